@@ -0,0 +1,189 @@
+"""Synthetic data for benchmarks: a social graph shaped like the real one, only bigger.
+
+    python benchmarks/datagen.py DIR [--users 2000] [--labs 40] [--follow-degree 20] [--posts 10000] ...
+    FLASK_APP=iiit_research flask init-db && flask import-data DIR && flask rebuild-timelines ...
+
+Writes one JSONL file per table in the format of `flask export-data` / `flask import-data` (see bulk.py).
+The same seed always gives the same data (dated relative to today), so numbers from different commits are
+comparable.
+
+* Users: 10% professors; 80% of students have a professor, and each professor runs a lab with their students.
+* Follows: each user's out-degree is Pareto distributed around --follow-degree (heavier tail for a lower
+  --follow-alpha) and followees are picked in proportion to a Pareto "popularity", so a few users and labs
+  have most of the followers. About 10% of follows are of labs.
+* Posts: mostly written by a few very active users (activity is drawn independently of popularity), 10% by
+  labs, spread over the last --days days.
+* Likes: per post, Pareto distributed around --likes-per-post, capped at the number of users.
+"""
+import argparse
+import json
+import os
+import random
+import sys
+from bisect import bisect_left
+from datetime import datetime, timedelta
+from itertools import accumulate
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+INTERESTS = ['Machine Learning', 'Computer Vision', 'NLP', 'Robotics', 'Databases', 'Networks', 'Security',
+             'Compilers', 'Graphics', 'Theory', 'Systems', 'HCI', 'Data Analytics', 'Web Development',
+             'Blockchain', 'Bioinformatics', 'Signal Processing', 'VLSI', 'Quantum Computing', 'IoT']
+WORDS = ('graph learning model data network neural system paper result dataset robot vision language query '
+         'index cache latency throughput kernel compiler proof theorem sensor protocol secure privacy energy '
+         'cloud edge stream parallel distributed benchmark survey workshop seminar deadline lab project').split()
+FIRST = ['Aarav', 'Vivaan', 'Aditya', 'Ananya', 'Diya', 'Ishaan', 'Kavya', 'Meera', 'Rohan', 'Saanvi', 'Arjun',
+         'Nisha', 'Rahul', 'Priya', 'Karan', 'Sneha', 'Vikram', 'Pooja', 'Nikhil', 'Riya']
+LAST = ['Sharma', 'Verma', 'Reddy', 'Iyer', 'Gupta', 'Nair', 'Rao', 'Das', 'Singh', 'Mehta']
+
+
+def _pareto(rng, mean, alpha, cap):
+    """A Pareto distributed int with the given mean (alpha > 1), at most `cap`."""
+    scale = mean * (alpha - 1) / alpha
+    return min(cap, int(rng.paretovariate(alpha) * scale))
+
+
+class _Weighted:
+    """Draws ids in proportion to their weights, without replacement within one `sample()` call."""
+
+    def __init__(self, rng, ids, weights):
+        self.rng, self.ids = rng, ids
+        self.cumulative = list(accumulate(weights))
+
+    def sample(self, k, exclude=()):
+        k = min(k, len(self.ids) - len(exclude))
+        chosen = set()
+        while len(chosen) < k:
+            i = bisect_left(self.cumulative, self.rng.random() * self.cumulative[-1])
+            if self.ids[i] not in exclude:
+                chosen.add(self.ids[i])
+        return chosen
+
+
+def _text(rng, words):
+    return ' '.join(rng.choice(WORDS) for _ in range(words))
+
+
+def generate(users=2000, labs=40, follow_degree=20, follow_alpha=2.0, posts=10000, likes_per_post=5,
+             days=365, seed=1):
+    """{table name: [row dict, ...]} for every table that `flask import-data` loads."""
+    rng = random.Random(seed)
+    # relative to today, so time windows (trending this week, recommended recent posts) see the new posts
+    now = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+    tables = {}
+
+    tables['interest'] = [{'id': i, 'name': name} for i, name in enumerate(INTERESTS, 1)]
+
+    user_ids = list(range(1, users + 1))
+    professors = user_ids[:max(1, users // 10)]
+    rows = []
+    for user_id in user_ids:
+        is_prof = user_id <= len(professors)
+        name = f'{rng.choice(FIRST)} {rng.choice(LAST)}'
+        rows.append({'id': user_id, 'name': name, 'username': f'user{user_id}',
+                     'email': f'user{user_id}@example.com', 'password': 'x', 'about_me': _text(rng, 12),
+                     'email_verify': True, 'user_type': 'professor' if is_prof else 'student',
+                     'prof_id': None if is_prof or rng.random() < 0.2 else rng.choice(professors)})
+    tables['user'] = rows
+
+    interest_weights = _Weighted(rng, [i['id'] for i in tables['interest']],
+                                 [1 / rank for rank in range(1, len(INTERESTS) + 1)])
+    tables['user_interests'] = [{'user_id': user_id, 'interest_id': interest_id} for user_id in user_ids
+                                for interest_id in sorted(interest_weights.sample(rng.randint(1, 4)))]
+
+    lab_ids = list(range(1, labs + 1))
+    tables['lab'] = [{'id': lab_id, 'name': f'{rng.choice(INTERESTS)} Lab {lab_id}', 'image': 'default.jpg',
+                      'description': _text(rng, 30)} for lab_id in lab_ids]
+    # every professor runs a lab and their students are members of it
+    lab_of = {prof: lab_ids[i % labs] for i, prof in enumerate(professors)}
+    members = {(lab_of[prof], prof) for prof in professors}
+    members |= {(lab_of[row['prof_id']], row['id']) for row in rows if row['prof_id']}
+    tables['lab_members'] = [{'lab_id': lab_id, 'user_id': user_id} for lab_id, user_id in sorted(members)]
+
+    popular_users = _Weighted(rng, user_ids, [rng.paretovariate(follow_alpha) for _ in user_ids])
+    popular_labs = _Weighted(rng, lab_ids, [rng.paretovariate(follow_alpha) for _ in lab_ids])
+    follows = []
+    for user_id in user_ids:
+        degree = _pareto(rng, follow_degree, follow_alpha, users - 1)
+        lab_degree = min(labs, sum(1 for _ in range(degree) if rng.random() < 0.1))
+        follows += [(user_id, followee, 'user')
+                    for followee in sorted(popular_users.sample(degree - lab_degree, exclude={user_id}))]
+        follows += [(user_id, lab_id, 'lab') for lab_id in sorted(popular_labs.sample(lab_degree))]
+    tables['subscription'] = [{'id': i, 'follower': follower, 'followee': followee, 'followee_type': kind}
+                              for i, (follower, followee, kind) in enumerate(follows, 1)]
+
+    active_users = _Weighted(rng, user_ids, [rng.paretovariate(follow_alpha) for _ in user_ids])
+    rows = []
+    for post_id in range(1, posts + 1):
+        created_at = now - timedelta(seconds=rng.randrange(days * 86400))
+        row = {'id': post_id, 'title': _text(rng, 5).capitalize(), 'content': _text(rng, 60), 'file': None,
+               'created_at': created_at.isoformat(), 'like_count': 0}
+        if rng.random() < 0.1:
+            row.update(author_type='lab', author_id=None, lab_id=popular_labs.sample(1).pop())
+        else:
+            row.update(author_type='user', author_id=active_users.sample(1).pop(), lab_id=None)
+        rows.append(row)
+    tables['post'] = rows
+
+    likes = []
+    for post in rows:
+        likers = rng.sample(user_ids, _pareto(rng, likes_per_post, follow_alpha, users))
+        post['like_count'] = len(likers)
+        likes += [(post['id'], user_id) for user_id in sorted(likers)]
+    tables['like'] = [{'id': i, 'post_id': post_id, 'user_id': user_id}
+                      for i, (post_id, user_id) in enumerate(likes, 1)]
+    return tables
+
+
+def write(tables, directory):
+    os.makedirs(directory, exist_ok=True)
+    for name, rows in tables.items():
+        with open(os.path.join(directory, f'{name}.jsonl'), 'w') as f:
+            for row in rows:
+                f.write(json.dumps(row) + '\n')
+
+
+def load(directory):
+    """Load files written by `write()` into the app's database, then build the derived tables."""
+    sys.path.insert(0, ROOT)
+    from iiit_research import bulk, fulltext, migrations, timeline, trends
+    migrations.upgrade()
+    for name, path in bulk.files_in(directory, 'jsonl'):
+        with open(path) as f:
+            bulk.import_table(name, f)
+    timeline.rebuild_all()
+    fulltext.rebuild()
+    trends.reconcile()
+
+
+def add_arguments(parser):
+    parser.add_argument('--users', type=int, default=2000)
+    parser.add_argument('--labs', type=int, default=40)
+    parser.add_argument('--follow-degree', type=float, default=20, help='mean number of follows per user')
+    parser.add_argument('--follow-alpha', type=float, default=2.0,
+                        help='Pareto shape of follow degree and popularity (lower = more skewed)')
+    parser.add_argument('--posts', type=int, default=10000)
+    parser.add_argument('--likes-per-post', type=float, default=5)
+    parser.add_argument('--days', type=int, default=365, help='posts are spread over this many days')
+    parser.add_argument('--seed', type=int, default=1)
+
+
+def options(args):
+    return {'users': args.users, 'labs': args.labs, 'follow_degree': args.follow_degree,
+            'follow_alpha': args.follow_alpha, 'posts': args.posts, 'likes_per_post': args.likes_per_post,
+            'days': args.days, 'seed': args.seed}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('directory')
+    add_arguments(parser)
+    args = parser.parse_args()
+    tables = generate(**options(args))
+    write(tables, args.directory)
+    for name, rows in tables.items():
+        print(f'{name}: {len(rows)} rows')
+
+
+if __name__ == '__main__':
+    main()
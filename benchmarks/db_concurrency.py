@@ -0,0 +1,168 @@
+"""Concurrent load test for the SQLite settings in database.py.
+
+    python benchmarks/db_concurrency.py [--processes 4] [--threads 4] [--requests 60] [--export-seconds 1] [--mode both]
+
+Runs the app in several worker processes (like gunicorn workers), each with several threads, against a
+scratch database. Every thread logs in as its own user and mixes page views (/posts/<id>, /user/<name>,
+/trending) with like/unlike and follow/unfollow clicks (--writes of them). With --export-seconds another
+process keeps long read transactions open, as a backup or `flask export` would.
+
+It is run once with the tuned settings (WAL, synchronous=NORMAL, busy timeout, mmap) and once with SQLite's
+defaults (rollback journal, synchronous=FULL), and prints throughput, latency and the number of
+"database is locked" failures.
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+MODES = {
+    'tuned': {},
+    'default': {'SQLITE_JOURNAL_MODE': 'DELETE', 'SQLITE_SYNCHRONOUS': 'FULL', 'SQLITE_MMAP_SIZE': '0'},
+}
+
+
+def _import_app():
+    sys.path.insert(0, ROOT)
+    import iiit_research
+    iiit_research.app.config['PROPAGATE_EXCEPTIONS'] = True
+    return iiit_research
+
+
+def setup(users, posts):
+    pkg = _import_app()
+    from iiit_research.models import User, Post
+    with pkg.app.app_context():
+        pkg.db.create_all()
+        pkg.fulltext.create_index()
+        pkg.db.session.add_all(User(name=f'user {i}', username=f'user{i}', email=f'user{i}@example.com',
+                                    password='x') for i in range(users))
+        pkg.db.session.commit()
+        pkg.db.session.add_all(Post(title=f'post {i}', content='...', author_id=i % users + 1, author_type='user')
+                               for i in range(posts))
+        pkg.db.session.commit()
+
+
+def worker(first_user, threads, requests, users, posts, writes, ready, go, queue):
+    import threading
+    pkg = _import_app()
+    results = []
+
+    def run(user_id):
+        client = pkg.app.test_client()
+        with client.session_transaction() as session:
+            session['_user_id'] = str(user_id)
+            session['_fresh'] = True
+        liked, followed = set(), set()
+        for _ in range(requests):
+            roll = random.random()
+            if roll < writes * 2 / 3:
+                post_id = random.randint(1, posts)
+                action = 'unlike' if post_id in liked else 'like'
+                liked.symmetric_difference_update({post_id})
+                url = f'/like/{post_id}/{action}'
+            elif roll < writes:
+                followee = random.choice([u for u in range(1, users + 1) if u != user_id])
+                action = 'unfollow' if followee in followed else 'follow'
+                followed.symmetric_difference_update({followee})
+                url = f'/follow_action/{followee}/{action}/user'
+            elif roll < writes + (1 - writes) / 2:
+                url = f'/posts/{random.randint(1, posts)}'
+            elif roll < 1 - (1 - writes) / 5:
+                url = f'/user/user{random.randint(0, users - 1)}'
+            else:
+                url = '/trending'
+            started = time.perf_counter()
+            try:
+                status = client.get(url, headers={'Referer': '/posts'}).status_code
+                error = None if status < 500 else f'HTTP {status}'
+            except Exception as e:
+                error = 'database is locked' if 'database is locked' in str(e) else type(e).__name__
+            results.append((time.perf_counter() - started, error))
+
+    pool = [threading.Thread(target=run, args=(first_user + i,)) for i in range(threads)]
+    # start the clock only once every process has imported the app
+    ready.put(True)
+    go.wait()
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+    queue.put(results)
+
+
+def exporter(seconds, go, stop):
+    """Keeps a read transaction open for `seconds` at a time, like a backup or a bulk export would."""
+    conn = sqlite3.connect(os.environ['DATABASE_URL'][len('sqlite:///'):], isolation_level=None)
+    go.wait()
+    while not stop.is_set():
+        conn.execute('BEGIN')
+        conn.execute('SELECT * FROM post').fetchall()
+        stop.wait(seconds)
+        conn.execute('ROLLBACK')
+        time.sleep(0.05)
+
+
+def run_mode(mode, args):
+    workdir = tempfile.mkdtemp()
+    os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(workdir, 'load.db')
+    for key in ('SQLITE_JOURNAL_MODE', 'SQLITE_SYNCHRONOUS', 'SQLITE_MMAP_SIZE'):
+        os.environ.pop(key, None)
+    os.environ.update(MODES[mode])
+
+    ctx = multiprocessing.get_context('spawn')
+    users = args.processes * args.threads
+    process = ctx.Process(target=setup, args=(users, args.posts))
+    process.start()
+    process.join()
+
+    queue, ready, go = ctx.Queue(), ctx.Queue(), ctx.Event()
+    processes = [ctx.Process(target=worker, args=(1 + p * args.threads, args.threads, args.requests, users,
+                                                  args.posts, args.writes, ready, go, queue))
+                 for p in range(args.processes)]
+    stop = ctx.Event()
+    if args.export_seconds:
+        processes.append(ctx.Process(target=exporter, args=(args.export_seconds, go, stop)))
+    for process in processes:
+        process.start()
+    for _ in processes[:args.processes]:
+        ready.get()
+    started = time.perf_counter()
+    go.set()
+    results = [row for _ in range(args.processes) for row in queue.get()]
+    elapsed = time.perf_counter() - started
+    stop.set()
+    for process in processes:
+        process.join()
+
+    latencies = sorted(latency for latency, _ in results)
+    errors = [error for _, error in results if error]
+    locked = sum(1 for error in errors if error == 'database is locked')
+    p50, p95 = latencies[len(latencies) // 2], latencies[int(len(latencies) * .95)]
+    print(f'{mode:8} {len(results):6d} requests in {elapsed:6.2f}s  {len(results) / elapsed:7.0f} req/s  '
+          f'p50 {p50 * 1000:6.1f}ms  p95 {p95 * 1000:7.1f}ms  {locked} locked, {len(errors) - locked} other errors')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--processes', type=int, default=4)
+    parser.add_argument('--threads', type=int, default=4)
+    parser.add_argument('--requests', type=int, default=60, help='requests per thread')
+    parser.add_argument('--posts', type=int, default=20, help='fewer posts = hotter rows')
+    parser.add_argument('--writes', type=float, default=0.45, help='share of requests that like or follow')
+    parser.add_argument('--export-seconds', type=float, default=1,
+                        help='also run a reader that holds read transactions open this long')
+    parser.add_argument('--mode', choices=['both'] + list(MODES), default='both')
+    args = parser.parse_args()
+    for mode in MODES if args.mode == 'both' else [args.mode]:
+        run_mode(mode, args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,202 @@
+"""Load test for the hot routes on a synthetic data set.
+
+    python benchmarks/hot_routes.py [--requests 200] [--threads 1] [--routes home,trending] [--compare last]
+                                    [datagen options: --users 2000 --posts 10000 --follow-degree 20 ...]
+
+Generates a social graph with datagen.py into a scratch database, then requests /home, /trending, /search,
+/account, /user/<username> and /like/... (liking and unliking) through the Flask test client, as random
+users, in random order. Each route gets --requests requests after --warmup untimed ones per route.
+
+Prints p50/p95/p99 latency, throughput and SQL queries per request for every route, and saves the results
+with the current commit to instance/benchmarks/<time>-<commit>.json. `--compare last` (or a results file)
+prints the change against an earlier run; only compare runs made with the same options.
+"""
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime
+
+import datagen
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS = os.path.join(ROOT, 'instance', 'benchmarks')
+
+WORDS = ['graph', 'learning', 'network', 'robot', 'query', 'compiler', 'privacy', 'stream']
+SEARCHES = ['post', 'student', 'professor', 'lab', 'area_of_interest']
+
+
+def _routes(users, posts):
+    """name -> function(rng, user_id) giving the URL to request."""
+    liked = set()
+
+    def like(rng, user_id):
+        post_id = rng.randint(1, posts)
+        action = 'unlike' if (user_id, post_id) in liked else 'like'
+        liked.symmetric_difference_update({(user_id, post_id)})
+        return f'/like/{post_id}/{action}'
+
+    def search(rng, user_id):
+        kind = rng.choice(SEARCHES)
+        query = rng.choice(datagen.INTERESTS) if kind == 'area_of_interest' else rng.choice(WORDS)
+        return f'/search?search_for={kind}&query={query}'
+
+    return {
+        'home': lambda rng, user_id: '/home',
+        'trending': lambda rng, user_id: '/trending',
+        'search': search,
+        'account': lambda rng, user_id: '/account',
+        'profile': lambda rng, user_id: f'/user/user{rng.randint(1, users)}',
+        'like': like,
+    }
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+def commit():
+    def git(*args):
+        return subprocess.run(['git', *args], cwd=ROOT, capture_output=True, text=True).stdout.strip()
+    return git('rev-parse', '--short', 'HEAD') or 'unknown', bool(git('status', '--porcelain', '--untracked-files=no'))
+
+
+def run(args):
+    workdir = tempfile.mkdtemp()
+    os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(workdir, 'bench.db')
+    sys.path.insert(0, ROOT)
+    from sqlalchemy import event
+    from sqlalchemy.engine import Engine
+    from iiit_research import app
+
+    started = time.perf_counter()
+    datagen.write(datagen.generate(**datagen.options(args)), workdir)
+    with app.app_context():
+        datagen.load(workdir)
+    print(f'generated and loaded data in {time.perf_counter() - started:.1f}s', file=sys.stderr)
+
+    counter = threading.local()
+
+    @event.listens_for(Engine, 'before_cursor_execute')
+    def count(conn, cursor, statement, parameters, context, executemany):
+        counter.queries = getattr(counter, 'queries', 0) + 1
+
+    routes = _routes(args.users, args.posts)
+    names = args.routes.split(',') if args.routes else list(routes)
+    samples, failures = defaultdict(list), []
+
+    def worker(seed, plan, record):
+        rng = random.Random(seed)
+        client = app.test_client()
+        for name in plan:
+            user_id = rng.randint(1, args.users)
+            with client.session_transaction() as session:
+                session['_user_id'] = str(user_id)
+                session['_fresh'] = True
+            url = routes[name](rng, user_id)
+            counter.queries = 0
+            request_started = time.perf_counter()
+            status = client.get(url, headers={'Referer': '/home'}).status_code
+            elapsed = time.perf_counter() - request_started
+            if status >= 400:
+                failures.append(f'{url} returned {status}')
+            elif record:
+                samples[name].append((elapsed, counter.queries))
+
+    def plan(per_route):
+        plan = [name for name in names for _ in range(per_route)]
+        random.Random(args.seed).shuffle(plan)
+        return plan
+
+    worker(args.seed, plan(args.warmup), False)
+    timed = plan(args.requests)
+    threads = [threading.Thread(target=worker, args=(args.seed + i, timed[i::args.threads], True))
+               for i in range(args.threads)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    if failures:
+        raise SystemExit('\n'.join(failures[:10]))
+
+    results = {}
+    for name in names:
+        latencies = [latency for latency, _ in samples[name]]
+        results[name] = {
+            'requests': len(latencies),
+            'p50_ms': percentile(latencies, 50) * 1000,
+            'p95_ms': percentile(latencies, 95) * 1000,
+            'p99_ms': percentile(latencies, 99) * 1000,
+            'req_per_s': len(latencies) / sum(latencies) * args.threads,
+            'queries': sum(queries for _, queries in samples[name]) / len(latencies),
+        }
+    total = sum(len(rows) for rows in samples.values())
+    return results, total / elapsed
+
+
+def report(results, throughput, previous=None):
+    print(f'{"route":10} {"p50 ms":>8} {"p95 ms":>8} {"p99 ms":>8} {"req/s":>8} {"queries":>8}')
+    for name, row in results.items():
+        line = f'{name:10} {row["p50_ms"]:8.2f} {row["p95_ms"]:8.2f} {row["p99_ms"]:8.2f} ' \
+               f'{row["req_per_s"]:8.0f} {row["queries"]:8.1f}'
+        before = previous and previous['routes'].get(name)
+        if before:
+            line += f'   p50 {(row["p50_ms"] / before["p50_ms"] - 1) * 100:+5.0f}%' \
+                    f'  p95 {(row["p95_ms"] / before["p95_ms"] - 1) * 100:+5.0f}%' \
+                    f'  queries {row["queries"] - before["queries"]:+.1f}'
+        print(line)
+    line = f'overall: {throughput:.0f} req/s'
+    if previous:
+        line += f' ({(throughput / previous["throughput"] - 1) * 100:+.0f}% vs {previous["commit"]})'
+    print(line)
+
+
+def load_previous(compare):
+    if compare != 'last':
+        with open(compare) as f:
+            return json.load(f)
+    files = sorted(os.listdir(RESULTS)) if os.path.isdir(RESULTS) else []
+    if not files:
+        return None
+    with open(os.path.join(RESULTS, files[-1])) as f:
+        return json.load(f)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--requests', type=int, default=200, help='timed requests per route')
+    parser.add_argument('--warmup', type=int, default=20, help='untimed requests per route first')
+    parser.add_argument('--threads', type=int, default=1)
+    parser.add_argument('--routes', help='comma separated subset of: home, trending, search, account, profile, like')
+    parser.add_argument('--compare', help="results file to compare with, or 'last'")
+    parser.add_argument('--no-save', action='store_true', help="don't save the results")
+    datagen.add_arguments(parser)
+    args = parser.parse_args()
+
+    previous = load_previous(args.compare) if args.compare else None
+    results, throughput = run(args)
+    revision, dirty = commit()
+    report(results, throughput, previous)
+
+    if not args.no_save:
+        os.makedirs(RESULTS, exist_ok=True)
+        stamp = datetime.now().strftime('%Y%m%d-%H%M%S')
+        path = os.path.join(RESULTS, f'{stamp}-{revision}{"-dirty" if dirty else ""}.json')
+        with open(path, 'w') as f:
+            json.dump({'commit': revision, 'dirty': dirty, 'date': stamp, 'threads': args.threads,
+                       'requests': args.requests, 'data': datagen.options(args), 'routes': results,
+                       'throughput': throughput}, f, indent=2)
+        print(f'saved {os.path.relpath(path, ROOT)}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+"""Concurrency harness for the like path.
+
+    python benchmarks/like_concurrency.py [--threads 8] [--requests 2000] [--write-behind]
+
+Hammers /like/<post_id>/like and /like/<post_id>/unlike from many threads and users against a scratch
+database and then checks that every post's like_count equals its number of `like` rows. Exits non-zero on
+any mismatch. Requests that fail (e.g. "database is locked") are reported but are not a correctness failure
+as long as they left no partial write behind.
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from iiit_research import app, db, fulltext, likebuffer  # noqa: E402
+from iiit_research.models import User, Post, Like  # noqa: E402
+
+
+def setup(users, posts):
+    db.create_all()
+    fulltext.create_index()
+    db.session.add_all(User(name=f'user {i}', username=f'user{i}', email=f'user{i}@example.com', password='x')
+                       for i in range(users))
+    db.session.commit()
+    db.session.add_all(Post(title=f'post {i}', content='...', author_id=1, like_count=0) for i in range(posts))
+    db.session.commit()
+    return [u.id for u in User.query], [p.id for p in Post.query]
+
+
+def worker(user_ids, post_ids, requests, results):
+    client = app.test_client()
+    user_id = random.choice(user_ids)
+    with client.session_transaction() as session:
+        session['_user_id'] = str(user_id)
+        session['_fresh'] = True
+    for _ in range(requests):
+        action = random.choice(['like', 'like', 'unlike'])
+        response = client.get(f'/like/{random.choice(post_ids)}/{action}', headers={'Referer': '/posts'})
+        results.append(response.status_code)
+
+
+def check():
+    mismatches = []
+    for post in Post.query:
+        actual = Like.query.filter_by(post_id=post.id).count()
+        if post.like_count != actual:
+            mismatches.append((post.id, post.like_count, actual))
+    return mismatches
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--requests', type=int, default=2000, help='total requests across all threads')
+    parser.add_argument('--posts', type=int, default=3, help='few posts = hot posts = more contention')
+    parser.add_argument('--write-behind', action='store_true', help='enable LIKE_WRITE_BEHIND')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp()
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + os.path.join(workdir, 'likes.db')
+    app.config['LIKE_WRITE_BEHIND'] = args.write_behind
+    app.config['LIKE_FLUSH_INTERVAL'] = 0.2
+
+    with app.app_context():
+        user_ids, post_ids = setup(users=args.threads, posts=args.posts)
+
+    results = []
+    per_thread = args.requests // args.threads
+    threads = [threading.Thread(target=worker, args=(user_ids[i:i + 1], post_ids, per_thread, results))
+               for i in range(args.threads)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if likebuffer.get_buffer() is not None:
+        likebuffer.get_buffer().flush()
+    elapsed = time.perf_counter() - started
+
+    with app.app_context():
+        mismatches = check()
+    failed = sum(1 for status in results if status >= 500)
+    print(f'{len(results)} requests in {elapsed:.2f}s ({len(results) / elapsed:.0f} req/s), {failed} failed')
+    for post_id, count, actual in mismatches:
+        print(f'post {post_id}: like_count={count} but {actual} like rows')
+    print('OK' if not mismatches else 'MISMATCH')
+    return 1 if mismatches else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
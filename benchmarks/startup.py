@@ -0,0 +1,130 @@
+"""Worker start-up benchmark: how long a new worker takes to import the app and serve its first requests.
+
+    python benchmarks/startup.py [--runs 5] [--urls /home,/posts,/user/user1,/labs/1,/trending]
+                                 [datagen options, smaller by default: --users 500 --posts 2000 ...]
+
+Loads a synthetic data set (datagen.py) into a scratch database, then starts --runs workers in each of three
+ways and times the import of the app and the first request to each URL, as a logged in user:
+
+* cold: a fresh process with the template bytecode cache turned off;
+* bytecode: a fresh process reading the templates from a filled bytecode cache (`flask build-templates`);
+* preforked: a child forked from a process that imported the app and ran `warmup.preload(data=True)`, as
+  under gunicorn --preload. It has nothing left to import.
+
+Prints the median of every timing per mode. POSIX only (uses fork).
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import datagen
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+URLS = '/home,/posts,/user/user1,/labs/1,/trending'
+
+
+def first_requests(app, urls):
+    """{url: seconds} for the first request to each of `urls`."""
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['_user_id'] = '1'
+        session['_fresh'] = True
+    timings = {}
+    for url in urls:
+        started = time.perf_counter()
+        status = client.get(url).status_code
+        timings[url] = time.perf_counter() - started
+        if status >= 400:
+            raise SystemExit(f'{url} returned {status}')
+    return timings
+
+
+def worker(urls):
+    """Timings of a fresh worker process: the app import, then the first requests."""
+    started = time.perf_counter()
+    sys.path.insert(0, ROOT)
+    from iiit_research import app
+    imported = time.perf_counter() - started
+    return dict(first_requests(app, urls), **{'import': imported})
+
+
+def spawn(urls, bytecode_cache):
+    env = dict(os.environ, TEMPLATE_BYTECODE_CACHE=bytecode_cache)
+    output = subprocess.run([sys.executable, os.path.abspath(__file__), '--worker', '--urls', ','.join(urls)],
+                            env=env, capture_output=True, text=True, check=True).stdout
+    return json.loads(output)
+
+
+def fork(app, urls):
+    read, write = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(read)
+        code = 1
+        try:
+            timings = dict(first_requests(app, urls), **{'import': 0.0})
+            os.write(write, json.dumps(timings).encode())
+            code = 0
+        finally:
+            os._exit(code)
+    os.close(write)
+    with os.fdopen(read) as f:
+        output = f.read()
+    _, status = os.waitpid(pid, 0)
+    if status != 0:
+        raise SystemExit('forked worker failed')
+    return json.loads(output)
+
+
+def run(args):
+    urls = args.urls.split(',')
+    workdir = tempfile.mkdtemp()
+    cache = os.path.join(workdir, 'template-cache')
+    os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(workdir, 'bench.db')
+    os.environ['TEMPLATE_BYTECODE_CACHE'] = cache
+    sys.path.insert(0, ROOT)
+    from iiit_research import app, warmup
+
+    datagen.write(datagen.generate(**datagen.options(args)), workdir)
+    with app.app_context():
+        datagen.load(workdir)
+    warmup.compile_templates()
+
+    results = {'cold': [spawn(urls, '') for _ in range(args.runs)],
+               'bytecode': [spawn(urls, cache) for _ in range(args.runs)]}
+    steps = warmup.preload(data=True)
+    results['preforked'] = [fork(app, urls) for _ in range(args.runs)]
+    return urls, results, steps
+
+
+def report(urls, results, steps):
+    columns = ['import'] + urls
+    print(f'{"ms (median)":12}' + ''.join(f'{column[:14]:>15}' for column in columns) + f'{"total":>10}')
+    for mode, runs in results.items():
+        medians = [statistics.median(run[column] for run in runs) * 1000 for column in columns]
+        print(f'{mode:12}' + ''.join(f'{value:15.1f}' for value in medians) + f'{sum(medians):10.1f}')
+    print('preload in the master: ' + ', '.join(f'{step} {seconds * 1000:.0f} ms' for step, seconds in steps.items()))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--runs', type=int, default=5, help='workers started per mode')
+    parser.add_argument('--urls', default=URLS, help='comma separated URLs requested by every worker')
+    parser.add_argument('--worker', action='store_true', help=argparse.SUPPRESS)
+    datagen.add_arguments(parser)
+    parser.set_defaults(users=500, posts=2000)
+    args = parser.parse_args()
+
+    if args.worker:
+        print(json.dumps(worker(args.urls.split(','))))
+        return
+    report(*run(args))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,149 @@
+"""Throughput of the preforked production server against `flask run`.
+
+    python benchmarks/throughput.py [--duration 10] [--clients 8] [--workers 4] [--threads 4]
+                                    [--modes flask-run,prefork]
+                                    [datagen options, smaller by default: --users 500 --posts 2000 ...]
+
+Loads a synthetic data set (datagen.py) into a scratch database and starts the app on a free local port in
+each mode:
+
+* flask-run: the development server as script.sh runs it, one process with a thread per request;
+* prefork: `python -m iiit_research.server` with --workers processes of --threads threads and the caches
+  shared on tmpfs.
+
+--clients client processes then request /home, /posts, /trending, /user/<username> and /labs/<id> over HTTP as
+random logged in users, untimed for --warmup seconds and timed for --duration seconds. Prints requests per
+second, p50/p95/p99 latency and failed requests per mode. The clients run on the same machine as the server,
+so compare modes from the same run only.
+"""
+import argparse
+import http.client
+import multiprocessing
+import os
+import random
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import datagen
+from hot_routes import percentile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MODES = ['flask-run', 'prefork']
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def _command(mode, port, args):
+    if mode == 'flask-run':
+        return [sys.executable, '-m', 'flask', 'run', '--port', str(port)]
+    return [sys.executable, '-m', 'iiit_research.server', '--bind', f'127.0.0.1:{port}',
+            '--workers', str(args.workers), '--threads', str(args.threads)]
+
+
+def _wait_until_up(port, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            connection = http.client.HTTPConnection('127.0.0.1', port, timeout=5)
+            connection.request('GET', '/login')
+            if connection.getresponse().status == 200:
+                return
+        except OSError:
+            time.sleep(0.2)
+    raise SystemExit(f'server on port {port} did not start')
+
+
+def client(port, cookies, users, labs, warmup, duration, seed):
+    """Request random pages until the deadline. Returns (latencies, failures) of the timed part."""
+    rng = random.Random(seed)
+    urls = [lambda: '/home', lambda: '/posts', lambda: '/trending',
+            lambda: f'/user/user{rng.randint(1, users)}', lambda: f'/labs/{rng.randint(1, labs)}']
+    latencies, failures = [], 0
+    timed_from = time.monotonic() + warmup
+    deadline = timed_from + duration
+    while True:
+        now = time.monotonic()
+        if now >= deadline:
+            return latencies, failures
+        url = rng.choice(urls)()
+        started = time.perf_counter()
+        try:
+            connection = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+            connection.request('GET', url, headers={'Cookie': rng.choice(cookies)})
+            response = connection.getresponse()
+            response.read()
+            connection.close()
+            ok = response.status == 200
+        except OSError:
+            ok = False
+        if now >= timed_from:
+            latencies.append(time.perf_counter() - started)
+            failures += not ok
+
+
+def measure(mode, args, env, cookies, workdir):
+    port = _free_port()
+    with open(os.path.join(workdir, f'{mode}.log'), 'w') as log:
+        server = subprocess.Popen(_command(mode, port, args), cwd=ROOT, env=env, stdout=log, stderr=log)
+    try:
+        _wait_until_up(port)
+        with multiprocessing.get_context('fork').Pool(args.clients) as pool:
+            runs = pool.starmap(client, [(port, cookies, args.users, args.labs, args.warmup, args.duration, i)
+                                         for i in range(args.clients)])
+    finally:
+        server.send_signal(signal.SIGTERM)
+        server.wait(30)
+    latencies = [latency for run, _ in runs for latency in run]
+    return {'req_per_s': len(latencies) / args.duration, 'p50_ms': percentile(latencies, 50) * 1000,
+            'p95_ms': percentile(latencies, 95) * 1000, 'p99_ms': percentile(latencies, 99) * 1000,
+            'failed': sum(failures for _, failures in runs)}
+
+
+def run(args):
+    workdir = tempfile.mkdtemp()
+    os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(workdir, 'bench.db')
+    env = dict(os.environ, FLASK_APP='iiit_research', TEMPLATE_BYTECODE_CACHE=os.path.join(workdir, 'template-cache'))
+    env.pop('FLASK_ENV', None)
+    sys.path.insert(0, ROOT)
+    from iiit_research import app
+
+    datagen.write(datagen.generate(**datagen.options(args)), workdir)
+    with app.app_context():
+        datagen.load(workdir)
+    serializer = app.session_interface.get_signing_serializer(app)
+    cookies = ['session=' + serializer.dumps({'_user_id': str(user_id), '_fresh': True})
+               for user_id in range(1, args.users + 1)]
+    print(f'{args.clients} clients, {args.duration:.0f}s per mode, server logs in {workdir}', file=sys.stderr)
+    return {mode: measure(mode, args, env, cookies, workdir) for mode in args.modes.split(',')}
+
+
+def report(results):
+    print(f'{"mode":10} {"req/s":>8} {"p50 ms":>8} {"p95 ms":>8} {"p99 ms":>8} {"failed":>8}')
+    for mode, row in results.items():
+        print(f'{mode:10} {row["req_per_s"]:8.1f} {row["p50_ms"]:8.1f} {row["p95_ms"]:8.1f} {row["p99_ms"]:8.1f} '
+              f'{row["failed"]:8d}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--duration', type=float, default=10, help='timed seconds per mode')
+    parser.add_argument('--warmup', type=float, default=2, help='untimed seconds per mode')
+    parser.add_argument('--clients', type=int, default=8, help='concurrent client processes')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='prefork worker processes')
+    parser.add_argument('--threads', type=int, default=4, help='threads per prefork worker')
+    parser.add_argument('--modes', default=','.join(MODES))
+    datagen.add_arguments(parser)
+    parser.set_defaults(users=500, posts=2000)
+    report(run(parser.parse_args()))
+
+
+if __name__ == '__main__':
+    main()
@@ -5,21 +5,27 @@ from flask_bcrypt import Bcrypt
 from flask_login import LoginManager
 from flask_mail import Mail
 
+from iiit_research import database
+
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'd9cbc4d94184198d5adc127407daf4c4'
 
 app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///site.db'
+app.config['MAIL_SERVER'] = os.environ.get('MAIL_SERVER', 'smtp.googlemail.com')
+app.config['MAIL_PORT'] = int(os.environ.get('MAIL_PORT', 587))
+app.config['MAIL_USE_TLS'] = os.environ.get('MAIL_USE_TLS', '1') == '1'
+app.config['MAIL_USERNAME'] = os.environ.get('EMAIL_USER')
+app.config['MAIL_PASSWORD'] = os.environ.get('EMAIL_PASS')
+# per-deployment settings (CACHE_BACKEND, LIKE_WRITE_BEHIND, ...): a Python file of KEY = value lines
+app.config.from_envvar('IIIT_RESEARCH_SETTINGS', silent=True)
+database.configure(app)  # DATABASE_URL, SQLite pragmas and pool settings, see database.py
 db = SQLAlchemy(app)
 
 bcrypt = Bcrypt(app)
 login_manager = LoginManager(app)
 login_manager.login_view = 'login'
 login_manager.login_message_category = 'info'
-app.config['MAIL_SERVER'] = 'smtp.googlemail.com'
-app.config['MAIL_PORT'] = 587
-app.config['MAIL_USE_TLS'] = True
-app.config['MAIL_USERNAME'] = os.environ.get('EMAIL_USER')
-app.config['MAIL_PASSWORD'] = os.environ.get('EMAIL_PASS')
 mail = Mail(app)
 
-from iiit_research import routes
+# imported for their side effects: views, CLI commands and the static file hooks
+from iiit_research import routes, commands, metrics, api, warmup, assets  # noqa: F401
@@ -0,0 +1,55 @@
+"""Follows, likes and approvals applied in bulk, for the JSON API (api.py) and the plain link routes.
+
+Each function takes the wanted end state per target, e.g. {post_id: True} to like and {post_id: False} to
+unlike, changes only what differs from the current state, with one statement per kind of change, and leaves
+the commit to the caller, so a whole batch goes into one transaction.
+"""
+from iiit_research import db, likebuffer, socialgraph, timeline, trends
+from iiit_research.models import User, Subscription, PendingApproval
+
+
+def follow(user_id, wanted):
+    """`wanted` maps (followee id, 'user' or 'lab') to True (follow) or False (unfollow).
+    Returns the pairs that changed."""
+    graph = socialgraph.get(fresh=True)
+    added = [(id_, kind) for (id_, kind), on in wanted.items() if on and not graph.is_following(user_id, id_, kind)]
+    removed = [(id_, kind) for (id_, kind), on in wanted.items() if not on and graph.is_following(user_id, id_, kind)]
+
+    db.session.add_all(Subscription(follower=user_id, followee=id_, followee_type=kind) for id_, kind in added)
+    for kind in socialgraph.KINDS:
+        ids = [id_ for id_, k in removed if k == kind]
+        if ids:
+            for row in Subscription.query.filter(Subscription.follower == user_id, Subscription.followee_type == kind,
+                                                 Subscription.followee.in_(ids)):
+                db.session.delete(row)
+
+    for id_, kind in added:
+        timeline.on_follow(user_id, id_, kind)
+        trends.on_follow(id_, kind, 1)
+    for id_, kind in removed:
+        timeline.on_unfollow(user_id, id_, kind)
+        trends.on_follow(id_, kind, -1)
+    return added + removed
+
+
+def like(user_id, wanted):
+    """`wanted` maps post ids to True (like) or False (unlike). Returns {post_id: like_count}."""
+    buffer = likebuffer.get_buffer()
+    if buffer is not None:
+        # applied here and now, so a queued click on the same post must not undo it later
+        buffer.discard((user_id, post_id) for post_id in wanted)
+    return likebuffer.apply_likes({(user_id, post_id): on for post_id, on in wanted.items()})
+
+
+def approve(prof_id, wanted):
+    """`wanted` maps student ids to True (accept) or False (decline) for the professor's pending requests.
+    Returns the ids of the students that were accepted and of those whose request was handled."""
+    requests = PendingApproval.query.filter(PendingApproval.prof_id == prof_id,
+                                            PendingApproval.student_id.in_(list(wanted))).all()
+    accepted = [row.student_id for row in requests if wanted[row.student_id]]
+    if accepted:
+        for user in User.query.filter(User.id.in_(accepted)):
+            user.prof_id = prof_id
+    for row in requests:
+        db.session.delete(row)
+    return accepted, [row.student_id for row in requests]
@@ -0,0 +1,98 @@
+"""Index advisor: runs `EXPLAIN QUERY PLAN` over the queries the routes issue and flags full table scans.
+
+Every side-effect free GET route is requested through the test client as a real user while the SQL it
+issues is captured; each distinct statement is then explained against the same database. A statement is
+flagged when it has a WHERE/JOIN condition but SQLite still plans a plain `SCAN` of a table for it. Run it
+with `flask explain-queries`, which exits non-zero when anything is flagged, so index coverage can't
+silently regress.
+"""
+import re
+from collections import OrderedDict
+
+from flask import url_for
+from sqlalchemy import event
+
+from iiit_research import app, db
+from iiit_research.models import User, Post, Lab
+
+# endpoints that write, log out or need a secret token
+SKIP_ENDPOINTS = {'static', 'logout', 'follow_action', 'approve_request', 'like_action', 'verify_email',
+                  'reset_token', 'login', 'register', 'reset_request'}
+
+# extra query strings worth exercising on top of the bare URL
+EXTRA_QUERIES = {'search': ['search_for=student&query=a', 'search_for=lab&query=a', 'search_for=post&query=a',
+                            'search_for=area_of_interest&query=a']}
+
+_SCAN = re.compile(r'^SCAN (?:TABLE )?(\w+)')
+
+
+def _sample_args(user):
+    post = Post.query.order_by(Post.id).first()
+    lab = Lab.query.order_by(Lab.id).first()
+    return {'username': user.username, 'post_id': post.id if post else 1, 'lab_id': lab.id if lab else 1}
+
+
+def sample_urls(user):
+    """One URL per side-effect free GET route, with sample values for its arguments."""
+    args = _sample_args(user)
+    urls = []
+    with app.test_request_context():
+        for rule in sorted(app.url_map.iter_rules(), key=lambda r: r.rule):
+            if rule.endpoint in SKIP_ENDPOINTS or 'GET' not in rule.methods:
+                continue
+            url = url_for(rule.endpoint, **{name: args[name] for name in rule.arguments})
+            urls.append(url)
+            urls.extend(f'{url}?{query}' for query in EXTRA_QUERIES.get(rule.endpoint, []))
+    return list(OrderedDict.fromkeys(urls))
+
+
+def capture(urls, user):
+    """Request `urls` as `user`, returning {statement: (parameters, url)} for everything that was run."""
+    statements = OrderedDict()
+    current_url = [None]
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        if not executemany and statement.lstrip().upper().startswith('SELECT'):
+            statements.setdefault(statement, (parameters, current_url[0]))
+
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['_user_id'] = str(user.id)
+        session['_fresh'] = True
+
+    # cached fragments would hide the queries behind them
+    fragment_cache = app.config.get('FRAGMENT_CACHE_ENABLED', True)
+    app.config['FRAGMENT_CACHE_ENABLED'] = False
+    event.listen(db.engine, 'before_cursor_execute', record)
+    try:
+        for url in urls:
+            current_url[0] = url
+            client.get(url)
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', record)
+        app.config['FRAGMENT_CACHE_ENABLED'] = fragment_cache
+    return statements
+
+
+def full_scans(statement, parameters):
+    """Tables SQLite scans in full to answer `statement`."""
+    if not re.search(r'\b(WHERE|JOIN)\b', statement, re.IGNORECASE):
+        return []  # listing a whole table is a scan by design
+    plan = db.engine.execute('EXPLAIN QUERY PLAN ' + statement, parameters).fetchall()
+    scans = []
+    for row in plan:
+        detail = row[-1]
+        match = _SCAN.match(detail)
+        # scans of subquery results (anon_1, CONSTANT ROW, ...) aren't table scans
+        if match and match.group(1) in db.metadata.tables and 'USING' not in detail:
+            scans.append(match.group(1))
+    return scans
+
+
+def report(user=None):
+    """Yields (url, statement, scanned tables) for every flagged statement."""
+    user = user or User.query.order_by(User.id).first()
+    for statement, (parameters, url) in capture(sample_urls(user), user).items():
+        scans = full_scans(statement, parameters)
+        if scans:
+            yield url, statement, scans
@@ -0,0 +1,114 @@
+"""JSON API behind the follow, like and approve buttons (static/actions.js).
+
+    POST /api/v1/actions
+    {"actions": [{"action": "follow", "type": "user", "id": 4}, {"action": "like", "id": 12}, ...]}
+
+Actions are follow/unfollow (type "user" or "lab"), like/unlike (posts) and approve/decline (students asking
+the current professor). The whole batch is checked first and then applied in one transaction (see
+actions.py); a later action on the same target wins over an earlier one. The response has one result per
+action with the target's new state:
+
+    {"results": [{"action": "follow", "type": "user", "id": 4, "following": true, "followers": 12}, ...]}
+
+Only JSON bodies are accepted. A cross-site form can't send one, so the endpoint needs no CSRF token.
+"""
+from flask import jsonify, request
+from flask_login import current_user
+
+from iiit_research import app, db, actions, socialgraph, usercache
+from iiit_research.models import User, Lab, Post
+
+FOLLOW = {'follow': True, 'unfollow': False}
+LIKE = {'like': True, 'unlike': False}
+APPROVE = {'approve': True, 'decline': False}
+
+
+def _error(status, message, index=None):
+    body = {'error': message}
+    if index is not None:
+        body['index'] = index
+    return jsonify(body), status
+
+
+def _parse(body):
+    """[(action, type, id)] for a request body, or raise ValueError(message, index)."""
+    if not isinstance(body, dict) or not isinstance(body.get('actions'), list):
+        raise ValueError('expected {"actions": [...]}', None)
+    if len(body['actions']) > app.config.get('API_MAX_ACTIONS', 100):
+        raise ValueError('too many actions', None)
+    parsed = []
+    for i, entry in enumerate(body['actions']):
+        action = entry.get('action') if isinstance(entry, dict) else None
+        id_ = entry.get('id') if isinstance(entry, dict) else None
+        if action not in FOLLOW and action not in LIKE and action not in APPROVE:
+            raise ValueError('unknown action', i)
+        if not isinstance(id_, int) or isinstance(id_, bool):
+            raise ValueError('id must be an integer', i)
+        kind = entry.get('type', 'user') if action in FOLLOW else None
+        if action in FOLLOW and kind not in socialgraph.KINDS:
+            raise ValueError('type must be user or lab', i)
+        if action in FOLLOW and kind == 'user' and id_ == current_user.id:
+            raise ValueError("can't follow yourself", i)
+        parsed.append((action, kind, id_))
+    return parsed
+
+
+def _missing(parsed):
+    """Index of the first action whose user, lab or post doesn't exist, or None."""
+    targets = {'user': User.id, 'lab': Lab.id, 'post': Post.id}
+    wanted = {}
+    for action, kind, id_ in parsed:
+        if action in FOLLOW or action in LIKE:
+            wanted.setdefault(kind or 'post', set()).add(id_)
+    existing = {kind: {id_ for id_, in db.session.query(targets[kind]).filter(targets[kind].in_(list(ids)))}
+                for kind, ids in wanted.items()}
+    for i, (action, kind, id_) in enumerate(parsed):
+        if (action in FOLLOW or action in LIKE) and id_ not in existing[kind or 'post']:
+            return i
+    return None
+
+
+@app.route('/api/v1/actions', methods=['POST'])
+def api_actions():
+    if not current_user.is_authenticated:
+        return _error(401, 'login required')
+    if not request.is_json:
+        return _error(415, 'expected application/json')
+    try:
+        parsed = _parse(request.get_json(silent=True))
+    except ValueError as e:
+        return _error(400, *e.args)
+    missing = _missing(parsed)
+    if missing is not None:
+        return _error(404, 'not found', missing)
+
+    follows, likes, approvals = {}, {}, {}
+    for action, kind, id_ in parsed:
+        if action in FOLLOW:
+            follows[id_, kind] = FOLLOW[action]
+        elif action in LIKE:
+            likes[id_] = LIKE[action]
+        else:
+            approvals[id_] = APPROVE[action]
+
+    user_id = current_user.id
+    if follows:
+        actions.follow(user_id, follows)
+    like_counts = actions.like(user_id, likes) if likes else {}
+    accepted, handled = actions.approve(user_id, approvals) if approvals else ([], [])
+    db.session.commit()
+    for student_id in accepted:
+        usercache.invalidate(student_id)
+
+    graph = socialgraph.get()
+    results = []
+    for action, kind, id_ in parsed:
+        if action in FOLLOW:
+            results.append({'action': action, 'type': kind, 'id': id_, 'following': follows[id_, kind],
+                            'followers': graph.follower_count(id_, kind)})
+        elif action in LIKE:
+            results.append({'action': action, 'id': id_, 'liked': likes[id_], 'likes': like_counts.get(id_, 0)})
+        else:
+            results.append({'action': action, 'id': id_, 'approved': id_ in accepted,
+                            'handled': id_ in handled})
+    return jsonify({'results': results})
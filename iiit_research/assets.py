@@ -0,0 +1,168 @@
+"""Fingerprinted static files.
+
+`url_for('static', filename='main.css')` is rewritten to `/static/main.<hash>.css`, where the hash is taken
+from the file's content. Because the URL changes whenever the content does, fingerprinted URLs are served
+with a one year `immutable` Cache-Control and a browser never has to ask for them again. Plain URLs still
+work and are served with the default short cache.
+
+Every response is conditional (ETag / If-None-Match) and supports Range requests, so interrupted PDF
+downloads resume. `flask build-assets` writes the manifest of hashes (so the web process doesn't hash
+files on first use) and gzip/brotli copies of the text assets into the instance folder; those are sent to
+browsers that accept them. Brotli needs the optional `brotli` package.
+"""
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import re
+
+from flask import request, send_file, send_from_directory
+from werkzeug.exceptions import NotFound
+from werkzeug.security import safe_join
+
+from iiit_research import app
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+IMMUTABLE = 'public, max-age=31536000, immutable'
+TEXT_EXTENSIONS = {'.css', '.js', '.svg', '.json', '.txt', '.html'}
+HASH_LENGTH = 12
+ENCODINGS = [('br', '.br'), ('gzip', '.gz')]
+
+_FINGERPRINT = re.compile(r'^(?P<stem>.+)\.(?P<hash>[0-9a-f]{%d})(?P<ext>\.[^./]+)$' % HASH_LENGTH)
+
+_hashes = {}  # filename -> (mtime_ns, size, content hash)
+
+
+def _build_path(*parts):
+    return os.path.join(app.instance_path, 'assets', *parts)
+
+
+def _manifest_path():
+    return _build_path('manifest.json')
+
+
+def _load_manifest():
+    try:
+        with open(_manifest_path()) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return
+    _hashes.update((name, tuple(entry)) for name, entry in manifest.items())
+
+
+def _source(filename):
+    return safe_join(app.static_folder, filename)
+
+
+def content_hash(filename):
+    """Short content hash of static/<filename>, or None if there is no such file."""
+    path = _source(filename)
+    try:
+        stat = os.stat(path)
+    except (OSError, TypeError):
+        return None
+    cached = _hashes.get(filename)
+    if cached and cached[:2] == (stat.st_mtime_ns, stat.st_size):
+        return cached[2]
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(64 * 1024), b''):
+            sha.update(chunk)
+    digest = sha.hexdigest()[:HASH_LENGTH]
+    _hashes[filename] = (stat.st_mtime_ns, stat.st_size, digest)
+    return digest
+
+
+def fingerprinted(filename):
+    digest = content_hash(filename)
+    if digest is None:
+        return filename
+    stem, ext = os.path.splitext(filename)
+    return f'{stem}.{digest}{ext}'
+
+
+@app.url_defaults
+def fingerprint_static_urls(endpoint, values):
+    if endpoint == 'static' and 'filename' in values and app.config.get('ASSET_FINGERPRINTS', True):
+        values['filename'] = fingerprinted(values['filename'])
+
+
+def _precompressed(filename):
+    """(encoding, path) of an up to date compressed copy the client accepts, or None."""
+    if os.path.splitext(filename)[1] not in TEXT_EXTENSIONS:
+        return None
+    source_mtime = os.stat(_source(filename)).st_mtime_ns
+    for encoding, suffix in ENCODINGS:
+        if encoding not in request.accept_encodings:
+            continue
+        path = _build_path(filename + suffix)
+        if os.path.exists(path) and os.stat(path).st_mtime_ns >= source_mtime:
+            return encoding, path
+    return None
+
+
+def serve_static(filename):
+    match = _FINGERPRINT.match(filename)
+    immutable = False
+    if match and not os.path.isfile(_source(filename) or ''):
+        logical = match.group('stem') + match.group('ext')
+        if content_hash(logical) == match.group('hash'):
+            filename, immutable = logical, True
+        else:
+            # an old fingerprint: serve the current file, but don't let it be cached as that version
+            filename = logical
+    if not os.path.isfile(_source(filename) or ''):
+        raise NotFound()
+
+    cache_timeout = 31536000 if immutable else app.get_send_file_max_age(filename)
+    compressed = _precompressed(filename)
+    if compressed:
+        encoding, path = compressed
+        response = send_file(path, mimetype=mimetypes.guess_type(filename)[0], conditional=True,
+                             cache_timeout=cache_timeout)
+        response.headers['Content-Encoding'] = encoding
+    else:
+        response = send_from_directory(app.static_folder, filename, cache_timeout=cache_timeout)
+    if os.path.splitext(filename)[1] in TEXT_EXTENSIONS:
+        response.vary.add('Accept-Encoding')
+    if immutable:
+        response.headers['Cache-Control'] = IMMUTABLE
+    return response
+
+
+app.view_functions['static'] = serve_static
+
+
+def build():
+    """Hash every static file into the manifest and precompress the text assets.
+    Returns (files hashed, files compressed)."""
+    manifest, compressed = {}, 0
+    for directory, _, files in os.walk(app.static_folder):
+        for name in files:
+            filename = os.path.relpath(os.path.join(directory, name), app.static_folder).replace(os.sep, '/')
+            content_hash(filename)
+            manifest[filename] = _hashes[filename]
+            if os.path.splitext(name)[1] not in TEXT_EXTENSIONS:
+                continue
+            with open(_source(filename), 'rb') as f:
+                data = f.read()
+            os.makedirs(os.path.dirname(_build_path(filename)), exist_ok=True)
+            with open(_build_path(filename + '.gz'), 'wb') as f:
+                f.write(gzip.compress(data, 9))
+            compressed += 1
+            if brotli is not None:
+                with open(_build_path(filename + '.br'), 'wb') as f:
+                    f.write(brotli.compress(data, quality=11))
+                compressed += 1
+    os.makedirs(_build_path(), exist_ok=True)
+    with open(_manifest_path(), 'w') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    return len(manifest), compressed
+
+
+_load_manifest()
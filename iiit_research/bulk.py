@@ -0,0 +1,157 @@
+"""Bulk import and export of the core tables (`flask import-data` / `flask export-data`).
+
+Files are named after their table, like the per-table dumps in `sql_dumps/`: `user.jsonl`, `post.csv`, ...
+One row per JSON line (or CSV record) with the table's column names as keys. Export streams rows straight
+from a cursor; import streams the file in batches of `executemany` inserts, one transaction per file,
+with the table's secondary indexes dropped during the load and rebuilt once at the end.
+
+Imports go through Core, not the ORM, so the derived tables are not maintained row by row. `post.like_count`
+is recomputed after `like` is loaded; the search index, timelines and trending counters are rebuilt with
+their own commands afterwards (see `DERIVED`).
+"""
+import csv
+import json
+import os
+from datetime import datetime
+
+from sqlalchemy import Boolean, DateTime, Integer, func, select
+
+from iiit_research import database, db, socialgraph, validators
+from iiit_research.models import Post, Like
+
+# in dependency order
+TABLES = ['interest', 'user', 'user_interests', 'lab', 'lab_members', 'post', 'subscription', 'like']
+FORMATS = ('jsonl', 'csv')
+
+# commands that rebuild data derived from the imported tables
+DERIVED = ['flask rebuild-search-index', 'flask rebuild-timelines', 'flask reconcile-trending']
+
+
+def _table(name):
+    return db.metadata.tables[name]
+
+
+def _encode(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+def _converters(table):
+    """Column name -> function turning a value read from a file into what the column expects."""
+    def convert(column):
+        if isinstance(column.type, Integer):
+            parse = int
+        elif isinstance(column.type, Boolean):
+            def parse(value):
+                return value if isinstance(value, bool) else str(value).lower() in ('1', 'true', 't', 'yes')
+        elif isinstance(column.type, DateTime):
+            def parse(value):
+                return datetime.fromisoformat(value)
+        else:
+            parse = str
+        return lambda value: None if value is None or (value == '' and column.nullable) else parse(value)
+    return {column.name: convert(column) for column in table.columns}
+
+
+def _missing(table):
+    """Column name -> function giving the value for a column a record leaves out (its default, else NULL)."""
+    def default(column):
+        if column.default is None or not column.default.is_scalar and not column.default.is_callable:
+            return lambda: None
+        if column.default.is_scalar:
+            return lambda: column.default.arg
+        return lambda: column.default.arg(None)
+    return {column.name: default(column) for column in table.columns}
+
+
+def _read(fileobj, fmt):
+    if fmt == 'jsonl':
+        for line in fileobj:
+            if line.strip():
+                yield json.loads(line)
+    else:
+        yield from csv.DictReader(fileobj)
+
+
+def export_table(name, fileobj, fmt='jsonl', progress=None, batch_size=10000):
+    """Write every row of table `name` to `fileobj`. Returns the number of rows."""
+    table = _table(name)
+    columns = [column.name for column in table.columns]
+    writer = csv.DictWriter(fileobj, columns) if fmt == 'csv' else None
+    if writer:
+        writer.writeheader()
+    count = 0
+    result = db.session.connection().execution_options(stream_results=True) \
+        .execute(select([table]).order_by(*table.primary_key.columns))
+    while True:
+        rows = result.fetchmany(batch_size)
+        if not rows:
+            break
+        for row in rows:
+            record = {column: _encode(value) for column, value in zip(columns, row)}
+            if writer:
+                writer.writerow(record)
+            else:
+                fileobj.write(json.dumps(record) + '\n')
+        count += len(rows)
+        if progress:
+            progress(name, count)
+    return count
+
+
+def import_table(name, fileobj, fmt='jsonl', batch_size=10000, defer_indexes=True, progress=None):
+    """Insert every row of `fileobj` into table `name` in a single transaction. Returns the number of rows."""
+    table = _table(name)
+    convert, missing = _converters(table), _missing(table)
+    conn = db.session.connection()
+    if conn.dialect.name == 'sqlite':
+        # no fsyncs while the rows are written, nor at COMMIT: an OS crash or power loss shortly after an import
+        # can lose it (run it again) and, outside WAL mode, damage the file. The setting stays on the connection,
+        # so it is put back to SQLITE_SYNCHRONOUS once the commit or rollback returns it to the pool.
+        conn.execute('PRAGMA synchronous = OFF')
+        database.restore_synchronous(conn)
+    indexes = list(table.indexes) if defer_indexes else []
+    for index in indexes:
+        index.drop(bind=conn)
+
+    count, batch = 0, []
+    insert = table.insert()
+    for record in _read(fileobj, fmt):
+        # executemany needs the same columns in every row
+        batch.append({column: convert[column](record[column]) if column in record else missing[column]()
+                      for column in convert})
+        if len(batch) >= batch_size:
+            conn.execute(insert, batch)
+            count += len(batch)
+            batch = []
+            if progress:
+                progress(name, count)
+    if batch:
+        conn.execute(insert, batch)
+        count += len(batch)
+
+    for index in indexes:
+        index.create(bind=conn)
+    if name == 'like':
+        recount_likes(conn)
+    if name == 'subscription':
+        socialgraph.bump(conn)
+    # every page may show the new rows
+    validators.record(db.session, ['all'])
+    db.session.commit()
+    if progress:
+        progress(name, count)
+    return count
+
+
+def recount_likes(conn):
+    """Set every post's like_count from the `like` table."""
+    actual = select([func.count(Like.id)]).where(Like.post_id == Post.id).as_scalar()
+    conn.execute(Post.__table__.update().values(like_count=actual))
+
+
+def files_in(directory, fmt):
+    """(table, path) of every importable file in `directory`, in dependency order."""
+    for name in TABLES:
+        path = os.path.join(directory, f'{name}.{fmt}')
+        if os.path.exists(path):
+            yield name, path
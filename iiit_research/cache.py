@@ -0,0 +1,113 @@
+"""Small key/value caches with TTL.
+
+Two interchangeable backends:
+
+* `LRUCache` - in-process, bounded, thread-safe. Fastest, but every worker process has its own copy.
+* `SQLiteCache` - a local SQLite file shared by every worker process on the host, so an invalidation
+  in one worker is seen by all of them.
+
+Use `make_cache()` to build one from app config. CACHE_BACKEND and CACHE_PATH set the default backend and
+file for every cache; `python -m iiit_research.server` with several workers makes them share one SQLite file
+on tmpfs (/dev/shm), the host's shared memory.
+"""
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+class LRUCache:
+    def __init__(self, max_entries=1024, default_ttl=300):
+        self.max_entries = max_entries
+        self.default_ttl = default_ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at is not None and expires_at < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        ttl = self.default_ttl if ttl is None else ttl
+        expires_at = time.monotonic() + ttl if ttl else None
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+class SQLiteCache:
+    def __init__(self, path, default_ttl=300):
+        self.path = path
+        self.default_ttl = default_ttl
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS cache '
+                         '(key TEXT PRIMARY KEY, value BLOB NOT NULL, expires_at REAL)')
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or getattr(self._local, 'pid', None) != os.getpid():
+            # connections must not be shared across a fork
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn, self._local.pid = conn, os.getpid()
+        return conn
+
+    def get(self, key):
+        row = self._connect().execute('SELECT value, expires_at FROM cache WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return None
+        value, expires_at = row
+        if expires_at is not None and expires_at < time.time():
+            self.delete(key)
+            return None
+        return pickle.loads(value)
+
+    def set(self, key, value, ttl=None):
+        ttl = self.default_ttl if ttl is None else ttl
+        expires_at = time.time() + ttl if ttl else None
+        self._connect().execute('INSERT OR REPLACE INTO cache (key, value, expires_at) VALUES (?, ?, ?)',
+                                (key, pickle.dumps(value, pickle.HIGHEST_PROTOCOL), expires_at))
+
+    def delete(self, key):
+        self._connect().execute('DELETE FROM cache WHERE key = ?', (key,))
+
+    def clear(self):
+        self._connect().execute('DELETE FROM cache')
+
+
+def make_cache(app, prefix):
+    """Build the cache configured by `<prefix>_BACKEND` ('lru' or 'sqlite', default CACHE_BACKEND or 'lru'),
+    `<prefix>_TTL`, `<prefix>_MAX_ENTRIES` and `<prefix>_PATH` (default CACHE_PATH)."""
+    backend = app.config.get(f'{prefix}_BACKEND', app.config.get('CACHE_BACKEND', 'lru'))
+    ttl = app.config.get(f'{prefix}_TTL', 300)
+    if backend == 'lru':
+        return LRUCache(max_entries=app.config.get(f'{prefix}_MAX_ENTRIES', 1024), default_ttl=ttl)
+    if backend == 'sqlite':
+        path = app.config.get(f'{prefix}_PATH', app.config.get('CACHE_PATH'))
+        if not path:
+            os.makedirs(app.instance_path, exist_ok=True)
+            path = os.path.join(app.instance_path, 'cache.sqlite')
+        return SQLiteCache(path, default_ttl=ttl)
+    raise ValueError(f'Unknown cache backend {backend!r} for {prefix}_BACKEND')
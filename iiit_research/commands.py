@@ -0,0 +1,146 @@
+import os
+import time
+
+import click
+
+from iiit_research import app, timeline, fulltext, trends, migrations, advisor, mailqueue, images, assets, \
+    bulk, fragments, recommendations, warmup
+from iiit_research.models import User
+
+
+@app.cli.command('init-db')
+def init_db():
+    """Create any missing tables, columns and indexes."""
+    created = migrations.upgrade()
+    for name in created:
+        click.echo(f'Created {name}')
+    click.echo('Database is up to date.')
+
+
+@app.cli.command('rebuild-timelines')
+def rebuild_timelines():
+    """Rebuild every user's materialized home timeline."""
+    count = timeline.rebuild_all()
+    click.echo(f'Rebuilt {count} timelines.')
+
+
+@app.cli.command('rebuild-search-index')
+def rebuild_search_index():
+    """Re-index users, labs, interests and posts for /search."""
+    count = fulltext.rebuild()
+    click.echo(f'Indexed {count} rows.')
+
+
+@app.cli.command('reconcile-trending')
+def reconcile_trending():
+    """Recompute the /trending counters from the source tables. Run periodically."""
+    trends.reconcile()
+    click.echo('Trending counters reconciled.')
+
+
+@app.cli.command('build-recommendations')
+def build_recommendations():
+    """Recompute the suggested people, labs and posts shown on /home. Run periodically."""
+    if not recommendations.available():
+        raise click.ClickException('Recommendations need numpy and scipy: pip install numpy scipy')
+    count, elapsed = recommendations.rebuild()
+    click.echo(f'Stored {count} recommendations in {elapsed:.1f}s.')
+
+
+@app.cli.command('explain-queries')
+@click.option('--user-id', type=int, help='User to browse as (defaults to the first user).')
+def explain_queries(user_id):
+    """Flag route queries that make SQLite scan a whole table. Exits 1 if any are found."""
+    user = User.query.get(user_id) if user_id else None
+    flagged = 0
+    for url, statement, tables in advisor.report(user):
+        flagged += 1
+        click.echo(f'{url}: full scan of {", ".join(tables)}')
+        click.echo('    ' + ' '.join(statement.split()))
+    if flagged:
+        raise SystemExit(1)
+    click.echo('No full table scans found.')
+
+
+@app.cli.command('send-mail')
+@click.option('--workers', default=2, help='Number of sender threads, each with its own SMTP connection.')
+@click.option('--once', is_flag=True, help='Send everything that is due and exit.')
+def send_mail(workers, once):
+    """Send queued emails (use with MAIL_QUEUE_IN_PROCESS = False)."""
+    dispatcher = mailqueue.MailDispatcher(workers=workers)
+    if once:
+        click.echo(f'Sent {dispatcher.drain()} emails.')
+        return
+    dispatcher.start()
+    click.echo(f'Sending mail with {workers} workers, press Ctrl+C to stop.')
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        dispatcher.stop()
+
+
+@app.cli.command('build-thumbnails')
+@click.option('--force', is_flag=True, help='Regenerate derivatives that already exist.')
+def build_thumbnails(force):
+    """Generate thumbnails for every stored profile picture and lab image."""
+    if not images.available():
+        raise click.ClickException('Pillow is not installed.')
+    count, written = images.backfill(force)
+    click.echo(f'Checked {count} images, wrote {written} thumbnails.')
+
+
+@app.cli.command('build-assets')
+def build_assets():
+    """Fingerprint the static files and precompress the text assets. Run on every deploy."""
+    hashed, compressed = assets.build()
+    click.echo(f'Hashed {hashed} files, wrote {compressed} compressed copies.')
+
+
+@app.cli.command('build-templates')
+def build_templates():
+    """Compile every template into the bytecode cache, so workers don't compile them. Run on every deploy."""
+    if not app.config['TEMPLATE_BYTECODE_CACHE']:
+        raise click.ClickException('TEMPLATE_BYTECODE_CACHE is disabled.')
+    started = time.perf_counter()
+    count = warmup.compile_templates()
+    click.echo(f'Compiled {count} templates into {app.config["TEMPLATE_BYTECODE_CACHE"]} '
+               f'in {time.perf_counter() - started:.2f}s.')
+
+
+def _progress(table, rows):
+    click.echo(f'  {table}: {rows} rows', err=True)
+
+
+@app.cli.command('export-data')
+@click.argument('directory', type=click.Path(file_okay=False))
+@click.option('--format', 'fmt', type=click.Choice(bulk.FORMATS), default='jsonl')
+@click.option('--tables', help='Comma separated tables to export (default: all).')
+def export_data(directory, fmt, tables):
+    """Export users, labs, posts, subscriptions, likes and interests to DIRECTORY/<table>.<format>."""
+    os.makedirs(directory, exist_ok=True)
+    started = time.perf_counter()
+    for name in tables.split(',') if tables else bulk.TABLES:
+        with open(os.path.join(directory, f'{name}.{fmt}'), 'w', newline='') as f:
+            count = bulk.export_table(name, f, fmt, progress=_progress)
+        click.echo(f'Exported {count} rows from {name}.')
+    click.echo(f'Done in {time.perf_counter() - started:.1f}s.')
+
+
+@app.cli.command('import-data')
+@click.argument('directory', type=click.Path(exists=True, file_okay=False))
+@click.option('--format', 'fmt', type=click.Choice(bulk.FORMATS), default='jsonl')
+@click.option('--batch-size', default=10000, help='Rows per executemany.')
+@click.option('--keep-indexes', is_flag=True, help="Don't drop secondary indexes during the load.")
+def import_data(directory, fmt, batch_size, keep_indexes):
+    """Bulk load DIRECTORY/<table>.<format> files (as written by export-data) into an initialized database."""
+    started = time.perf_counter()
+    for name, path in bulk.files_in(directory, fmt):
+        table_started = time.perf_counter()
+        with open(path, newline='') as f:
+            count = bulk.import_table(name, f, fmt, batch_size=batch_size, defer_indexes=not keep_indexes,
+                                      progress=_progress)
+        elapsed = time.perf_counter() - table_started
+        click.echo(f'Imported {count} rows into {name} ({count / max(elapsed, 1e-6):.0f} rows/s).')
+    fragments.clear()
+    click.echo(f'Done in {time.perf_counter() - started:.1f}s. Now run: ' + ', '.join(bulk.DERIVED))
@@ -0,0 +1,72 @@
+"""Database settings.
+
+The URI comes from DATABASE_URL (default: the SQLite file `site.db` next to the package), and every
+setting below can be overridden with an environment variable of the same name.
+
+The app only runs on SQLite: search uses an FTS5 table, the write paths use INSERT OR IGNORE and
+ON CONFLICT upserts, and the settings below are PRAGMAs. Any other DATABASE_URL is refused at startup.
+
+SQLite is tuned for several worker processes writing at once:
+
+* SQLITE_JOURNAL_MODE = WAL: readers no longer block the writer or each other, so a like/follow burst
+  doesn't fail page views with "database is locked".
+* SQLITE_SYNCHRONOUS = NORMAL: in WAL mode this only fsyncs at checkpoints, not on every commit. A power
+  loss can drop the last commits but never corrupts the database.
+* SQLITE_BUSY_TIMEOUT (ms): how long a writer waits for the write lock before giving up.
+* SQLITE_MMAP_SIZE (bytes): reads go through a memory map instead of read() calls.
+"""
+import os
+import sqlite3
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.pool import Pool
+
+DEFAULTS = {
+    'SQLITE_JOURNAL_MODE': 'WAL',
+    'SQLITE_SYNCHRONOUS': 'NORMAL',
+    'SQLITE_BUSY_TIMEOUT': 5000,
+    'SQLITE_MMAP_SIZE': 256 * 1024 * 1024,
+}
+
+_settings = dict(DEFAULTS)
+
+
+def configure(app):
+    """Fill in the database config from the environment. Call before creating the SQLAlchemy object."""
+    for key, default in DEFAULTS.items():
+        value = os.environ.get(key, app.config.get(key, default))
+        app.config[key] = type(default)(value)
+    _settings.update((key, app.config[key]) for key in DEFAULTS)
+
+    uri = os.environ.get('DATABASE_URL', app.config.get('SQLALCHEMY_DATABASE_URI', 'sqlite:///site.db'))
+    if not uri.startswith('sqlite:'):
+        raise ValueError(f'DATABASE_URL must be a sqlite:/// URL, got {uri.split(":")[0]}:')
+    app.config['SQLALCHEMY_DATABASE_URI'] = uri
+    app.config.setdefault('SQLALCHEMY_TRACK_MODIFICATIONS', False)
+
+
+@event.listens_for(Engine, 'connect')
+def _sqlite_pragmas(dbapi_connection, connection_record):
+    if not isinstance(dbapi_connection, sqlite3.Connection):
+        return
+    cursor = dbapi_connection.cursor()
+    cursor.execute(f"PRAGMA busy_timeout = {int(_settings['SQLITE_BUSY_TIMEOUT'])}")
+    cursor.execute(f"PRAGMA journal_mode = {_settings['SQLITE_JOURNAL_MODE']}")
+    cursor.execute(f"PRAGMA synchronous = {_settings['SQLITE_SYNCHRONOUS']}")
+    cursor.execute(f"PRAGMA mmap_size = {int(_settings['SQLITE_MMAP_SIZE'])}")
+    cursor.close()
+
+
+def restore_synchronous(conn):
+    """Set PRAGMA synchronous back to SQLITE_SYNCHRONOUS when `conn` goes back to the pool. SQLite only lets it
+    change outside a transaction, so a caller that lowered it can't restore it before its commit or rollback."""
+    conn.info['restore_synchronous'] = True
+
+
+@event.listens_for(Pool, 'checkin')
+def _restore_synchronous(dbapi_connection, connection_record):
+    if dbapi_connection is not None and connection_record.info.pop('restore_synchronous', False):
+        cursor = dbapi_connection.cursor()
+        cursor.execute(f"PRAGMA synchronous = {_settings['SQLITE_SYNCHRONOUS']}")
+        cursor.close()
@@ -0,0 +1,234 @@
+"""Fragment cache for rendered template components.
+
+Wrap a component in `{% cache name, tag, ... %}...{% endcache %}`. The rendered HTML is cached under the
+fragment name plus the current version of every tag. A tag names the data the fragment shows, e.g.
+`'followers:' ~ user.id` or `'trending'`. Versions are opaque tokens that are thrown away when the tag is
+touched, so a change never has to find the fragments it affects: they just stop being looked up.
+
+Tags are touched automatically for ORM writes to Subscription, User, Lab, Interest, PendingApproval and
+Post (see `_tags_for`), and by hand with `touch()` for Core-level writes. Versions are dropped after the
+transaction commits, so a concurrent render can't cache data from before the commit under the new version.
+
+Fragments live in a per-process LRU. With FRAGMENT_CACHE_BACKEND (or CACHE_BACKEND) = 'sqlite' versions and
+fragments are also kept in the SQLite cache shared by every worker on the host, so an invalidation in one
+worker is seen by all of them; with the default 'lru' other workers only catch up after FRAGMENT_CACHE_TTL
+seconds.
+
+`cached()` does the same for any picklable value computed in Python, e.g. the profile counts in profiles.py.
+
+Views should hand the template lazy data (a Query, or `deferred()`) so a cache hit skips the query too.
+"""
+import threading
+import uuid
+from collections import defaultdict
+from itertools import chain
+
+from flask import g
+from jinja2 import nodes
+from jinja2.ext import Extension
+from markupsafe import Markup
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+
+from iiit_research import app, images, validators
+from iiit_research.cache import LRUCache, make_cache
+from iiit_research.models import User, Lab, Post, Subscription, Interest, PendingApproval
+
+_local = None
+_shared = None
+_stats = defaultdict(lambda: {'hits': 0, 'misses': 0})
+_stats_lock = threading.Lock()
+
+
+def _caches():
+    global _local, _shared
+    if _local is None:
+        ttl = app.config.get('FRAGMENT_CACHE_TTL', 300)
+        if app.config.get('FRAGMENT_CACHE_BACKEND', app.config.get('CACHE_BACKEND', 'lru')) != 'lru':
+            _shared = make_cache(app, 'FRAGMENT_CACHE')
+        _local = LRUCache(max_entries=app.config.get('FRAGMENT_CACHE_MAX_ENTRIES', 1024), default_ttl=ttl)
+    return _local, _shared
+
+
+def _version(tag):
+    local, shared = _caches()
+    store = shared or local
+    version = store.get('fv:' + tag)
+    if version is None:
+        version = uuid.uuid4().hex[:12]
+        store.set('fv:' + tag, version, ttl=0)
+    return version
+
+
+def bump(*tags):
+    """Invalidate every fragment that depends on one of `tags`, right now."""
+    local, shared = _caches()
+    for tag in tags:
+        (shared or local).delete('fv:' + tag)
+
+
+def clear():
+    """Drop every fragment and version, e.g. after data was loaded behind the ORM's back."""
+    for store in _caches():
+        if store is not None:
+            store.clear()
+
+
+def touch(session, *tags):
+    """Invalidate fragments depending on `tags` once `session` commits (and pages' ETags right away)."""
+    session.info.setdefault('fragment_tags', set()).update(tags)
+    validators.record(session, tags)
+
+
+def _record(name, hit):
+    with _stats_lock:
+        _stats[name]['hits' if hit else 'misses'] += 1
+    counts = g.setdefault('fragment_counts', [0, 0])
+    counts[0 if hit else 1] += 1
+
+
+def stats():
+    """{fragment name: {'hits': n, 'misses': n}} for this process."""
+    with _stats_lock:
+        return {name: dict(counts) for name, counts in _stats.items()}
+
+
+def cached(name, tags, compute, variant=''):
+    """The value cached for `name` under the current versions of `tags`, calling `compute()` on a miss."""
+    if not app.config.get('FRAGMENT_CACHE_ENABLED', True):
+        return compute()
+    local, shared = _caches()
+    key = 'fragment:{}:{}:{}'.format(name, variant, ':'.join(f'{tag}@{_version(tag)}' for tag in tags))
+    value = local.get(key)
+    if value is None and shared is not None:
+        value = shared.get(key)
+        if value is not None:
+            local.set(key, value)
+    _record(name, value is not None)
+    if value is None:
+        value = compute()
+        local.set(key, value)
+        if shared is not None:
+            shared.set(key, value)
+    return value
+
+
+def render(name, tags, caller):
+    # fragments may contain image URLs, which differ by the image format the client accepts
+    return Markup(cached(name, tags, lambda: str(caller()), variant=images.client_format()))
+
+
+class FragmentCacheExtension(Extension):
+    """`{% cache 'name', 'tag', ... %}...{% endcache %}`"""
+    tags = {'cache'}
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        args = [parser.parse_expression()]
+        while parser.stream.skip_if('comma'):
+            args.append(parser.parse_expression())
+        body = parser.parse_statements(['name:endcache'], drop_needle=True)
+        call = self.call_method('_render', [args[0], nodes.List(args[1:])])
+        return nodes.CallBlock(call, [], [], body).set_lineno(lineno)
+
+    def _render(self, name, tags, caller):
+        return render(name, [str(tag) for tag in tags], caller)
+
+
+app.jinja_env.add_extension(FragmentCacheExtension)
+
+
+class deferred:
+    """An iterable that calls `fn` when first iterated, so a cached fragment never runs it."""
+
+    def __init__(self, fn, *args, **kwargs):
+        self._call = lambda: fn(*args, **kwargs)
+        self._items = None
+
+    def __iter__(self):
+        if self._items is None:
+            self._items = list(self._call())
+        return iter(self._items)
+
+
+def _changed(state, attr):
+    return state.attrs[attr].history.has_changes()
+
+
+def _ids(state, attr):
+    history = state.attrs[attr].history
+    return [obj.id for obj in chain(history.added, history.deleted) if obj.id is not None]
+
+
+def _tags_for(obj, state, new_or_deleted):
+    """Tags whose fragments show `obj`."""
+    if isinstance(obj, Subscription):
+        tags = {f'following:{obj.follower}', 'trending'}
+        if obj.followee_type == 'user':
+            tags.add(f'followers:{obj.followee}')
+        return tags
+    if isinstance(obj, User):
+        tags = set()
+        if new_or_deleted or any(_changed(state, attr.key) for attr in state.mapper.column_attrs):
+            tags.add(f'user:{obj.id}')
+        if new_or_deleted or any(_changed(state, attr) for attr in ('name', 'username', 'profile_pic')):
+            tags.add('user_names')
+        if _changed(state, 'interests'):
+            tags.add(f'interests:{obj.id}')
+        if _changed(state, 'prof_id'):
+            history = state.attrs.prof_id.history
+            tags.update(f'students:{prof_id}' for prof_id in chain(history.added, history.deleted) if prof_id)
+        if _changed(state, 'lab'):
+            tags.update((f'labs_of:{obj.id}', 'lab_members'))
+            tags.update(f'lab_members:{lab_id}' for lab_id in _ids(state, 'lab'))
+        return tags
+    if isinstance(obj, Lab):
+        tags = set()
+        if new_or_deleted or _changed(state, 'name') or _changed(state, 'image'):
+            tags.add('labs')
+        if new_or_deleted or any(_changed(state, attr.key) for attr in state.mapper.column_attrs):
+            tags.add(f'lab:{obj.id}')
+        if _changed(state, 'members'):
+            tags.update((f'lab_members:{obj.id}', 'lab_members'))
+            tags.update(f'labs_of:{user_id}' for user_id in _ids(state, 'members'))
+        return tags
+    if isinstance(obj, Interest):
+        return {'interests'} if new_or_deleted or _changed(state, 'name') else set()
+    if isinstance(obj, PendingApproval):
+        return {f'pending:{obj.prof_id}'}
+    if isinstance(obj, Post):
+        tags = {'trending', f'post:{obj.id}'}
+        if new_or_deleted:
+            tags.add(f'posts_of:{obj.author_type}:{obj.lab_id if obj.author_type == "lab" else obj.author_id}')
+        return tags
+    return set()
+
+
+@event.listens_for(Session, 'after_flush')
+def _collect_tags(session, flush_context):
+    tags = set()
+    # runs before the session's bookkeeping is reset, so new/deleted and attribute history are still intact
+    for obj in chain(session.new, session.dirty, session.deleted):
+        tags |= _tags_for(obj, inspect(obj), obj in session.new or obj in session.deleted)
+    if tags:
+        touch(session, *tags)
+
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate(session):
+    tags = session.info.pop('fragment_tags', None)
+    if tags:
+        bump(*tags)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard(session):
+    session.info.pop('fragment_tags', None)
+
+
+@app.after_request
+def fragment_header(response):
+    # in debug, show how much of the page came from the fragment cache
+    if app.debug and 'fragment_counts' in g:
+        response.headers['X-Fragment-Cache'] = 'hits={}, misses={}'.format(*g.fragment_counts)
+    return response
@@ -0,0 +1,156 @@
+"""Full-text search over users, labs, interests and posts.
+
+Backed by an SQLite FTS5 table, `search_index`, with one row per searchable entity. Rows are kept in sync
+by a session `after_flush` hook, so every ORM write to a User/Lab/Interest/Post updates the index in the same
+transaction. `flask init-db` creates the table and `flask rebuild-search-index` (re)fills it.
+
+Queries are ranked with bm25 (title matches weigh more than body matches) and every term is a prefix match.
+"""
+import re
+
+from sqlalchemy import event, text
+from sqlalchemy.orm import Session
+
+from iiit_research import db
+from iiit_research.models import User, Lab, Post, Interest, UserInterests
+
+# model -> (index kinds it may use, kind of an instance, (title, body) of an instance)
+# users are indexed under their user_type so student/professor searches are a single index lookup
+INDEXED = {
+    User: (('student', 'professor'), lambda user: user.user_type,
+           lambda user: (user.name, ' '.join(filter(None, [user.username, user.about_me])))),
+    Lab: (('lab',), lambda lab: 'lab', lambda lab: (lab.name, lab.description)),
+    Interest: (('interest',), lambda interest: 'interest', lambda interest: (interest.name, '')),
+    Post: (('post',), lambda post: 'post', lambda post: (post.title, post.content)),
+}
+
+# FTS5 can't index UNINDEXED columns, so rows are addressed by a rowid derived from (kind, ref_id)
+KIND_CODES = {'student': 1, 'professor': 2, 'lab': 3, 'interest': 4, 'post': 5}
+SEARCHABLE = {'student': User, 'professor': User, 'lab': Lab, 'post': Post}
+
+_TOKEN = re.compile(r'\w+', re.UNICODE)
+
+
+def create_index(bind=None):
+    (bind or db.engine).execute(text(
+        "CREATE VIRTUAL TABLE IF NOT EXISTS search_index "
+        "USING fts5(kind UNINDEXED, ref_id UNINDEXED, title, body, prefix='2 3')"))
+
+
+def _rowid(kind, ref_id):
+    return ref_id * 8 + KIND_CODES[kind]
+
+
+def _delete(conn, model, ref_id):
+    for kind in INDEXED[model][0]:
+        conn.execute(text("DELETE FROM search_index WHERE rowid = :rowid"), rowid=_rowid(kind, ref_id))
+
+
+def _insert(conn, obj):
+    _, kind_of, document = INDEXED[type(obj)]
+    kind = kind_of(obj)
+    title, body = document(obj)
+    conn.execute(text("INSERT INTO search_index (rowid, kind, ref_id, title, body) "
+                      "VALUES (:rowid, :kind, :ref_id, :title, :body)"),
+                 rowid=_rowid(kind, obj.id), kind=kind, ref_id=obj.id, title=title or '', body=body or '')
+
+
+def index(objects):
+    """(Re-)index rows that were written with Core statements, which the flush hook doesn't see."""
+    conn = db.session.connection()
+    for obj in objects:
+        _delete(conn, type(obj), obj.id)
+        _insert(conn, obj)
+
+
+@event.listens_for(Session, 'after_flush')
+def _sync_index(session, flush_context):
+    changed = [(obj, False) for obj in session.new] + [(obj, False) for obj in session.dirty] \
+        + [(obj, True) for obj in session.deleted]
+    changed = [(obj, deleted) for obj, deleted in changed if type(obj) in INDEXED]
+    if not changed:
+        return
+    conn = session.connection()
+    for obj, deleted in changed:
+        _delete(conn, type(obj), obj.id)
+        if not deleted:
+            _insert(conn, obj)
+
+
+def rebuild():
+    """Re-index everything from the source tables."""
+    create_index()
+    conn = db.session.connection()
+    conn.execute(text("DELETE FROM search_index"))
+    count = 0
+    for model in INDEXED:
+        for obj in model.query.yield_per(1000):
+            _insert(conn, obj)
+            count += 1
+    db.session.commit()
+    return count
+
+
+def match_expression(query):
+    """Turn free text into an FTS5 query: every word must match, as a prefix. None if there are no words."""
+    terms = _TOKEN.findall(query or '')
+    if not terms:
+        return None
+    return ' '.join(f'"{term}"*' for term in terms)
+
+
+def _ranked_ids(kind, query, limit, offset):
+    expression = match_expression(query)
+    if expression is None:
+        return []
+    rows = db.session.execute(text(
+        "SELECT ref_id FROM search_index WHERE search_index MATCH :expression AND kind = :kind "
+        "ORDER BY bm25(search_index, 0, 0, 10.0, 1.0) LIMIT :limit OFFSET :offset"),
+        {'expression': expression, 'kind': kind, 'limit': limit, 'offset': offset})
+    return [int(row.ref_id) for row in rows]
+
+
+def _in_order(objects, ids):
+    by_id = {obj.id: obj for obj in objects}
+    return [by_id[i] for i in ids if i in by_id]
+
+
+class SearchPage:
+    def __init__(self, items, page, has_next):
+        self.items = items
+        self.page = page
+        self.has_next = has_next
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __bool__(self):
+        return bool(self.items)
+
+
+def search(search_for, query, page=1, per_page=20):
+    """Ranked results for the search form.
+
+    `search_for` is one of student, professor, lab, post or area_of_interest (users having a matching
+    interest). Returns a SearchPage of model instances.
+    """
+    page = max(page, 1)
+    offset = (page - 1) * per_page
+    limit = per_page + 1
+
+    if search_for in SEARCHABLE:
+        model = SEARCHABLE[search_for]
+        ids = _ranked_ids(search_for, query, limit, offset)
+        items = _in_order(model.query.filter(model.id.in_(ids)).all(), ids) if ids else []
+    elif search_for == 'area_of_interest':
+        interest_ids = _ranked_ids('interest', query, 100, 0)
+        if interest_ids:
+            items = User.query.join(UserInterests, UserInterests.c.user_id == User.id) \
+                .filter(UserInterests.c.interest_id.in_(interest_ids)) \
+                .distinct().order_by(User.name, User.id).offset(offset).limit(limit).all()
+        else:
+            items = []
+    else:
+        items = []
+
+    return SearchPage(items[:per_page], page, has_next=len(items) > per_page)
@@ -0,0 +1,126 @@
+"""Thumbnails for profile pictures and lab images.
+
+Every picture is shown as a small circle, but the originals can be megabytes. For each stored image a
+background pool renders square, centre-cropped derivatives at the SIZES below, in WebP and JPEG, into
+`static/<folder>/derived/`. Templates ask for a size with `image_url(folder, filename, size)`, which returns
+the WebP derivative to browsers that accept it, the JPEG one otherwise, and the original until the
+derivatives exist.
+
+Pillow is optional: without it nothing is generated and `image_url()` always returns the original.
+"""
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import g, request, url_for
+
+from iiit_research import app
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = None
+
+FOLDERS = ('profile_pics', 'lab_images')
+SIZES = {'small': 140, 'medium': 300}  # 2x the CSS sizes (50-70px in lists, 150px on profiles)
+FORMATS = {'webp': 'WEBP', 'jpg': 'JPEG'}
+QUALITY = 82
+
+_pool = None
+_pool_lock = threading.Lock()
+_existing = set()  # derivative paths known to exist, to skip the stat on every render
+
+
+def available():
+    return Image is not None
+
+
+def derived_name(filename, size, ext):
+    return f'derived/{os.path.splitext(filename)[0]}-{size}.{ext}'
+
+
+def _path(folder, name):
+    return os.path.join(app.root_path, 'static', folder, name)
+
+
+def generate(folder, filename, force=False):
+    """Render every derivative of static/<folder>/<filename>. Returns the number of files written."""
+    written = 0
+    with Image.open(_path(folder, filename)) as original:
+        original = ImageOps.exif_transpose(original).convert('RGB')
+        os.makedirs(_path(folder, 'derived'), exist_ok=True)
+        for size, pixels in SIZES.items():
+            thumb = None
+            for ext, fmt in FORMATS.items():
+                path = _path(folder, derived_name(filename, size, ext))
+                if not force and os.path.exists(path):
+                    continue
+                thumb = thumb or ImageOps.fit(original, (pixels, pixels), Image.LANCZOS)
+                # write to a temp name first so a request never sees a half-written file
+                thumb.save(path + '.tmp', fmt, quality=QUALITY)
+                os.replace(path + '.tmp', path)
+                written += 1
+    return written
+
+
+def _generate_logged(folder, filename, force=False):
+    try:
+        return generate(folder, filename, force)
+    except Exception:
+        app.logger.exception('Generating thumbnails for %s/%s failed', folder, filename)
+        return 0
+
+
+def _get_pool():
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ThreadPoolExecutor(max_workers=app.config.get('IMAGE_WORKERS', 2),
+                                           thread_name_prefix='thumbnails')
+    return _pool
+
+
+def schedule(folder, filename):
+    """Generate the derivatives of a freshly stored image in the background."""
+    if available():
+        return _get_pool().submit(_generate_logged, folder, filename)
+
+
+def backfill(force=False):
+    """Generate missing derivatives for every stored image. Returns (images, files written)."""
+    pool = _get_pool()
+    futures = []
+    for folder in FOLDERS:
+        directory = _path(folder, '')
+        for filename in sorted(os.listdir(directory)):
+            if os.path.isfile(os.path.join(directory, filename)):
+                futures.append(pool.submit(_generate_logged, folder, filename, force))
+    return len(futures), sum(future.result() for future in futures)
+
+
+def client_format():
+    """'webp' or 'jpg', whichever derivative the current client should get."""
+    g.image_vary_accept = True
+    return 'webp' if request.accept_mimetypes['image/webp'] else 'jpg'
+
+
+@app.template_global()
+def image_url(folder, filename, size='small'):
+    """URL of the `size` derivative of static/<folder>/<filename>, or of the original if there is none yet."""
+    ext = client_format()
+    name = derived_name(filename, size, ext)
+    path = _path(folder, name)
+    if path not in _existing:
+        if not os.path.exists(path):
+            return url_for('static', filename=f'{folder}/{filename}')
+        _existing.add(path)
+    return url_for('static', filename=f'{folder}/{name}')
+
+
+@app.after_request
+def vary_on_accept(response):
+    # the page's image URLs depend on whether the browser accepts WebP
+    if g.get('image_vary_accept'):
+        response.vary.add('Accept')
+    return response
@@ -0,0 +1,145 @@
+"""Optional write-behind buffer for likes (`LIKE_WRITE_BEHIND = True`).
+
+Instead of a transaction per click, like/unlike requests record the user's latest intent in memory. A
+background thread flushes every LIKE_FLUSH_INTERVAL seconds (or once LIKE_FLUSH_MAX_PENDING intents are
+queued): likes are bulk inserted, unlikes bulk deleted, and the like_count of every touched post is
+recomputed from the `like` table in a single UPDATE. A burst of like/unlike/like on a hot post therefore
+collapses into one row change, and the counts are exact after every flush no matter how many processes
+flush concurrently.
+
+Until its flush, a pending intent is overlaid on `User.has_liked_post()`/`User.liked_post_ids()` so the
+user sees their own click straight away.
+"""
+import atexit
+import threading
+from collections import defaultdict
+
+from sqlalchemy import bindparam, func, select
+
+from iiit_research import app, db
+
+
+class LikeBuffer:
+    def __init__(self, interval=2.0, max_pending=1000):
+        self.interval = interval
+        self.max_pending = max_pending
+        self._pending = {}  # (user_id, post_id) -> True for like, False for unlike
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+
+    def record(self, user_id, post_id, liked):
+        with self._lock:
+            self._pending[(int(user_id), int(post_id))] = liked
+            size = len(self._pending)
+        self._ensure_started()
+        if size >= self.max_pending:
+            self._wakeup.set()
+
+    def pending_state(self, user_id, post_id):
+        """True/False for a queued like/unlike, None if nothing is pending."""
+        with self._lock:
+            return self._pending.get((int(user_id), int(post_id)))
+
+    def pending_for(self, user_id):
+        """The user's queued intents as sorted (post_id, liked) pairs."""
+        with self._lock:
+            return sorted((post_id, liked) for (user, post_id), liked in self._pending.items() if user == user_id)
+
+    def discard(self, keys):
+        """Drop pending intents for these (user_id, post_id) pairs, e.g. once they were applied directly."""
+        with self._lock:
+            for user_id, post_id in keys:
+                self._pending.pop((int(user_id), int(post_id)), None)
+
+    def _ensure_started(self):
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name='like-flusher', daemon=True)
+                    self._thread.start()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception:
+                app.logger.exception('Flushing buffered likes failed')
+
+    def flush(self):
+        """Apply every pending intent in one transaction. Returns the number of intents applied."""
+        with self._lock:
+            batch, self._pending = self._pending, {}
+        if not batch:
+            return 0
+
+        # runs on the flusher thread (or at exit), never inside a request
+        with app.app_context():
+            try:
+                apply_likes(batch)
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                # put the batch back unless newer intents have superseded it
+                with self._lock:
+                    for key, liked in batch.items():
+                        self._pending.setdefault(key, liked)
+                raise
+            finally:
+                db.session.remove()
+        return len(batch)
+
+
+def apply_likes(batch):
+    """Apply {(user_id, post_id): liked} intents in the current transaction, with a bulk insert for the likes,
+    a bulk delete for the unlikes and one UPDATE recounting like_count. Returns {post_id: like_count}."""
+    from iiit_research import fragments, trends
+    from iiit_research.models import Like, Post
+
+    likes = [{'user_id': u, 'post_id': p} for (u, p), liked in batch.items() if liked]
+    unlikes = [{'u': u, 'p': p} for (u, p), liked in batch.items() if not liked]
+    post_ids = {p for _, p in batch}
+    # a no-op write first: pysqlite only begins the transaction at the first write, so this takes SQLite's
+    # write lock before the likes are read, and a concurrent click on the same post waits for our commit
+    Post.query.filter(Post.id.in_(post_ids)).update({Post.like_count: Post.like_count}, synchronize_session=False)
+    # when the existing likes were made, so the trending score loses exactly what they added
+    existing = db.session.query(Like.user_id, Like.post_id, func.coalesce(Like.created_at, Post.created_at)) \
+        .join(Post, Post.id == Like.post_id) \
+        .filter(Like.post_id.in_(post_ids), Like.user_id.in_({u for u, _ in batch}))
+    liked_at = {(u, p): when for u, p, when in existing if (u, p) in batch}
+
+    if likes:
+        db.session.execute(Like.__table__.insert().prefix_with('OR IGNORE', dialect='sqlite'), likes)
+    if unlikes:
+        db.session.execute(Like.__table__.delete().where(
+            (Like.user_id == bindparam('u')) & (Like.post_id == bindparam('p'))), unlikes)
+
+    actual = select([func.count(Like.id)]).where(Like.post_id == Post.id).as_scalar()
+    Post.query.filter(Post.id.in_(post_ids)).update({Post.like_count: actual}, synchronize_session=False)
+    added, removed = defaultdict(int), defaultdict(list)
+    for key, liked in batch.items():
+        if liked and key not in liked_at:
+            added[key[1]] += 1
+        elif not liked and key in liked_at:
+            removed[key[1]].append(liked_at[key])
+    for post_id in set(added) | set(removed):
+        trends.on_likes(post_id, added[post_id], removed[post_id])
+        fragments.touch(db.session, f'post:{post_id}')
+    return dict(db.session.query(Post.id, Post.like_count).filter(Post.id.in_(post_ids)))
+
+
+_buffer = None
+
+
+def get_buffer():
+    """The process-wide buffer, or None when write-behind is disabled."""
+    global _buffer
+    if not app.config.get('LIKE_WRITE_BEHIND'):
+        return None
+    if _buffer is None:
+        _buffer = LikeBuffer(interval=app.config.get('LIKE_FLUSH_INTERVAL', 2.0),
+                             max_pending=app.config.get('LIKE_FLUSH_MAX_PENDING', 1000))
+        atexit.register(_buffer.flush)
+    return _buffer
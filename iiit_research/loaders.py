@@ -0,0 +1,24 @@
+"""Per-view loader strategies.
+
+Relationships are lazy by default so that plain lookups (e.g. `load_user`) don't drag related rows along.
+Views that render a relationship for every row in a list pull it in up front with one of these presets
+instead of firing a SELECT per row from the template.
+"""
+from sqlalchemy.orm import joinedload, selectinload
+
+from iiit_research.models import User, Lab, Post
+
+
+def post_authors():
+    """For post listings that show the author (user or lab) of every post."""
+    return joinedload(Post.author), joinedload(Post.author_lab)
+
+
+def lab_members():
+    """For lab listings that show every lab's members."""
+    return selectinload(Lab.members),
+
+
+def user_interests():
+    """For user listings/profiles that show the user's areas of interest."""
+    return selectinload(User.interests),
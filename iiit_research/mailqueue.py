@@ -0,0 +1,184 @@
+"""Asynchronous outbound mail.
+
+Views never talk to SMTP. `enqueue()` stores the message in the `outbound_mail` table as part of the
+caller's transaction, and a `MailDispatcher` sends it from background worker threads:
+
+* each worker claims a batch of due messages with a single UPDATE, so several workers (or processes)
+  never send the same message twice;
+* each worker keeps its SMTP connection open while there is work, so a batch is one TLS handshake instead
+  of one per message;
+* failures are retried with exponential backoff (MAIL_RETRY_BASE seconds, doubling) and given up on after
+  MAIL_MAX_ATTEMPTS; messages claimed by a worker that died are put back after MAIL_CLAIM_TIMEOUT seconds.
+
+By default the dispatcher runs inside the web process and is started on the first enqueue. Set
+MAIL_QUEUE_IN_PROCESS = False and run `flask send-mail` instead to send from a separate process.
+"""
+import smtplib
+import threading
+import uuid
+from datetime import datetime, timedelta
+
+from flask_mail import Message
+from sqlalchemy import select
+
+from iiit_research import app, db, mail
+from iiit_research.models import OutboundMail
+
+
+def _row(msg):
+    return {'subject': msg.subject, 'sender': msg.sender, 'recipients': ','.join(msg.recipients),
+            'body': msg.body}
+
+
+def enqueue(msg):
+    """Queue a flask_mail.Message. It is sent once the caller's transaction commits."""
+    db.session.add(OutboundMail(**_row(msg)))
+    ensure_dispatcher()
+
+
+def enqueue_many(messages):
+    """Queue many messages with a single bulk insert and commit them."""
+    now = datetime.utcnow()
+    rows = [dict(_row(msg), status='pending', attempts=0, next_attempt_at=now, created_at=now)
+            for msg in messages]
+    if rows:
+        db.session.execute(OutboundMail.__table__.insert(), rows)
+        db.session.commit()
+        ensure_dispatcher()
+    return len(rows)
+
+
+def claim(limit, token):
+    """Atomically take up to `limit` due messages for the worker identified by `token`."""
+    now = datetime.utcnow()
+    stale = now - timedelta(seconds=app.config.get('MAIL_CLAIM_TIMEOUT', 300))
+    OutboundMail.query.filter(OutboundMail.status == 'sending', OutboundMail.claimed_at < stale) \
+        .update({OutboundMail.status: 'pending'}, synchronize_session=False)
+    due = select([OutboundMail.id]) \
+        .where((OutboundMail.status == 'pending') & (OutboundMail.next_attempt_at <= now)) \
+        .order_by(OutboundMail.next_attempt_at).limit(limit)
+    OutboundMail.query.filter(OutboundMail.id.in_(due), OutboundMail.status == 'pending') \
+        .update({OutboundMail.status: 'sending', OutboundMail.claimed_by: token, OutboundMail.claimed_at: now},
+                synchronize_session=False)
+    db.session.commit()
+    return OutboundMail.query.filter_by(claimed_by=token, status='sending').order_by(OutboundMail.id).all()
+
+
+def _message(row):
+    return Message(row.subject, sender=row.sender, recipients=row.recipients.split(','), body=row.body)
+
+
+def _failed(row, error):
+    row.attempts += 1
+    row.last_error = str(error)
+    row.claimed_by = None
+    if row.attempts >= app.config.get('MAIL_MAX_ATTEMPTS', 5):
+        row.status = 'failed'
+        app.logger.error('Giving up on mail %s to %s: %s', row.id, row.recipients, error)
+    else:
+        delay = min(app.config.get('MAIL_RETRY_BASE', 30) * 2 ** (row.attempts - 1), 3600)
+        row.status = 'pending'
+        row.next_attempt_at = datetime.utcnow() + timedelta(seconds=delay)
+
+
+class MailDispatcher:
+    def __init__(self, workers=2, batch_size=50, poll_interval=1.0):
+        self.workers = workers
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self._stopping = threading.Event()
+        self._threads = []
+
+    def start(self):
+        self._stopping.clear()
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._run, name=f'mail-dispatcher-{i}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, timeout=None):
+        self._stopping.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def send_batch(self, connection=None):
+        """Claim and send one batch over `connection` (opened if needed).
+        Returns (number claimed, number sent, the connection to reuse or None)."""
+        batch = claim(self.batch_size, uuid.uuid4().hex)
+        sent = 0
+        for row in batch:
+            try:
+                connection = connection or _open()
+                connection.send(_message(row))
+            except Exception as e:
+                # whatever went wrong, the message is retried with backoff and eventually given up on
+                _failed(row, e)
+                connection = _close(connection)
+            else:
+                row.status, row.claimed_by = 'sent', None
+                sent += 1
+            db.session.commit()
+        return len(batch), sent, connection
+
+    def drain(self):
+        """Send everything that is due, in this thread. Returns the number of messages sent."""
+        total, connection = 0, None
+        with app.app_context():
+            try:
+                while True:
+                    claimed, sent, connection = self.send_batch(connection)
+                    total += sent
+                    if not claimed:
+                        return total
+            finally:
+                _close(connection)
+                db.session.remove()
+
+    def _run(self):
+        connection = None
+        while not self._stopping.is_set():
+            with app.app_context():
+                try:
+                    claimed, _, connection = self.send_batch(connection)
+                except Exception:
+                    app.logger.exception('Mail dispatcher batch failed')
+                    db.session.rollback()
+                    claimed, connection = 0, _close(connection)
+                finally:
+                    db.session.remove()
+            if not claimed:
+                # idle: don't hold the SMTP connection open
+                connection = _close(connection)
+                self._stopping.wait(self.poll_interval)
+        _close(connection)
+
+
+def _open():
+    connection = mail.connect()
+    connection.__enter__()  # opens (and logs in to) the SMTP session
+    return connection
+
+
+def _close(connection):
+    if connection is not None:
+        try:
+            connection.__exit__(None, None, None)
+        except (smtplib.SMTPException, OSError):
+            pass
+    return None
+
+
+_dispatcher = None
+_dispatcher_lock = threading.Lock()
+
+
+def ensure_dispatcher():
+    """Start the in-process dispatcher, unless mail is sent by a separate `flask send-mail` process."""
+    global _dispatcher
+    if not app.config.get('MAIL_QUEUE_IN_PROCESS', True) or _dispatcher is not None:
+        return
+    with _dispatcher_lock:
+        if _dispatcher is None:
+            _dispatcher = MailDispatcher(workers=app.config.get('MAIL_WORKERS', 2))
+            _dispatcher.start()
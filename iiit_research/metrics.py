@@ -0,0 +1,240 @@
+"""Opt-in request instrumentation: per-route timings, SQL and template time, slow queries and a sampling profiler.
+
+Set METRICS_ENABLED (config or environment) to turn it on. Each request then gets a `Server-Timing` header
+(total, db with the query count, template), and `/metrics` serves per-endpoint counters and histograms in
+the Prometheus text format. The numbers are per worker process, like those of any in-process exporter.
+`/metrics` only answers requests from METRICS_ALLOW (default: localhost).
+
+Statements slower than METRICS_SLOW_QUERY_MS (default 100) are logged once normalized, i.e. with literals
+and IN lists replaced by `?`, so the same query with different arguments reads the same in the log.
+
+With METRICS_PROFILE_SLOW_MS set, a background thread samples the stacks of threads serving a request every
+METRICS_PROFILE_INTERVAL_MS (default 5). Requests that take longer than the threshold have their samples
+appended to instance/profiles/<endpoint>.folded, in the folded format read by flamegraph.pl and speedscope.
+"""
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter, defaultdict
+
+from flask import abort, g, has_request_context, request, signals
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from iiit_research import app, fragments
+
+app.config.setdefault('METRICS_ENABLED', os.environ.get('METRICS_ENABLED', '0') == '1')
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+QUERY_BUCKETS = (0, 1, 2, 4, 8, 16, 32, 64)
+
+_lock = threading.Lock()
+_counters = defaultdict(float)  # (name, labels) -> value
+_histograms = {}  # (name, labels) -> {'buckets': upper bounds, 'counts': per bucket, 'sum': .., 'count': ..}
+
+
+def enabled():
+    return app.config['METRICS_ENABLED']
+
+
+def _labels(**labels):
+    return tuple(sorted(labels.items()))
+
+
+def inc(name, amount=1, **labels):
+    with _lock:
+        _counters[name, _labels(**labels)] += amount
+
+
+def observe(name, value, buckets, **labels):
+    key = name, _labels(**labels)
+    with _lock:
+        histogram = _histograms.setdefault(key, {'buckets': buckets, 'counts': [0] * len(buckets), 'sum': 0,
+                                                 'count': 0})
+        for i, bound in enumerate(buckets):
+            if value <= bound:
+                histogram['counts'][i] += 1
+        histogram['sum'] += value
+        histogram['count'] += 1
+
+
+_LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_IN_LIST = re.compile(r'\bIN \((?:\?, )*\?\)', re.IGNORECASE)
+
+
+def normalize(statement):
+    """`statement` with literals and IN lists replaced by `?` and whitespace collapsed."""
+    statement = _LITERALS.sub('?', ' '.join(statement.split()))
+    return _IN_LIST.sub('IN (?)', statement)
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _query_started(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context() and 'metrics' in g:
+        context.metrics_started = time.perf_counter()
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _query_finished(conn, cursor, statement, parameters, context, executemany):
+    started = getattr(context, 'metrics_started', None)
+    if started is None or 'metrics' not in g:
+        return
+    elapsed = time.perf_counter() - started
+    g.metrics['queries'] += 1
+    g.metrics['db'] += elapsed
+    if elapsed * 1000 >= app.config.get('METRICS_SLOW_QUERY_MS', 100):
+        inc('db_slow_queries_total', endpoint=request.endpoint)
+        app.logger.warning('Slow query (%.1f ms) in %s: %s', elapsed * 1000, request.endpoint, normalize(statement))
+
+
+def _template_started(sender, template, context, **extra):
+    if 'metrics' in g:
+        g.metrics['template_started'] = time.perf_counter()
+
+
+def _template_rendered(sender, template, context, **extra):
+    if 'metrics' in g and 'template_started' in g.metrics:
+        g.metrics['template'] += time.perf_counter() - g.metrics.pop('template_started')
+
+
+if signals.signals_available:
+    signals.before_render_template.connect(_template_started, app)
+    signals.template_rendered.connect(_template_rendered, app)
+
+
+class Sampler:
+    """Samples the stack of every registered thread at a fixed interval."""
+
+    def __init__(self, interval):
+        self.interval = interval
+        self._threads = {}  # thread id -> Counter of folded stacks
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name='metrics-sampler', daemon=True)
+        self._thread.start()
+
+    def start(self):
+        with self._lock:
+            self._threads[threading.get_ident()] = Counter()
+
+    def stop(self):
+        with self._lock:
+            return self._threads.pop(threading.get_ident(), Counter())
+
+    def _run(self):
+        own = threading.get_ident()
+        while True:
+            time.sleep(self.interval)
+            frames = sys._current_frames()
+            with self._lock:
+                for ident, stacks in self._threads.items():
+                    if ident != own and ident in frames:
+                        stacks[_fold(frames[ident])] += 1
+
+
+def _fold(frame):
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f'{os.path.basename(code.co_filename)}:{code.co_name}')
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+
+_sampler = None
+_sampler_lock = threading.Lock()
+
+
+def _get_sampler():
+    global _sampler
+    if app.config.get('METRICS_PROFILE_SLOW_MS') is None:
+        return None
+    with _sampler_lock:
+        if _sampler is None:
+            _sampler = Sampler(app.config.get('METRICS_PROFILE_INTERVAL_MS', 5) / 1000)
+    return _sampler
+
+
+def _dump_profile(endpoint, stacks):
+    directory = os.path.join(app.instance_path, 'profiles')
+    os.makedirs(directory, exist_ok=True)
+    with _lock, open(os.path.join(directory, f'{endpoint}.folded'), 'a') as f:
+        for stack, count in stacks.items():
+            f.write(f'{stack} {count}\n')
+
+
+@app.before_request
+def start_request():
+    if not enabled():
+        return
+    g.metrics = {'started': time.perf_counter(), 'queries': 0, 'db': 0.0, 'template': 0.0}
+    sampler = _get_sampler()
+    if sampler is not None:
+        sampler.start()
+
+
+@app.after_request
+def finish_request(response):
+    if 'metrics' not in g:
+        return response
+    metrics = g.pop('metrics')
+    elapsed = time.perf_counter() - metrics['started']
+    endpoint = request.endpoint or 'unknown'
+    inc('http_requests_total', endpoint=endpoint, method=request.method, status=response.status_code)
+    observe('http_request_duration_seconds', elapsed, DURATION_BUCKETS, endpoint=endpoint)
+    observe('http_request_queries', metrics['queries'], QUERY_BUCKETS, endpoint=endpoint)
+    inc('db_query_seconds_total', metrics['db'], endpoint=endpoint)
+    inc('template_render_seconds_total', metrics['template'], endpoint=endpoint)
+
+    response.headers.add('Server-Timing', f'app;dur={elapsed * 1000:.1f}')
+    response.headers.add('Server-Timing', f'db;dur={metrics["db"] * 1000:.1f};desc="{metrics["queries"]} queries"')
+    response.headers.add('Server-Timing', f'tpl;dur={metrics["template"] * 1000:.1f}')
+
+    sampler = _get_sampler()
+    if sampler is not None:
+        stacks = sampler.stop()
+        if elapsed * 1000 >= app.config['METRICS_PROFILE_SLOW_MS'] and stacks:
+            _dump_profile(endpoint, stacks)
+    return response
+
+
+def _format_labels(labels, **extra):
+    labels = labels + tuple(extra.items())
+    if not labels:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(key, str(value).replace('"', '\\"')) for key, value in labels) + '}'
+
+
+def render():
+    """All metrics in the Prometheus text exposition format."""
+    lines = []
+    with _lock:
+        counters = dict(_counters)
+        histograms = {key: dict(histogram, counts=list(histogram['counts'])) for key, histogram in _histograms.items()}
+    for name in sorted({name for name, _ in counters}):
+        lines.append(f'# TYPE {name} counter')
+        lines += [f'{name}{_format_labels(labels)} {value:g}' for (n, labels), value in sorted(counters.items())
+                  if n == name]
+    for name in sorted({name for name, _ in histograms}):
+        lines.append(f'# TYPE {name} histogram')
+        for (n, labels), histogram in sorted(histograms.items()):
+            if n != name:
+                continue
+            lines += [f'{name}_bucket{_format_labels(labels, le=f"{bound:g}")} {value}'
+                      for bound, value in zip(histogram['buckets'], histogram['counts'])]
+            lines.append(f'{name}_bucket{_format_labels(labels, le="+Inf")} {histogram["count"]}')
+            lines.append(f'{name}_sum{_format_labels(labels)} {histogram["sum"]:g}')
+            lines.append(f'{name}_count{_format_labels(labels)} {histogram["count"]}')
+    lines.append('# TYPE fragment_cache_requests_total counter')
+    for fragment, counts in sorted(fragments.stats().items()):
+        for result, key in (('hit', 'hits'), ('miss', 'misses')):
+            lines.append(f'fragment_cache_requests_total{{fragment="{fragment}",result="{result}"}} {counts[key]}')
+    return '\n'.join(lines) + '\n'
+
+
+@app.route('/metrics')
+def metrics():
+    if not enabled() or request.remote_addr not in app.config.get('METRICS_ALLOW', ('127.0.0.1', '::1')):
+        abort(404)
+    return app.response_class(render(), mimetype='text/plain; version=0.0.4')
@@ -0,0 +1,60 @@
+"""Schema upgrades.
+
+There is no migration framework in this project: the models are the source of truth and `upgrade()` brings
+an existing database up to date with them by creating whatever tables, nullable columns and indexes are
+missing (plus the full-text search table, which isn't part of the ORM metadata). It is idempotent, so it is
+safe to run on every deploy. Other column changes to existing tables still have to be done by hand.
+
+Data that would violate a new unique index is fixed up first by the function registered for it in
+BEFORE_INDEX.
+"""
+from sqlalchemy import inspect, text
+
+from iiit_research import db, fulltext, vocabulary
+
+BEFORE_INDEX = {
+    'ix_interest_name': vocabulary.merge_duplicates,
+}
+
+
+def _index_names(engine, inspector, table):
+    if engine.dialect.name == 'sqlite':
+        # the inspector leaves out expression indexes such as lower(name)
+        return {name for name, in engine.execute(text(
+            "SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = :table"), table=table)}
+    return {index['name'] for index in inspector.get_indexes(table)}
+
+
+def _add_columns(engine, inspector, table):
+    """Add the table's nullable columns that the database lacks. Returns their names."""
+    existing = {column['name'] for column in inspector.get_columns(table.name)}
+    added = []
+    for column in table.columns:
+        if column.name not in existing and column.nullable:
+            preparer = engine.dialect.identifier_preparer
+            with engine.begin() as conn:
+                conn.execute(text(f'ALTER TABLE {preparer.format_table(table)} ADD COLUMN '
+                                  f'{preparer.format_column(column)} {column.type.compile(engine.dialect)}'))
+            added.append(column.name)
+    return added
+
+
+def upgrade(engine=None):
+    """Create missing tables, columns and indexes. Returns what was created, e.g. 'column like.created_at'."""
+    engine = engine or db.engine
+    db.metadata.create_all(bind=engine)
+    fulltext.create_index(engine)
+
+    inspector = inspect(engine)
+    created = []
+    for table in db.metadata.sorted_tables:
+        created += [f'column {table.name}.{name}' for name in _add_columns(engine, inspector, table)]
+        existing = _index_names(engine, inspector, table.name)
+        for index in table.indexes:
+            if index.name not in existing:
+                with engine.begin() as conn:
+                    if index.name in BEFORE_INDEX:
+                        BEFORE_INDEX[index.name](conn)
+                    index.create(bind=conn)
+                created.append(f'index {index.name}')
+    return created
@@ -4,12 +4,12 @@ from flask_login import UserMixin
 from itsdangerous import TimedJSONWebSignatureSerializer as Serializer
 from sqlalchemy import CheckConstraint, UniqueConstraint
 
-from iiit_research import db, login_manager, app
+from iiit_research import db, login_manager, app, usercache, likebuffer
 
 
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
+    return usercache.load(User, int(user_id))
 
 
 # http://flask-sqlalchemy.pocoo.org/2.3/models/#many-to-many-relationships
@@ -17,14 +17,18 @@ def load_user(user_id):
 UserInterests = db.Table(
     'user_interests',
     db.Column('user_id', db.Integer, db.ForeignKey('user.id'), primary_key=True),
-    db.Column('interest_id', db.Integer, db.ForeignKey('interest.id'), primary_key=True)
+    db.Column('interest_id', db.Integer, db.ForeignKey('interest.id'), primary_key=True),
+    # search by area of interest goes interest -> users
+    db.Index('ix_user_interests_interest', 'interest_id', 'user_id')
 )
 
 # A mapping between lab and its members
 LabMembers = db.Table(
     'lab_members',
     db.Column('lab_id', db.Integer, db.ForeignKey('lab.id'), primary_key=True),
-    db.Column('user_id', db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    db.Column('user_id', db.Integer, db.ForeignKey('user.id'), primary_key=True),
+    # User.lab goes user -> labs
+    db.Index('ix_lab_members_user', 'user_id', 'lab_id')
 )
 
 
@@ -39,28 +43,32 @@ class User(db.Model, UserMixin):
     email_verify = db.Column(db.Boolean, nullable=False, default=False)
 
     # user_type can be student or professor
-    user_type = db.Column(db.String(10), nullable=False, default='student')
+    user_type = db.Column(db.String(10), nullable=False, default='student', index=True)
 
     posts = db.relationship('Post', backref='author', lazy=True)
-    interests = db.relationship('Interest', secondary=UserInterests, lazy='subquery',
+    # lazy so that load_user() stays a single SELECT; views that list interests use loaders.user_interests()
+    interests = db.relationship('Interest', secondary=UserInterests, lazy=True,
                                 backref=db.backref('users', lazy=True))
-    prof_id = db.Column(db.Integer, nullable=True)
-
-    def like_post(self, post):
-        if not self.has_liked_post(post):
-            like = Like(user_id=self.id, post_id=post.id)
-            db.session.add(like)
-
-    def unlike_post(self, post):
-        if self.has_liked_post(post):
-            Like.query.filter_by(
-                user_id=self.id,
-                post_id=post.id).delete()
+    prof_id = db.Column(db.Integer, nullable=True, index=True)
+
+    def liked_post_ids(self, post_ids):
+        """The subset of `post_ids` this user has liked, in one query."""
+        if not post_ids:
+            return set()
+        rows = db.session.query(Like.post_id).filter(Like.user_id == self.id, Like.post_id.in_(post_ids))
+        liked = {row.post_id for row in rows}
+        buffer = likebuffer.get_buffer()
+        if buffer is not None:
+            for post_id in post_ids:
+                pending = buffer.pending_state(self.id, post_id)
+                if pending is True:
+                    liked.add(post_id)
+                elif pending is False:
+                    liked.discard(post_id)
+        return liked
 
     def has_liked_post(self, post):
-        return Like.query.filter(
-            Like.user_id == self.id,
-            Like.post_id == post.id).count() > 0
+        return post.id in self.liked_post_ids([post.id])
 
     def generate_verification_token(self, expires_sec=3600):
         s = Serializer(app.config['SECRET_KEY'], expires_sec)
@@ -85,7 +93,7 @@ class Lab(db.Model):
     description = db.Column(db.Text, nullable=False)
     image = db.Column(db.String(20), nullable=True)
 
-    members = db.relationship('User', secondary=LabMembers, lazy='subquery',
+    members = db.relationship('User', secondary=LabMembers, lazy=True,
                               backref=db.backref('lab', lazy=True))
     posts = db.relationship('Post', backref='author_lab', lazy=True)
 
@@ -100,6 +108,7 @@ class Post(db.Model):
     file = db.Column(db.String(20), nullable=True)
     created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
     likes = db.relationship('Like', backref='post', lazy=True)
+    # only ever recounted from the like table in the database, see likebuffer.apply_likes()
     like_count = db.Column(db.Integer, default=0)
 
     # one of author_id or lab_id must be set TODO: add constraint
@@ -109,6 +118,15 @@ class Post(db.Model):
     # author_type can be user or lab
     author_type = db.Column(db.String(10), nullable=False, default='user')
 
+    __table_args__ = (
+        # newest-first listings, keyset paginated on (created_at, id)
+        db.Index('ix_post_created', 'created_at', 'id'),
+        # a user's/lab's posts, newest first (profiles, lab pages, timeline fan-out)
+        db.Index('ix_post_author', 'author_type', 'author_id', 'created_at', 'id'),
+        db.Index('ix_post_lab', 'author_type', 'lab_id', 'created_at', 'id'),
+        db.Index('ix_post_like_count', 'like_count'),
+    )
+
     def __repr__(self):
         return f"Post('{self.title}','{self.created_at}','{self.author_id}')"
 
@@ -124,6 +142,9 @@ class Subscription(db.Model):
 
     __table_args__ = (
         UniqueConstraint('follower', 'followee', 'followee_type', name='follower_followee_unique'),
+        # who X follows / who follows X, per followee type
+        db.Index('ix_subscription_follower', 'follower', 'followee_type', 'followee'),
+        db.Index('ix_subscription_followee', 'followee', 'followee_type', 'follower'),
     )
 
 
@@ -131,8 +152,91 @@ class Like(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     post_id = db.Column(db.Integer, db.ForeignKey('post.id'), nullable=False)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    # weighs the like in the decayed trending score (trends.py); NULL for likes made before it was recorded
+    created_at = db.Column(db.DateTime, nullable=True, default=datetime.utcnow)
     __table_args__ = (
         UniqueConstraint('post_id', 'user_id', name='post_user_like_unique'),
+        # which of these posts has the user liked
+        db.Index('ix_like_user_post', 'user_id', 'post_id'),
+    )
+
+
+class TimelineEntry(db.Model):
+    """Materialized home timeline, one row per (reader, post). Written at post/follow time."""
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    post_id = db.Column(db.Integer, db.ForeignKey('post.id'), primary_key=True)
+    # copy of Post.created_at so a page of the timeline is a single index range scan
+    created_at = db.Column(db.DateTime, nullable=False)
+
+    __table_args__ = (
+        db.Index('ix_timeline_user_created', 'user_id', 'created_at', 'post_id'),
+    )
+
+
+class TimelineState(db.Model):
+    """Users whose timeline has been materialized; the rest are rebuilt on first read."""
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    built_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+
+class TrendingScore(db.Model):
+    """Precomputed counters for /trending, maintained incrementally (see trends.py)."""
+    # kind is one of user_followers, lab_followers or post_hot
+    kind = db.Column(db.String(20), primary_key=True)
+    ref_id = db.Column(db.Integer, primary_key=True)
+    score = db.Column(db.Float, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    __table_args__ = (
+        db.Index('ix_trending_kind_score', 'kind', 'score'),
+    )
+
+
+class ChangeCounter(db.Model):
+    """Incremented with every change to a table that processes keep a copy of in memory (see socialgraph.py)."""
+    name = db.Column(db.String(40), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+
+
+class ContentVersion(db.Model):
+    """Per-tag change counters behind the ETag/Last-Modified of pages (see validators.py)."""
+    tag = db.Column(db.String(80), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+
+class Recommendation(db.Model):
+    """Precomputed "you may want to follow/read" suggestions, rebuilt by `flask build-recommendations`."""
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    # kind is one of user, lab or post
+    kind = db.Column(db.String(10), primary_key=True)
+    ref_id = db.Column(db.Integer, primary_key=True)
+    score = db.Column(db.Float, nullable=False)
+
+    __table_args__ = (
+        db.Index('ix_recommendation_user_score', 'user_id', 'kind', 'score'),
+    )
+
+
+class OutboundMail(db.Model):
+    """Durable queue of emails waiting to be sent by the mail dispatcher (see mailqueue.py)."""
+    id = db.Column(db.Integer, primary_key=True)
+    subject = db.Column(db.String(200), nullable=False)
+    sender = db.Column(db.String(120), nullable=False)
+    recipients = db.Column(db.Text, nullable=False)  # comma separated
+    body = db.Column(db.Text, nullable=False)
+
+    # status can be pending, sending, sent or failed
+    status = db.Column(db.String(10), nullable=False, default='pending')
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    next_attempt_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    claimed_by = db.Column(db.String(32), nullable=True)
+    claimed_at = db.Column(db.DateTime, nullable=True)
+    last_error = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    __table_args__ = (
+        db.Index('ix_outbound_mail_due', 'status', 'next_attempt_at'),
     )
 
 
@@ -142,6 +246,10 @@ class Interest(db.Model):
     name = db.Column(db.String(20), nullable=False)
 
 
+# names are looked up case-insensitively and new ones are inserted with OR IGNORE, see vocabulary.py
+db.Index('ix_interest_name', db.func.lower(Interest.name), unique=True)
+
+
 class PendingApproval(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     prof_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
@@ -149,5 +257,7 @@ class PendingApproval(db.Model):
     __table_args__ = (
         # Make sure a user can not follow himself.
         CheckConstraint(prof_id != student_id, name='check_student_not_prof'),
+        # also serves lookups by prof_id
         UniqueConstraint('prof_id', 'student_id', name='student_prof_unique'),
+        db.Index('ix_pending_approval_student', 'student_id'),
     )
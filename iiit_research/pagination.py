@@ -0,0 +1,73 @@
+"""Keyset (cursor) pagination on (created_at, id).
+
+Unlike `.paginate()` there is no COUNT(*) and no OFFSET: every page is a range read that starts right
+after the cursor, so page N costs the same as page 1. Cursors are opaque to templates.
+"""
+import base64
+import binascii
+from datetime import datetime
+
+
+def encode_cursor(created_at, row_id):
+    raw = f'{created_at.isoformat()}|{row_id}'.encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Returns (created_at, id) or None for a missing/garbled cursor."""
+    if not cursor:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode('utf-8')
+        created_at, row_id = raw.rsplit('|', 1)
+        return datetime.strptime(created_at, '%Y-%m-%dT%H:%M:%S.%f' if '.' in created_at
+                                 else '%Y-%m-%dT%H:%M:%S'), int(row_id)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        return None
+
+
+class KeysetPage:
+    """One page of newest-first results with cursors to the neighbouring pages."""
+
+    def __init__(self, items, next_cursor=None, prev_cursor=None):
+        self.items = items
+        self.next_cursor = next_cursor  # older items
+        self.prev_cursor = prev_cursor  # newer items
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __bool__(self):
+        return bool(self.items)
+
+
+def keyset_paginate(query, created_column, id_column, after=None, before=None, per_page=5, key=None):
+    """Paginate `query` newest first.
+
+    `after` continues to older rows past a `next_cursor`, `before` goes back to newer rows past a
+    `prev_cursor`. `key` maps a result row to its (created_at, id), by default `(row.created_at, row.id)`.
+    """
+    key = key or (lambda row: (row.created_at, row.id))
+    query = query.order_by(None)
+    after, before = decode_cursor(after), decode_cursor(before)
+
+    if before:
+        created_at, row_id = before
+        rows = query.filter((created_column > created_at)
+                            | ((created_column == created_at) & (id_column > row_id))) \
+            .order_by(created_column.asc(), id_column.asc()).limit(per_page + 1).all()
+        has_more = len(rows) > per_page
+        items = list(reversed(rows[:per_page]))
+        has_newer, has_older = has_more, True
+    else:
+        if after:
+            created_at, row_id = after
+            query = query.filter((created_column < created_at)
+                                 | ((created_column == created_at) & (id_column < row_id)))
+        rows = query.order_by(created_column.desc(), id_column.desc()).limit(per_page + 1).all()
+        items = rows[:per_page]
+        has_newer, has_older = after is not None, len(rows) > per_page
+
+    next_cursor = encode_cursor(*key(items[-1])) if items and has_older else None
+    prev_cursor = encode_cursor(*key(items[0])) if items and has_newer else None
+    return KeysetPage(items, next_cursor=next_cursor, prev_cursor=prev_cursor)
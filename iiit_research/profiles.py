@@ -0,0 +1,116 @@
+"""Everything the account and public profile pages show about a user, in one round trip.
+
+`Profile` lazily runs a single UNION ALL over the user's followers, followed users and labs, lab
+memberships, interests, professor and, for professors, their students and pending approvals. Nothing
+is queried until a template asks for one of those lists, so pages whose fragments are all cached (see
+fragments.py) don't query at all. The follower/following counts shown on the tabs come from the in-memory
+follow graph (see socialgraph.py).
+"""
+from collections import namedtuple
+
+from sqlalchemy import and_, literal, null, select, union_all
+
+from iiit_research import db, socialgraph
+from iiit_research.models import User, Lab, Interest, Subscription, PendingApproval, LabMembers, UserInterests
+
+Person = namedtuple('Person', 'id username name profile_pic')
+LabEntry = namedtuple('LabEntry', 'id name image')
+InterestEntry = namedtuple('InterestEntry', 'id name')
+
+
+def _users(relation, *where, join=None):
+    query = select([literal(relation).label('relation'), User.id, User.username, User.name,
+                    User.profile_pic.label('image')])
+    if join is not None:
+        query = query.select_from(User.__table__.join(*join))
+    return query.where(and_(*where))
+
+
+def _labs(relation, join, *where):
+    return select([literal(relation), Lab.id, null().label('username'), Lab.name, Lab.image]) \
+        .select_from(Lab.__table__.join(*join)).where(and_(*where))
+
+
+def _statement(user):
+    parts = [
+        _users('followers', Subscription.followee == user.id, Subscription.followee_type == 'user',
+               join=(Subscription, User.id == Subscription.follower)),
+        _users('following', Subscription.follower == user.id, Subscription.followee_type == 'user',
+               join=(Subscription, User.id == Subscription.followee)),
+        _labs('following_labs', (Subscription, Lab.id == Subscription.followee),
+              Subscription.follower == user.id, Subscription.followee_type == 'lab'),
+        _labs('labs', (LabMembers, Lab.id == LabMembers.c.lab_id), LabMembers.c.user_id == user.id),
+        select([literal('interests'), Interest.id, null().label('username'), Interest.name,
+                null().label('image')])
+        .select_from(Interest.__table__.join(UserInterests, Interest.id == UserInterests.c.interest_id))
+        .where(UserInterests.c.user_id == user.id),
+    ]
+    if user.prof_id is not None:
+        parts.append(_users('prof', User.id == user.prof_id))
+    if user.user_type == 'professor':
+        parts.append(_users('students', User.prof_id == user.id))
+        parts.append(_users('pending', PendingApproval.prof_id == user.id,
+                            join=(PendingApproval, User.id == PendingApproval.student_id)))
+    return union_all(*parts)
+
+
+class Profile:
+    def __init__(self, user):
+        self.user = user
+        self._lists = None
+
+    def _load(self):
+        if self._lists is None:
+            lists = {relation: [] for relation in ('followers', 'following', 'following_labs', 'labs',
+                                                   'interests', 'prof', 'students', 'pending')}
+            for relation, id_, username, name, image in db.session.execute(_statement(self.user)):
+                if relation == 'interests':
+                    lists[relation].append(InterestEntry(id_, name))
+                elif relation in ('following_labs', 'labs'):
+                    lists[relation].append(LabEntry(id_, name, image))
+                else:
+                    lists[relation].append(Person(id_, username, name, image))
+            self._lists = lists
+        return self._lists
+
+    @property
+    def followers(self):
+        return self._load()['followers']
+
+    @property
+    def following(self):
+        """Followed users, then followed labs (templates tell them apart by `username`)."""
+        return self._load()['following'] + self._load()['following_labs']
+
+    @property
+    def labs(self):
+        return self._load()['labs']
+
+    @property
+    def interests(self):
+        return self._load()['interests']
+
+    @property
+    def interest_names(self):
+        return {interest.name for interest in self.interests}
+
+    @property
+    def prof(self):
+        prof = self._load()['prof']
+        return prof[0] if prof else None
+
+    @property
+    def students(self):
+        return self._load()['students']
+
+    @property
+    def pending(self):
+        return self._load()['pending']
+
+    @property
+    def follower_count(self):
+        return socialgraph.get().follower_count(self.user.id)
+
+    @property
+    def following_count(self):
+        return socialgraph.get().following_count(self.user.id)
@@ -0,0 +1,70 @@
+"""Development-mode query budgets for views.
+
+    @query_budget(4)
+    def home(): ...
+
+counts the SQL statements a view issues for GET and HEAD requests (template rendering included); form
+submissions are not budgeted. Over budget, a warning is logged in debug mode and `QueryBudgetExceeded` is
+raised when TESTING is set, so an N+1 regression fails tests.
+Set QUERY_BUDGETS_ENABLED to force it on/off; otherwise it follows app.debug/app.testing.
+Work wrapped in `exempt()` is not counted.
+"""
+from contextlib import contextmanager
+from functools import wraps
+
+from flask import g, has_app_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from iiit_research import app
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _count_query(conn, cursor, statement, parameters, context, executemany):
+    if has_app_context() and g.get('query_count') is not None and not g.get('query_count_paused'):
+        g.query_count += 1
+
+
+@contextmanager
+def exempt():
+    """Don't charge one-off work (e.g. a lazy rebuild) to the current view's budget."""
+    paused, g.query_count_paused = g.get('query_count_paused'), True
+    try:
+        yield
+    finally:
+        g.query_count_paused = paused
+
+
+def budgets_enabled():
+    enabled = app.config.get('QUERY_BUDGETS_ENABLED')
+    if enabled is None:
+        return app.debug or app.testing
+    return enabled
+
+
+def query_budget(limit):
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if not budgets_enabled() or request.method not in ('GET', 'HEAD'):
+                return view(*args, **kwargs)
+            g.query_count = 0
+            try:
+                rv = view(*args, **kwargs)
+                used = g.query_count
+            finally:
+                g.query_count = None
+            if used > limit:
+                message = f'{request.endpoint} issued {used} queries, budget is {limit}'
+                if app.testing:
+                    raise QueryBudgetExceeded(message)
+                app.logger.warning(message)
+            return rv
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,194 @@
+"""Suggested people, labs and posts, computed in batch from interests, follows and likes.
+
+`flask build-recommendations` (run it periodically, like `flask reconcile-trending`) loads the graph into
+sparse matrices and scores every candidate for a block of users at a time with a few matrix products:
+
+* people: cosine similarity of interests (weighted by inverse popularity, so a shared niche interest counts
+  more than a shared popular one), plus how many of the people you follow follow them;
+* labs: similarity of your interests with those of the lab's members, plus follows by the people you follow;
+* posts from the last POST_WINDOW that you wouldn't see in your feed: similarity of your interests with the
+  author's, plus likes by the people you follow, decayed by age.
+
+Whatever you already follow, belong to, wrote or liked is left out. The top few per kind are stored in the
+`recommendation` table, which /home reads with one indexed query.
+
+NumPy and SciPy are optional: without them the table stays empty and no suggestions are shown.
+"""
+import time
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+from sqlalchemy import and_, select
+
+from iiit_research import db, fragments, socialgraph
+from iiit_research.models import User, Lab, Post, Like, Subscription, Recommendation, UserInterests, LabMembers
+
+try:
+    import numpy as np
+    from scipy import sparse
+except ImportError:
+    np = sparse = None
+
+KEEP = {'user': 10, 'lab': 5, 'post': 10}  # stored per user and kind
+POST_WINDOW = timedelta(days=30)
+POST_HALF_LIFE = timedelta(days=7)
+FOLLOW_WEIGHT = 0.5  # weight of log(1 + follows/likes by people you follow), next to interest similarity
+BLOCK = 1024  # users scored at once; the dense score blocks are BLOCK x (users or posts) float32
+
+Suggestion = namedtuple('Suggestion', 'kind id name username image')
+
+
+def available():
+    return sparse is not None
+
+
+def _index(ids):
+    return {id_: i for i, id_ in enumerate(ids)}
+
+
+def _matrix(pairs, rows, cols, shape):
+    """Binary CSR matrix with a 1 at (rows[a], cols[b]) for every (a, b) in `pairs` whose ids are known."""
+    pairs = [(rows[a], cols[b]) for a, b in pairs if a in rows and b in cols]
+    data = np.ones(len(pairs), dtype=np.float32)
+    r, c = zip(*pairs) if pairs else ((), ())
+    matrix = sparse.csr_matrix((data, (r, c)), shape=shape)
+    matrix.sum_duplicates()
+    matrix.data[:] = 1
+    return matrix
+
+
+def _normalize(matrix):
+    norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel()).astype(np.float32)
+    norms[norms == 0] = 1
+    return sparse.diags(1 / norms).dot(matrix).tocsr().astype(np.float32)
+
+
+def _top(scores, excluded, keep):
+    """Arrays of (row, column, score) of the `keep` best positive, not excluded scores in every row."""
+    scores[excluded.nonzero()] = 0
+    keep = min(keep, scores.shape[1])
+    if keep == 0:
+        return np.array([], dtype=int), np.array([], dtype=int), np.array([])
+    best = np.argpartition(-scores, keep - 1, axis=1)[:, :keep]
+    best_scores = np.take_along_axis(scores, best, axis=1)
+    rows, cols = np.nonzero(best_scores > 0)
+    return rows, best[rows, cols], best_scores[rows, cols]
+
+
+def _rows(query):
+    return db.session.execute(query).fetchall()
+
+
+def _load(now):
+    since = now - POST_WINDOW
+    user_ids = [id_ for id_, in _rows(select([User.id]).order_by(User.id))]
+    lab_ids = [id_ for id_, in _rows(select([Lab.id]).order_by(Lab.id))]
+    interest_ids = [id_ for id_, in _rows(select([UserInterests.c.interest_id]).distinct()
+                                          .order_by(UserInterests.c.interest_id))]
+    posts = _rows(select([Post.id, Post.author_type, Post.author_id, Post.lab_id, Post.created_at])
+                  .where(Post.created_at >= since).order_by(Post.id))
+    users, labs, interests = _index(user_ids), _index(lab_ids), _index(interest_ids)
+    post_index = _index([post.id for post in posts])
+    n_users, n_labs, n_posts = len(user_ids), len(lab_ids), len(posts)
+
+    follows = _rows(select([Subscription.follower, Subscription.followee, Subscription.followee_type]))
+    likes = _rows(select([Like.user_id, Like.post_id]).select_from(Like.__table__.join(Post.__table__))
+                  .where(Post.created_at >= since))
+    return {
+        'user_ids': np.array(user_ids), 'lab_ids': np.array(lab_ids), 'post_ids': np.array(list(post_index)),
+        'interests': _matrix(_rows(select([UserInterests.c.user_id, UserInterests.c.interest_id])), users,
+                             interests, (n_users, len(interest_ids))),
+        'members': _matrix(_rows(select([LabMembers.c.user_id, LabMembers.c.lab_id])), users, labs,
+                           (n_users, n_labs)),
+        'follows': _matrix([(a, b) for a, b, kind in follows if kind == 'user'], users, users, (n_users, n_users)),
+        'lab_follows': _matrix([(a, b) for a, b, kind in follows if kind == 'lab'], users, labs, (n_users, n_labs)),
+        'likes': _matrix(likes, users, post_index, (n_users, n_posts)),
+        'user_posts': _matrix([(p.author_id, p.id) for p in posts if p.author_type == 'user'], users, post_index,
+                              (n_users, n_posts)),
+        'lab_posts': _matrix([(p.lab_id, p.id) for p in posts if p.author_type == 'lab'], labs, post_index,
+                             (n_labs, n_posts)),
+        'age_days': np.array([(now - p.created_at).total_seconds() / 86400 for p in posts], dtype=np.float32),
+    }
+
+
+def compute(now=None):
+    """Yield (kind, user ids, suggested ids, scores) arrays with every user's best suggestions, a block at a time."""
+    now = now or datetime.utcnow()
+    m = _load(now)
+    interests = m['interests']
+    # inverse user frequency, so a shared niche interest says more than a shared popular one
+    frequency = np.asarray(interests.sum(axis=0)).ravel()
+    weights = np.log((1 + interests.shape[0]) / (1 + frequency)) + 1
+    profiles = _normalize(interests.dot(sparse.diags(weights.astype(np.float32))))
+    lab_profiles = _normalize(m['members'].T.dot(profiles))
+    post_profiles = _normalize(m['user_posts'].T.dot(profiles) + m['lab_posts'].T.dot(lab_profiles))
+    # interest vocabularies are small, so the right-hand sides are kept dense for fast sparse x dense products
+    people_rhs = profiles.T.toarray()
+    lab_rhs = lab_profiles.T.toarray()
+    post_rhs = post_profiles.T.toarray()
+    freshness = (0.5 ** (m['age_days'] / (POST_HALF_LIFE / timedelta(days=1)))).astype(np.float32)
+
+    follows, lab_follows = m['follows'], m['lab_follows']
+    for start in range(0, len(m['user_ids']), BLOCK):
+        block = slice(start, start + BLOCK)
+        mine, followed = profiles[block], follows[block]
+        ids = m['user_ids'][block]
+
+        scores = mine.dot(people_rhs) + FOLLOW_WEIGHT * np.log1p(followed.dot(follows).toarray())
+        excluded = followed + sparse.eye(scores.shape[0], scores.shape[1], k=start, format='csr')
+        rows, cols, best = _top(scores, excluded, KEEP['user'])
+        yield 'user', ids[rows], m['user_ids'][cols], best
+
+        scores = mine.dot(lab_rhs) + FOLLOW_WEIGHT * np.log1p(followed.dot(lab_follows).toarray())
+        excluded = lab_follows[block] + m['members'][block]
+        rows, cols, best = _top(scores, excluded, KEEP['lab'])
+        yield 'lab', ids[rows], m['lab_ids'][cols], best
+
+        scores = (mine.dot(post_rhs) + FOLLOW_WEIGHT * np.log1p(followed.dot(m['likes']).toarray())) * freshness
+        excluded = (followed + sparse.eye(scores.shape[0], len(m['user_ids']), k=start, format='csr')) \
+            .dot(m['user_posts']) + lab_follows[block].dot(m['lab_posts']) + m['likes'][block]
+        rows, cols, best = _top(scores, excluded, KEEP['post'])
+        yield 'post', ids[rows], m['post_ids'][cols], best
+
+
+def rebuild():
+    """Replace the stored suggestions with freshly computed ones. Returns (rows, seconds)."""
+    started = time.perf_counter()
+    table = Recommendation.__table__
+    conn = db.session.connection()
+    conn.execute(table.delete())
+    count = 0
+    for kind, user_ids, ref_ids, scores in compute():
+        if len(user_ids):
+            conn.execute(table.insert(), [{'user_id': user_id, 'kind': kind, 'ref_id': ref_id, 'score': score}
+                                          for user_id, ref_id, score in
+                                          zip(user_ids.tolist(), ref_ids.tolist(), scores.tolist())])
+            count += len(user_ids)
+    fragments.touch(db.session, 'recommendations')
+    db.session.commit()
+    return count, time.perf_counter() - started
+
+
+def for_user(user_id):
+    """The user's stored suggestions, best first per kind, minus anything they have followed since."""
+    rec = Recommendation.__table__
+    user, lab, post = User.__table__, Lab.__table__, Post.__table__
+    query = select([rec.c.kind, rec.c.ref_id, user.c.name, user.c.username, user.c.profile_pic, lab.c.name,
+                    lab.c.image, post.c.title]) \
+        .select_from(rec.outerjoin(user, and_(rec.c.kind == 'user', user.c.id == rec.c.ref_id))
+                     .outerjoin(lab, and_(rec.c.kind == 'lab', lab.c.id == rec.c.ref_id))
+                     .outerjoin(post, and_(rec.c.kind == 'post', post.c.id == rec.c.ref_id))) \
+        .where(rec.c.user_id == user_id) \
+        .order_by(rec.c.kind, rec.c.score.desc())
+    graph = socialgraph.get()
+    suggestions = []
+    for kind, ref_id, user_name, username, profile_pic, lab_name, lab_image, title in db.session.execute(query):
+        if kind != 'post' and graph.is_following(user_id, ref_id, kind):
+            continue
+        if kind == 'user' and username is not None:
+            suggestions.append(Suggestion(kind, ref_id, user_name, username, profile_pic))
+        elif kind == 'lab' and lab_name is not None:
+            suggestions.append(Suggestion(kind, ref_id, lab_name, None, lab_image))
+        elif kind == 'post' and title is not None:
+            suggestions.append(Suggestion(kind, ref_id, title, None, None))
+    return suggestions
@@ -1,48 +1,33 @@
-import os
-import secrets
-
-from flask import render_template, url_for, flash, redirect, request
+from flask import render_template, url_for, flash, redirect, request, abort
 from flask_login import login_user, current_user, logout_user, login_required
 from flask_mail import Message
 
-from iiit_research import app, db, bcrypt, mail
+from iiit_research import app, db, bcrypt, timeline, loaders, querycount, usercache, fulltext, trends, \
+    likebuffer, mailqueue, uploads, images, fragments, profiles, recommendations, vocabulary, \
+    socialgraph, actions, validators
 from iiit_research.forms import RegistrationForm, CreateLabForm, LoginForm, UpdateAccountForm, PostForm, SearchForm, \
     RequestResetForm, ResetPasswordForm
-from iiit_research.models import User, Post, Subscription, Interest, Lab, PendingApproval
+from iiit_research.models import User, Post, Lab, PendingApproval, TimelineEntry
+from iiit_research.pagination import keyset_paginate
 
 
 @app.route("/home")
 @login_required
+@querycount.query_budget(4)
 def home():
-    user_query = db.session.query(User.id, User.username, User.name)
-    join_on_user_query = user_query.join(Subscription, User.id == Subscription.followee)
-    user_following = join_on_user_query.filter((Subscription.follower == current_user.id)
-                                               & (Subscription.followee_type == "user")).all()
-    # FIXME: this is gonna get real ugly real soon.
-    user_following_ids = []
-    for user in user_following:
-        user_following_ids.append(user.id)
-
-    lab_query = db.session.query(Lab.id, Lab.name)
-    join_on_lab_query = lab_query.join(Subscription, Lab.id == Subscription.followee)
-    lab_following = join_on_lab_query.filter((Subscription.follower == current_user.id)
-                                             & (Subscription.followee_type == "lab")).all()
-    lab_following_ids = []
-    for lab in lab_following:
-        lab_following_ids.append(lab.id)
-
-    page = request.args.get('page', 1, type=int)
-
-    # &, | can be used inside filter boz
-    # SQLAlchemy overloads the bitwise operators &, | and ~
-    # so instead of the ugly and hard-to-read prefix syntax with or_() and and_() we can use these operators:
-    # source: https://stackoverflow.com/a/14185275/5463404
-    posts = Post.query.filter(((Post.author_type == "lab") & (Post.lab_id.in_(lab_following_ids)))
-                              | ((Post.author_type == "user") & (Post.author_id.in_(user_following_ids)))).order_by(
-        Post.created_at.desc()).paginate(page=page,
-                                         per_page=5)
-
-    return render_template('home.html', title='Home', posts=posts)
+    if not timeline.is_built(current_user.id):
+        # fallback for users whose timeline has never been materialized
+        with querycount.exempt():
+            timeline.rebuild(current_user.id)
+            db.session.commit()
+
+    # the feed is written at post/follow time (see timeline.py), so this is one indexed slice
+    query = timeline.query(current_user.id).options(*loaders.post_authors())
+    posts = keyset_paginate(query, TimelineEntry.created_at, TimelineEntry.post_id,
+                            after=request.args.get('after'), before=request.args.get('before'), per_page=5)
+
+    recommended = fragments.deferred(recommendations.for_user, current_user.id)
+    return render_template('home.html', title='Home', posts=posts, recommended=recommended)
 
 
 @app.route("/about")
@@ -53,13 +38,24 @@ def about():
 
 @app.route("/posts")
 @login_required
+@querycount.query_budget(3)
 def post():
-    posts = Post.query.all()
-    return render_template('posts.html', posts=posts, title='Posts')
+    posts = keyset_paginate(Post.query.options(*loaders.post_authors()), Post.created_at, Post.id,
+                            after=request.args.get('after'), before=request.args.get('before'), per_page=10)
+    liked_post_ids = current_user.liked_post_ids([post.id for post in posts])
+    return render_template('posts.html', posts=posts, liked_post_ids=liked_post_ids, title='Posts')
+
+
+def post_tags(post_id):
+    if not post_id.isdigit():
+        return None
+    return [f'post:{int(post_id)}', 'user_names', 'labs']
 
 
 @app.route("/posts/<post_id>")
 @login_required
+@querycount.query_budget(4)
+@validators.conditional(post_tags)
 def post_detail(post_id):
     """Displays a single post."""
     # TODO: change to use slug instead of id
@@ -74,25 +70,7 @@ def send_verify_email(user):
     msg.body = f'''To verify your email address, visit the following link:
     {url_for('verify_email', token=token, _external=True)}
     If you did not make this request then simply ignore this email and no changes will be made.'''
-    mail.send(msg)
-
-
-def get_list_from_aoi(form_interests):
-    interests = set()
-    for aoi in form_interests:
-        i = Interest.query.filter(Interest.name == aoi).first()
-        if not i:
-            if aoi:
-                for item in aoi.strip(", ").split(","):
-                    item.strip(", ")
-                    i = Interest.query.filter(Interest.name == item).first()
-                    if not i:
-                        i = Interest(name=item)
-                    interests.add(i)
-        else:
-            interests.add(i)
-
-    return list(interests)
+    mailqueue.enqueue(msg)
 
 
 @app.route("/register", methods=['GET', 'POST'])
@@ -102,22 +80,21 @@ def register():
     form = RegistrationForm()
     if form.validate_on_submit():
         hashed_password = bcrypt.generate_password_hash(form.password.data).decode('utf-8')
-        interests = get_list_from_aoi(request.form.getlist('aoi'))
+        interests = vocabulary.resolve(request.form.getlist('aoi'))
 
         user = User(name=form.name.data, username=form.username.data,
                     email=form.email.data, password=hashed_password,
                     interests=interests, user_type=form.user_type.data)
 
         db.session.add(user)
+        db.session.flush()
+        send_verify_email(user)
         db.session.commit()
         flash(f'Your account is created! You can login Now.', 'success')
-        send_verify_email(user)
         return redirect(url_for('login'))
     # else:
     #     flash(f'Wrong information!', 'danger')
-    # interests = db.session.query(Interest.name).all()
-    interests = Interest.query.all()
-    return render_template('register.html', title='Register', form=form, area_of_interests=interests)
+    return render_template('register.html', title='Register', form=form, area_of_interests=vocabulary.terms())
 
 
 @app.route("/login", methods=['GET', 'POST'])
@@ -146,17 +123,15 @@ def logout():
 
 
 def save_pic(form_pic):
-    random_hex = secrets.token_hex(8)
-    fname, fext = os.path.splitext(form_pic.filename)
-    pic_fn = random_hex + fext
-    pic_path = os.path.join(app.root_path, 'static/profile_pics/', pic_fn)
-    form_pic.save(pic_path)
+    pic_fn = uploads.store(form_pic, 'profile_pics')
+    images.schedule('profile_pics', pic_fn)
     return pic_fn
 
 
 @app.route("/", methods=['GET', 'POST'])
 @app.route("/account", methods=['GET', 'POST'])
 @login_required
+@querycount.query_budget(6)
 def account():
     form = UpdateAccountForm()
     if form.validate_on_submit():
@@ -168,7 +143,7 @@ def account():
         if form.password.data:
             hashed_password = bcrypt.generate_password_hash(form.password.data).decode('utf-8')
             current_user.password = hashed_password
-        interests = get_list_from_aoi(request.form.getlist('aoi'))
+        interests = vocabulary.resolve(request.form.getlist('aoi'))
         current_user.interests = interests
         if form.about_me.data:
             current_user.about_me = form.about_me.data
@@ -194,6 +169,7 @@ def account():
         if form.lablist.data:
             current_user.lab.append(form.lablist.data)
         db.session.commit()
+        usercache.invalidate(current_user.id)
         flash('Your information has been updated!', 'success')
         return redirect(url_for('account'))
     elif request.method == 'GET':
@@ -204,45 +180,23 @@ def account():
         form.about_me.data = current_user.about_me
         form.prof_email.data = ''
 
-    # TODO: optimize join
-    query = db.session.query(User.username, User.name, User.profile_pic)
-    join_query = query.join(Subscription, User.id == Subscription.follower)
-    followers = join_query.filter((Subscription.followee == current_user.id)
-                                  & (Subscription.followee_type == "user")).all()
+    # the lists are loaded by a single query, and only if a fragment needs them, see profiles.py
+    profile = profiles.Profile(current_user)
+    posts = user_posts_page(current_user)
+    profile_pic = images.image_url('profile_pics', current_user.profile_pic, 'medium')
+    return render_template('account.html', title='Account', profile_pic=profile_pic, form=form, profile=profile,
+                           user=current_user, area_of_interests=vocabulary.terms(), posts=posts)
 
-    query_user = db.session.query(User.username, User.name, User.profile_pic)
-    join_query = query_user.join(Subscription, User.id == Subscription.followee)
-    following_users = join_query.filter((Subscription.follower == current_user.id)
-                                        & (Subscription.followee_type == "user")).all()
 
-    query_lab = db.session.query(Lab.id, Lab.name, Lab.image)
-    join_query = query_lab.join(Subscription, Lab.id == Subscription.followee)
-    following_labs = join_query.filter((Subscription.follower == current_user.id)
-                                       & (Subscription.followee_type == "lab")).all()
-
-    following = following_users + following_labs
-
-    interests = Interest.query.all()
-
-    query = db.session.query(User.id, User.username, User.name, User.profile_pic)
-    join_query = query.join(PendingApproval, User.id == PendingApproval.student_id)
-    pending_student_approval_list = join_query.filter(PendingApproval.prof_id == current_user.id).all()
-
-    proff = User.query.filter_by(id=current_user.prof_id).first()
-    students = User.query.filter_by(prof_id=current_user.id).all()
-    profile_pic = url_for('static', filename='profile_pics/' + current_user.profile_pic)
-    return render_template('account.html', title='Account', profile_pic=profile_pic, form=form, followers=followers,
-                           following=following, user=current_user, area_of_interests=interests,
-                           pendingStudentApprovalList=pending_student_approval_list, students=students, prof=proff)
+def user_posts_page(user):
+    """Page of posts written by `user` for the profile_components/posts.html tab."""
+    query = Post.query.filter((Post.author_type == "user") & (Post.author_id == user.id))
+    return keyset_paginate(query, Post.created_at, Post.id,
+                           after=request.args.get('after'), before=request.args.get('before'), per_page=10)
 
 
 def save_file(form_file):
-    random_hex = secrets.token_hex(8)
-    fname, fext = os.path.splitext(form_file.filename)
-    file_fn = random_hex + fext
-    file_path = os.path.join(app.root_path, 'static/files/', file_fn)
-    form_file.save(file_path)
-    return file_fn
+    return uploads.store(form_file, 'files')
 
 
 @app.route("/post/new", methods=['GET', 'POST'])
@@ -265,69 +219,50 @@ def new_post():
         else:  # current user is a student
             post = Post(title=form.title.data, content=form.content.data, author=current_user, author_type="user",
                         file=data_file)
-        print(data_file)
         db.session.add(post)
+        db.session.flush()
+        timeline.fan_out_post(post)
         db.session.commit()
         flash('Your post has been created!', 'success')
         return redirect(url_for('home'))
     return render_template('create_post.html', title='New Post', form=form)
 
 
+def profile_tags(username):
+    user_id = db.session.query(User.id).filter_by(username=username).scalar()
+    if user_id is None:
+        return None
+    return [f'user:{user_id}', f'interests:{user_id}', 'interests', f'followers:{user_id}', f'following:{user_id}',
+            f'posts_of:user:{user_id}', 'user_names', 'labs', f'following:{current_user.id}']
+
+
 @app.route("/user/<username>")
 @login_required
+@querycount.query_budget(6)
+@validators.conditional(profile_tags)
 def public_profile(username):
     """ Displays user's public profile """
     user = User.query.filter_by(username=username).first()
 
     if not user:
-        from flask import abort
         abort(404)
 
-    # TODO: optimize join
-    query = db.session.query(User.username, User.name, User.profile_pic)
-    join_query = query.join(Subscription, User.id == Subscription.follower)
-    followers = join_query.filter((Subscription.followee == user.id)
-                                  & (Subscription.followee_type == "user")).all()
+    # specifies whether currently logged in user follows this user
+    is_following = current_user.is_authenticated and socialgraph.get().is_following(current_user.id, user.id)
 
-    query_user = db.session.query(User.username, User.name, User.profile_pic)
-    join_query = query_user.join(Subscription, User.id == Subscription.followee)
-    following_users = join_query.filter((Subscription.follower == user.id)
-                                        & (Subscription.followee_type == "user")).all()
+    posts = user_posts_page(user)
 
-    query_lab = db.session.query(Lab.id, Lab.name, Lab.image)
-    join_query = query_lab.join(Subscription, Lab.id == Subscription.followee)
-    following_labs = join_query.filter((Subscription.follower == user.id)
-                                       & (Subscription.followee_type == "lab")).all()
+    return render_template('profile.html', user=user, profile=profiles.Profile(user),
+                           is_following=is_following, posts=posts)
 
-    following = following_users + following_labs
-
-    is_following = False  # specifies whether currently logged in user follows this user
-    if current_user.is_authenticated:
-        from sqlalchemy import and_
-        is_following = db.session.query(
-            db.exists().where(
-                and_(Subscription.follower == current_user.id,
-                     Subscription.followee == user.id))).scalar()
 
-    prof = User.query.filter_by(id=current_user.prof_id).first()
-
-    return render_template('profile.html',
-                           user=user,
-                           followers=followers, following=following,
-                           is_following=is_following, prof=prof)
-
-
-@app.route('/follow_action/<user_id>/<action>/<followee_type>')
+@app.route('/follow_action/<int:user_id>/<action>/<followee_type>')
 @login_required
 def follow_action(user_id, action, followee_type):
-    if action == 'follow':
-        row = Subscription(follower=current_user.id, followee=user_id, followee_type=followee_type)
-        db.session.add(row)
-        db.session.commit()
-    if action == 'unfollow':
-        row = Subscription.query.filter_by(follower=current_user.id, followee=user_id,
-                                           followee_type=followee_type).first_or_404()
-        db.session.delete(row)
+    if followee_type not in socialgraph.KINDS:
+        return redirect(request.referrer)
+    if action in ('follow', 'unfollow'):
+        actions.follow(current_user.id, {(user_id, followee_type): action == 'follow'})
         db.session.commit()
 
     return redirect(request.referrer)
@@ -342,6 +277,7 @@ def approve_request(user_id, action):
         row = PendingApproval.query.filter_by(prof_id=current_user.id, student_id=user_id).first_or_404()
         db.session.delete(row)
         db.session.commit()
+        usercache.invalidate(user.id)
     if action == 'delete':
         row = PendingApproval.query.filter_by(prof_id=current_user.id, student_id=user_id).first_or_404()
         db.session.delete(row)
@@ -354,31 +290,32 @@ def approve_request(user_id, action):
 @login_required
 def like_action(post_id, action):
     post = Post.query.get_or_404(post_id)
-    if action == 'like':
-        current_user.like_post(post)
-        post.like_count += 1
-        db.session.commit()
+    if action not in ('like', 'unlike'):
+        return redirect(request.referrer)
 
-    if action == 'unlike':
-        current_user.unlike_post(post)
-        post.like_count -= 1
-        db.session.commit()
+    buffer = likebuffer.get_buffer()
+    if buffer is not None:
+        # coalesced with other clicks and applied by the next batched flush
+        buffer.record(current_user.id, post.id, action == 'like')
+        return redirect(request.referrer)
+
+    actions.like(current_user.id, {post.id: action == 'like'})
+    db.session.commit()
     return redirect(request.referrer)
 
 
 @app.route('/labs')
 @login_required
+@querycount.query_budget(3)
+@validators.conditional(lambda: ['labs', 'lab_members', 'user_names'])
 def labs():
-    labs = Lab.query.all()
+    labs = Lab.query.options(*loaders.lab_members()).all()
     return render_template('labs.html', labs=labs)
 
 
 def save_lab_image(form_pic):
-    random_hex = secrets.token_hex(8)
-    fname, fext = os.path.splitext(form_pic.filename)
-    pic_fn = random_hex + fext
-    pic_path = os.path.join(app.root_path, 'static/lab_images/', pic_fn)
-    form_pic.save(pic_path)
+    pic_fn = uploads.store(form_pic, 'lab_images')
+    images.schedule('lab_images', pic_fn)
     return pic_fn
 
 
@@ -402,42 +339,43 @@ def create_lab():
     return render_template('create_lab.html', title='New Lab', form=form)
 
 
+def lab_tags(lab_id):
+    if not lab_id.isdigit():
+        return None
+    lab_id = int(lab_id)
+    return [f'lab:{lab_id}', f'lab_members:{lab_id}', f'posts_of:lab:{lab_id}', 'user_names',
+            f'following:{current_user.id}']
+
+
 @app.route('/labs/<lab_id>')
 @login_required
+@querycount.query_budget(4)
+@validators.conditional(lab_tags)
 def lab_detail(lab_id):
+    # lab.members is loaded by the lab_members fragment, and only when it isn't cached
     lab = Lab.query.get_or_404(lab_id)
 
-    is_following = False  # specifies whether currently logged in user follows this lab
-    if current_user.is_authenticated:
-        from sqlalchemy import and_
-        is_following = db.session.query(
-            db.exists().where(
-                and_(Subscription.follower == current_user.id,
-                     Subscription.followee == lab.id))).scalar()
+    # specifies whether currently logged in user follows this lab
+    is_following = current_user.is_authenticated and \
+        socialgraph.get().is_following(current_user.id, lab.id, 'lab')
+
+    posts = keyset_paginate(Post.query.filter((Post.author_type == "lab") & (Post.lab_id == lab.id)),
+                            Post.created_at, Post.id,
+                            after=request.args.get('after'), before=request.args.get('before'), per_page=10)
 
-    return render_template('lab_detail.html', lab=lab, is_following=is_following)
+    return render_template('lab_detail.html', lab=lab, is_following=is_following, posts=posts)
 
 
 @app.route('/trending')
 @login_required
+@querycount.query_budget(5)
 def trending():
-    top_5_posts = Post.query.order_by(Post.like_count.desc()).limit(5)
-
-    from sqlalchemy.sql.functions import func
-    from sqlalchemy import desc
-
-    # SELECT id,username,name, followee, followee_type, count(follower) AS num_followers
-    # FROM subscription,user
-    # GROUP BY followee
-    # ORDER BY num_followers desc
-    # LIMIT 5
-    most_followed = db.session.query(User.id, User.username, User.name, Subscription.followee,
-                                     Subscription.followee_type,
-                                     func.count(Subscription.follower).label('num_followers')) \
-        .filter((Subscription.followee_type == "user") & (Subscription.followee == User.id)) \
-        .group_by(Subscription.followee) \
-        .order_by(desc('num_followers')).limit(5)
-    return render_template('trending.html', most_liked_works=top_5_posts, most_followed=most_followed)
+    top_5_posts = Post.query.options(*loaders.post_authors()).order_by(Post.like_count.desc()).limit(5)
+    # the rest is served from counters maintained at write time, see trends.py
+    return render_template('trending.html', most_liked_works=top_5_posts,
+                           trending_works=fragments.deferred(trends.trending_posts, 5, options=loaders.post_authors()),
+                           most_followed=fragments.deferred(trends.most_followed_users, 5),
+                           most_followed_labs=fragments.deferred(trends.most_followed_labs, 5))
 
 
 @app.route('/verify/<token>', methods=['GET', 'POST'])
@@ -450,6 +388,7 @@ def verify_email(token):
         flash('Your email is verified', 'success')
         current_user.email_verify = True
         db.session.commit()
+        usercache.invalidate(current_user.id)
 
     return render_template('verify.html', title='Email Verification')
 
@@ -457,24 +396,13 @@ def verify_email(token):
 @app.route("/search", methods=['GET', 'POST'])
 @login_required
 def search():
-    form = SearchForm()
-    results = set()
-    if form.validate_on_submit():
-        search_for = form.search_for.data
-        query = form.query.data
-        if search_for == "student":
-            results.update(User.query.filter(User.user_type == "student")
-                           .filter(User.name.like('%{0}%'.format(query))))
-        elif search_for == "professor":
-            results.update(
-                User.query.filter(User.user_type == "professor")
-                    .filter(User.name.like('%{0}%'.format(query))))
-        elif search_for == "lab":
-            results.update(Lab.query.filter(Lab.name.like('%{0}%'.format(query))))
-        elif search_for == "area_of_interest":
-            interests = Interest.query.filter(Interest.name.like('%{0}%'.format(query))).all()
-            for interest in interests:
-                results.update(interest.users)
+    # a plain GET form, so that result pages can link to each other
+    form = SearchForm(request.args, meta={'csrf': False})
+    results = None
+    if request.args and form.validate():
+        results = fulltext.search(form.search_for.data, form.query.data,
+                                  page=request.args.get('page', 1, type=int),
+                                  per_page=app.config.get('SEARCH_PER_PAGE', 20))
     return render_template('search.html', title='Search', form=form, results=results, result_type=form.search_for.data)
 
 
@@ -485,7 +413,7 @@ def send_reset_email(user):
     msg.body = f'''To reset your password, visit the following link:
     {url_for('reset_token', token=token, _external=True)}
     If you did not make this request then simply ignore this email and no changes will be made.'''
-    mail.send(msg)
+    mailqueue.enqueue(msg)
 
 
 @app.route("/reset_password", methods=['GET', 'POST'])
@@ -496,6 +424,7 @@ def reset_request():
     if form.validate_on_submit():
         user = User.query.filter_by(email=form.email.data).first()
         send_reset_email(user)
+        db.session.commit()
         flash('An email has been sent with instructions to reset your password.', 'info')
         return redirect(url_for('login'))
     return render_template('reset_request.html', title='Reset Password', form=form)
@@ -514,6 +443,7 @@ def reset_token(token):
         hashed_password = bcrypt.generate_password_hash(form.password.data).decode('utf-8')
         user.password = hashed_password
         db.session.commit()
+        usercache.invalidate(user.id)
         flash('Your password has been updated! You are now able to log in', 'success')
         return redirect(url_for('login'))
     return render_template('reset_token.html', title='Reset Password', form=form)
@@ -0,0 +1,169 @@
+"""Production server: a master process that forks worker processes, each serving requests on a pool of threads.
+
+    python -m iiit_research.server [--bind 127.0.0.1:8000] [--workers 4] [--threads 4] [--no-preload] [--quiet]
+
+The master imports the app, opens the listening socket and, unless --no-preload, does the start-up work of
+warmup.preload() once. The workers are forked from it and accept connections from the shared socket; a worker
+only accepts while one of its threads is free, so busy workers leave new connections to idle ones. A worker
+that dies is replaced. SIGTERM or Ctrl-C stops the workers after their current requests, and they flush
+their buffered likes before exiting.
+
+With more than one worker the caches (cache.make_cache) default to one SQLite file on tmpfs (/dev/shm),
+shared by every worker, so a user or fragment invalidated in one worker is invalidated in all of them. The
+file is new for every start of the server and removed when the master exits. Set CACHE_BACKEND = 'lru' to
+keep per-process caches, or CACHE_PATH to use another file.
+
+Any other WSGI server can run the app instead, e.g. `gunicorn --preload -w 4 --threads 4 iiit_research:app`.
+"""
+import argparse
+import logging
+import os
+import signal
+import socket
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from werkzeug.serving import BaseWSGIServer
+
+from iiit_research import app, likebuffer, warmup
+
+SHARED_MEMORY = '/dev/shm'
+BACKLOG = 1024
+RESPAWN_DELAY = 1.0  # seconds to wait before replacing a worker that failed
+
+
+class PooledWSGIServer(BaseWSGIServer):
+    """Werkzeug's WSGI server on an inherited socket, handling each connection on one of `threads` threads."""
+
+    multithread = True
+
+    def __init__(self, host, app, fd, threads, multiprocess=False):
+        super().__init__(host, 0, app, fd=fd)
+        self.multiprocess = multiprocess
+        self._pool = ThreadPoolExecutor(threads, thread_name_prefix='request')
+        self._free = threading.Semaphore(threads)
+
+    def process_request(self, request, client_address):
+        self._free.acquire()
+        self._pool.submit(self._handle, request, client_address)
+
+    def _handle(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+            self._free.release()
+
+    def server_close(self):
+        self._pool.shutdown()
+        super().server_close()
+
+
+def _stop(signum, frame):
+    raise SystemExit(0)
+
+
+def _share_caches(app):
+    """Default every cache to one SQLite file on tmpfs. Returns the file's path if it is ours to remove."""
+    app.config.setdefault('CACHE_BACKEND', 'sqlite')
+    if app.config['CACHE_BACKEND'] != 'sqlite' or app.config.get('CACHE_PATH'):
+        return None
+    directory = SHARED_MEMORY if os.access(SHARED_MEMORY, os.W_OK) else tempfile.gettempdir()
+    app.config['CACHE_PATH'] = os.path.join(directory, f'iiit_research-{os.getpid()}.cache')
+    return app.config['CACHE_PATH']
+
+
+def _work(app, listener, host, threads, multiprocess):
+    """Run one worker until SIGTERM. Returns its exit code."""
+    signal.signal(signal.SIGTERM, _stop)
+    # Ctrl-C reaches the whole process group; the master turns it into SIGTERM
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.pthread_sigmask(signal.SIG_UNBLOCK, {signal.SIGTERM, signal.SIGINT})
+    server = PooledWSGIServer(host, app, listener.fileno(), threads, multiprocess)
+    try:
+        server.serve_forever()
+    except SystemExit:
+        pass
+    finally:
+        buffer = likebuffer.get_buffer()
+        if buffer is not None:
+            buffer.flush()
+    return 0
+
+
+def _fork(app, listener, host, threads, multiprocess):
+    # no signal may reach the child before it has installed its own handlers
+    signal.pthread_sigmask(signal.SIG_BLOCK, {signal.SIGTERM, signal.SIGINT})
+    pid = os.fork()
+    if pid == 0:
+        code = 1
+        try:
+            code = _work(app, listener, host, threads, multiprocess)
+        except BaseException:
+            app.logger.exception('Worker %d failed', os.getpid())
+        finally:
+            os._exit(code)
+    signal.pthread_sigmask(signal.SIG_UNBLOCK, {signal.SIGTERM, signal.SIGINT})
+    return pid
+
+
+def serve(app, host='127.0.0.1', port=8000, workers=2, threads=4, preload=True):
+    """Serve `app` from `workers` forked processes of `threads` threads each, until SIGTERM or Ctrl-C."""
+    listener = socket.socket(socket.AF_INET6 if ':' in host else socket.AF_INET, socket.SOCK_STREAM)
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.bind((host, port))
+    listener.listen(BACKLOG)
+    shared_cache = _share_caches(app) if workers > 1 else None
+    if preload:
+        warmup.preload(data=True)
+
+    children = set()
+    signal.signal(signal.SIGTERM, _stop)
+    signal.signal(signal.SIGINT, _stop)
+    print(f' * Serving on http://{host}:{port}/ with {workers} workers of {threads} threads', file=sys.stderr)
+    try:
+        for _ in range(workers):
+            children.add(_fork(app, listener, host, threads, workers > 1))
+        while True:
+            pid, status = os.wait()
+            children.discard(pid)
+            app.logger.warning('Worker %d exited with status %d, starting another', pid, status)
+            if status:
+                time.sleep(RESPAWN_DELAY)
+            children.add(_fork(app, listener, host, threads, workers > 1))
+    finally:
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        signal.signal(signal.SIGTERM, signal.SIG_IGN)
+        for pid in children:
+            os.kill(pid, signal.SIGTERM)
+        for pid in children:
+            os.waitpid(pid, 0)
+        listener.close()
+        if shared_cache:
+            for path in (shared_cache, shared_cache + '-wal', shared_cache + '-shm'):
+                if os.path.exists(path):
+                    os.remove(path)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--bind', default='127.0.0.1:8000', help='HOST:PORT to listen on')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='worker processes')
+    parser.add_argument('--threads', type=int, default=4, help='request threads per worker')
+    parser.add_argument('--no-preload', dest='preload', action='store_false',
+                        help="let every worker load templates and data on its own first requests")
+    parser.add_argument('--quiet', action='store_true', help="don't log every request")
+    args = parser.parse_args(argv)
+    if args.quiet:
+        logging.getLogger('werkzeug').setLevel(logging.WARNING)
+    host, _, port = args.bind.rpartition(':')
+    serve(app, host.strip('[]') or '127.0.0.1', int(port), args.workers, args.threads, args.preload)
+
+
+if __name__ == '__main__':
+    main()
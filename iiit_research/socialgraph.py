@@ -0,0 +1,165 @@
+"""The follow graph, held in memory by every worker process.
+
+Each user's followed users and labs, and each user's and lab's followers, are sorted `array('i')`s (4 bytes
+per edge and direction), so follow checks, counts and id lists are a dict lookup and a bisect instead of a
+query. The graph is loaded with one SELECT the first time it is used.
+
+Writers keep it current through the `change_counter` row named 'subscription', which every ORM flush that
+adds or deletes a Subscription increments in the same transaction:
+
+* the worker that made the change applies it to its own graph right after the commit, so its next page
+  already shows it;
+* other workers compare their graph's version with the row at most every SOCIAL_GRAPH_MAX_AGE seconds
+  (default 1) and reload it when it has moved. `get(fresh=True)` checks now, for decisions that write.
+
+Core writes (bulk imports) must increment the counter themselves with `bump()`.
+"""
+import threading
+import time
+from array import array
+from bisect import bisect_left
+
+from sqlalchemy import event, select, text
+from sqlalchemy.orm import Session
+
+from iiit_research import app, db, querycount
+from iiit_research.models import Subscription, ChangeCounter
+
+KINDS = ('user', 'lab')
+COUNTER = 'subscription'
+_EMPTY = array('i')
+
+_BUMP = text("INSERT INTO change_counter (name, version) VALUES (:name, 1) "
+             "ON CONFLICT (name) DO UPDATE SET version = change_counter.version + 1")
+
+
+class SocialGraph:
+    """Adjacency arrays of the follow graph in both directions, per followee kind."""
+
+    def __init__(self, edges, version):
+        self.version = version
+        following = {kind: {} for kind in KINDS}
+        followers = {kind: {} for kind in KINDS}
+        for follower, followee, kind in edges:
+            following[kind].setdefault(follower, []).append(followee)
+            followers[kind].setdefault(followee, []).append(follower)
+        self._following = {kind: {key: array('i', sorted(ids)) for key, ids in index.items()}
+                           for kind, index in following.items()}
+        self._followers = {kind: {key: array('i', sorted(ids)) for key, ids in index.items()}
+                           for kind, index in followers.items()}
+
+    def is_following(self, follower, followee, kind='user'):
+        ids = self._following[kind].get(int(follower), _EMPTY)
+        i = bisect_left(ids, int(followee))
+        return i < len(ids) and ids[i] == int(followee)
+
+    def followee_ids(self, user_id, kind='user'):
+        """Sorted ids of the users (or labs) `user_id` follows."""
+        return self._following[kind].get(int(user_id), _EMPTY)
+
+    def follower_ids(self, followee, kind='user'):
+        """Sorted ids of the users following user (or lab) `followee`."""
+        return self._followers[kind].get(int(followee), _EMPTY)
+
+    def follower_count(self, followee, kind='user'):
+        return len(self.follower_ids(followee, kind))
+
+    def following_count(self, user_id):
+        """Followed users and labs, like the profile's "Following" tab."""
+        return sum(len(self.followee_ids(user_id, kind)) for kind in KINDS)
+
+    def apply(self, follower, followee, kind, added):
+        _update(self._following[kind], int(follower), int(followee), added)
+        _update(self._followers[kind], int(followee), int(follower), added)
+
+
+def _update(index, key, value, added):
+    ids = index.get(key)
+    if ids is None:
+        if added:
+            index[key] = array('i', [value])
+        return
+    i = bisect_left(ids, value)
+    present = i < len(ids) and ids[i] == value
+    if added and not present:
+        ids.insert(i, value)
+    elif not added and present:
+        del ids[i]
+
+
+_graph = None
+_checked_at = 0.0
+_lock = threading.Lock()
+
+
+def _version(conn):
+    return conn.execute(select([ChangeCounter.version]).where(ChangeCounter.name == COUNTER)).scalar() or 0
+
+
+def _load():
+    conn = db.session.connection()
+    # the version is read first: a change committed in between is then loaded under the older version and
+    # merely causes one more reload, never a graph that claims a change it doesn't have
+    version = _version(conn)
+    edges = conn.execute(select([Subscription.follower, Subscription.followee, Subscription.followee_type]))
+    return SocialGraph(edges, version)
+
+
+def get(fresh=False):
+    """This process's graph, reloaded if another process has changed the follows since it was checked."""
+    global _graph, _checked_at
+    now = time.monotonic()
+    if _graph is not None and not fresh and now - _checked_at < app.config.get('SOCIAL_GRAPH_MAX_AGE', 1.0):
+        return _graph
+    with _lock, querycount.exempt():
+        if _graph is None or _version(db.session.connection()) != _graph.version:
+            _graph = _load()
+        _checked_at = now
+    return _graph
+
+
+def bump(conn):
+    """Mark the follow graph as changed; call in the transaction that changed `subscription` without the ORM."""
+    conn.execute(_BUMP, name=COUNTER)
+
+
+def reset():
+    """Forget the loaded graph, e.g. after the database was replaced."""
+    global _graph
+    _graph = None
+
+
+@event.listens_for(Session, 'after_flush')
+def _record_changes(session, flush_context):
+    changes = [(row, True) for row in session.new if isinstance(row, Subscription)] + \
+        [(row, False) for row in session.deleted if isinstance(row, Subscription)]
+    if not changes:
+        return
+    session.info.setdefault('graph_changes', []).extend(
+        (row.follower, row.followee, row.followee_type, added) for row, added in changes)
+    conn = session.connection()
+    bump(conn)
+    version = _version(conn)
+    # writers are serialized on the counter row, so nobody else can move it until this transaction ends
+    session.info.setdefault('graph_base', version - 1)
+    session.info['graph_version'] = version
+
+
+@event.listens_for(Session, 'after_commit')
+def _apply_changes(session):
+    changes = session.info.pop('graph_changes', None)
+    base, version = session.info.pop('graph_base', None), session.info.pop('graph_version', None)
+    if not changes:
+        return
+    with _lock:
+        if _graph is None or _graph.version != base:
+            return  # missed someone else's change; the next check reloads
+        for follower, followee, kind, added in changes:
+            _graph.apply(follower, followee, kind, added)
+        _graph.version = version
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_changes(session):
+    for key in ('graph_changes', 'graph_base', 'graph_version'):
+        session.info.pop(key, None)
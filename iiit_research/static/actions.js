@@ -0,0 +1,108 @@
+/*
+ * Follow, like and approve buttons without a page reload: clicks on links with a data-action attribute are
+ * queued for a moment, sent to /api/v1/actions as one batch and the buttons and counts updated in place.
+ * Without JavaScript, or if the request fails, the links are plain GET requests that redirect back.
+ */
+(function () {
+    var script = document.currentScript;
+    var url = script && script.getAttribute('data-url');
+    var BATCH_DELAY = 100;  // ms to wait for more clicks before sending
+    var LABELS = {follow: 'Follow', unfollow: 'Unfollow', like: 'Like', unlike: 'Unlike'};
+    var TOGGLES = {follow: true, unfollow: true, like: true, unlike: true};
+    var queue = [];
+    var timer = null;
+
+    if (!url || !window.fetch) {
+        return;
+    }
+
+    function describe(link) {
+        var action = {action: link.getAttribute('data-action'), id: parseInt(link.getAttribute('data-id'), 10)};
+        if (link.hasAttribute('data-type')) {
+            action.type = link.getAttribute('data-type');
+        }
+        return action;
+    }
+
+    function setText(selector, text) {
+        var nodes = document.querySelectorAll(selector);
+        for (var i = 0; i < nodes.length; i++) {
+            nodes[i].textContent = text;
+        }
+    }
+
+    function toggle(link, action) {
+        if (link.getAttribute('data-action') !== action) {
+            // data-other holds the fallback URL of the opposite action
+            var other = link.getAttribute('data-other');
+            link.setAttribute('data-other', link.href);
+            link.href = other;
+            link.setAttribute('data-action', action);
+        }
+        link.textContent = LABELS[action];
+        if (link.classList.contains('btn')) {
+            link.classList.toggle('btn-outline-success', action === 'follow');
+            link.classList.toggle('btn-outline-warning', action === 'unfollow');
+        }
+    }
+
+    function update(link, result) {
+        if ('following' in result) {
+            toggle(link, result.following ? 'unfollow' : 'follow');
+            if (result.type === 'user') {
+                setText('[data-followers="' + result.id + '"]', result.followers);
+            }
+        } else if ('liked' in result) {
+            toggle(link, result.liked ? 'unlike' : 'like');
+            setText('[data-likes="' + result.id + '"]', result.likes);
+        } else if (result.handled) {
+            var item = link.closest('[data-pending]');
+            if (item) {
+                item.parentNode.removeChild(item);
+            }
+        }
+    }
+
+    function send() {
+        var links = queue;
+        queue = [];
+        timer = null;
+        fetch(url, {
+            method: 'POST',
+            credentials: 'same-origin',
+            headers: {'Content-Type': 'application/json', 'Accept': 'application/json'},
+            body: JSON.stringify({actions: links.map(describe)})
+        }).then(function (response) {
+            if (!response.ok) {
+                throw new Error(response.status);
+            }
+            return response.json();
+        }).then(function (data) {
+            data.results.forEach(function (result, i) {
+                update(links[i], result);
+            });
+        }).catch(function () {
+            // let the server handle the last click the old way
+            window.location.href = links[links.length - 1].href;
+        });
+    }
+
+    document.addEventListener('click', function (event) {
+        var link = event.target.closest && event.target.closest('a[data-action]');
+        if (!link || event.ctrlKey || event.metaKey || event.shiftKey) {
+            return;
+        }
+        event.preventDefault();
+        var queued = queue.indexOf(link);
+        if (queued >= 0) {
+            // clicked again before the batch went out: a second follow/like click undoes the first
+            if (TOGGLES[link.getAttribute('data-action')]) {
+                queue.splice(queued, 1);
+            }
+            return;
+        }
+        queue.push(link);
+        clearTimeout(timer);
+        timer = setTimeout(send, BATCH_DELAY);
+    });
+})();
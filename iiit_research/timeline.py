@@ -0,0 +1,83 @@
+"""Fan-out-on-write home timelines.
+
+Every follower gets a row in `timeline_entry` when a post is created, and following/unfollowing
+someone copies/removes that author's posts. `/home` then reads one indexed slice per page instead of
+re-deriving the feed from the subscription table on every request.
+"""
+from datetime import datetime
+
+from sqlalchemy import and_, literal, select
+
+from iiit_research import db
+from iiit_research.models import User, Post, Subscription, TimelineEntry, TimelineState
+
+timeline_table = TimelineEntry.__table__
+
+
+def _insert_from(query):
+    # OR IGNORE keeps fan-out idempotent if a rebuild races a write
+    return timeline_table.insert().prefix_with('OR IGNORE', dialect='sqlite') \
+        .from_select(['user_id', 'post_id', 'created_at'], query)
+
+
+def _author_filter(followee_id, followee_type):
+    if followee_type == 'lab':
+        return and_(Post.author_type == 'lab', Post.lab_id == followee_id)
+    return and_(Post.author_type == 'user', Post.author_id == followee_id)
+
+
+def fan_out_post(post):
+    """Push a freshly flushed post into the timeline of everyone following its author."""
+    if post.author_type == 'lab':
+        followee_id = post.lab_id
+    else:
+        followee_id = post.author_id
+    followers = select([Subscription.follower, literal(post.id), literal(post.created_at)]) \
+        .where((Subscription.followee == followee_id) & (Subscription.followee_type == post.author_type))
+    db.session.execute(_insert_from(followers))
+
+
+def on_follow(user_id, followee_id, followee_type):
+    """Backfill the followee's posts into the follower's timeline."""
+    posts = select([literal(int(user_id)), Post.id, Post.created_at]) \
+        .where(_author_filter(followee_id, followee_type))
+    db.session.execute(_insert_from(posts))
+
+
+def on_unfollow(user_id, followee_id, followee_type):
+    """Drop the followee's posts from the follower's timeline."""
+    post_ids = select([Post.id]).where(_author_filter(followee_id, followee_type))
+    db.session.execute(timeline_table.delete().where(
+        (TimelineEntry.user_id == user_id) & TimelineEntry.post_id.in_(post_ids)))
+
+
+def rebuild(user_id):
+    """Recompute a user's timeline from the subscription table (the old read path)."""
+    db.session.execute(timeline_table.delete().where(TimelineEntry.user_id == user_id))
+    for followee_type, author_column in (('user', Post.author_id), ('lab', Post.lab_id)):
+        posts = select([literal(int(user_id)), Post.id, Post.created_at]) \
+            .select_from(Post.__table__.join(Subscription.__table__, author_column == Subscription.followee)) \
+            .where((Subscription.follower == user_id) & (Subscription.followee_type == followee_type)
+                   & (Post.author_type == followee_type))
+        db.session.execute(_insert_from(posts))
+    db.session.merge(TimelineState(user_id=user_id, built_at=datetime.utcnow()))
+
+
+def is_built(user_id):
+    return TimelineState.query.get(user_id) is not None
+
+
+def query(user_id):
+    """Posts in a user's timeline, newest first."""
+    return Post.query.join(TimelineEntry, TimelineEntry.post_id == Post.id) \
+        .filter(TimelineEntry.user_id == user_id) \
+        .order_by(TimelineEntry.created_at.desc(), TimelineEntry.post_id.desc())
+
+
+def rebuild_all():
+    """Rebuild every user's timeline. Used to backfill after the table is created."""
+    user_ids = [row.id for row in db.session.query(User.id)]
+    for user_id in user_ids:
+        rebuild(user_id)
+    db.session.commit()
+    return len(user_ids)
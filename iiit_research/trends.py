@@ -0,0 +1,125 @@
+"""Trending engine.
+
+Follower counts and time-decayed like scores live in `trending_score` and are bumped from the write paths
+(`follow_action()`, `like_action()`), so /trending reads top-K straight off the (kind, score) index instead of
+aggregating the subscription and post tables on every view. `flask reconcile-trending` recomputes the exact
+counters from the source tables and is meant to be run periodically (e.g. from cron).
+
+Decayed scores use the usual trick of growing the weight of new events instead of shrinking old ones: a like
+at time t weighs 2 ** ((t - EPOCH) / HALF_LIFE), so relative order never needs recomputing and a like from one
+half-life ago counts half as much as one now. Those weights outgrow a float within years, so a post's score
+is stored as log2 of the sum of its likes' weights. An unlike takes out the weight its like was added with
+(`Like.created_at`), not today's.
+"""
+import math
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+from sqlalchemy import func, text
+
+from iiit_research import db, fragments
+from iiit_research.models import User, Lab, Post, Like, Subscription, TrendingScore
+
+USER_FOLLOWERS = 'user_followers'
+LAB_FOLLOWERS = 'lab_followers'
+POST_HOT = 'post_hot'
+
+EPOCH = datetime(2018, 1, 1)
+HALF_LIFE = timedelta(days=7)  # "trending this week"
+EMPTY = 1e-9  # what is left of the largest weight after rounding once every like is taken out
+
+
+def decay_exponent(when=None):
+    """log2 of the weight of a like made at `when` (default: now)."""
+    return ((when or datetime.utcnow()) - EPOCH) / HALF_LIFE
+
+
+def _log2_sum(exponents, removed=()):
+    """log2(sum of 2 ** e for `exponents` minus sum of 2 ** e for `removed`), or None if nothing is left."""
+    if not exponents:
+        return None
+    top = max(exponents)
+    total = sum(2 ** (e - top) for e in exponents) - sum(2 ** (e - top) for e in removed)
+    return top + math.log2(total) if total > EMPTY else None
+
+
+def _bump(kind, ref_id, delta):
+    db.session.execute(text(
+        "INSERT INTO trending_score (kind, ref_id, score, updated_at) VALUES (:kind, :ref_id, max(:delta, 0), :now) "
+        "ON CONFLICT (kind, ref_id) DO UPDATE "
+        "SET score = max(trending_score.score + :delta, 0), updated_at = :now"),
+        {'kind': kind, 'ref_id': int(ref_id), 'delta': delta, 'now': datetime.utcnow()})
+
+
+def on_follow(followee_id, followee_type, delta=1):
+    """Call with delta=1 when a subscription is added and delta=-1 when it is removed."""
+    _bump(LAB_FOLLOWERS if followee_type == 'lab' else USER_FOLLOWERS, followee_id, delta)
+
+
+def on_likes(post_id, added=0, removed=()):
+    """Update a post's score for `added` likes made now and removed likes made at the `removed` times.
+    Call it in the transaction that wrote the like rows, with `added` and `removed` worked out after that
+    transaction took the write lock (see likebuffer.apply_likes()), so no other writer can change the likes
+    or the score in between."""
+    current = db.session.query(TrendingScore.score).filter_by(kind=POST_HOT, ref_id=post_id).scalar()
+    exponents = [current] if current is not None else []
+    if added:
+        exponents.append(decay_exponent() + math.log2(added))
+    score = _log2_sum(exponents, [decay_exponent(when) for when in removed])
+    if score is None:
+        TrendingScore.query.filter_by(kind=POST_HOT, ref_id=post_id).delete(synchronize_session=False)
+    else:
+        db.session.execute(text(
+            "INSERT INTO trending_score (kind, ref_id, score, updated_at) VALUES (:kind, :ref_id, :score, :now) "
+            "ON CONFLICT (kind, ref_id) DO UPDATE SET score = :score, updated_at = :now"),
+            {'kind': POST_HOT, 'ref_id': int(post_id), 'score': score, 'now': datetime.utcnow()})
+    fragments.touch(db.session, 'trending')
+
+
+def _top(kind, limit):
+    query = TrendingScore.query.filter(TrendingScore.kind == kind)
+    if kind != POST_HOT:
+        # follower counters stay behind at 0; post scores are log2 values whose rows are deleted when empty
+        query = query.filter(TrendingScore.score > 0)
+    return query.order_by(TrendingScore.score.desc()).limit(limit).subquery()
+
+
+def most_followed_users(limit=5):
+    top = _top(USER_FOLLOWERS, limit)
+    return db.session.query(User.id, User.username, User.name, top.c.score.label('num_followers')) \
+        .join(top, top.c.ref_id == User.id).order_by(top.c.score.desc()).all()
+
+
+def most_followed_labs(limit=5):
+    top = _top(LAB_FOLLOWERS, limit)
+    return db.session.query(Lab.id, Lab.name, Lab.image, top.c.score.label('num_followers')) \
+        .join(top, top.c.ref_id == Lab.id).order_by(top.c.score.desc()).all()
+
+
+def trending_posts(limit=5, options=()):
+    top = _top(POST_HOT, limit)
+    return Post.query.options(*options).join(top, top.c.ref_id == Post.id).order_by(top.c.score.desc()).all()
+
+
+def reconcile():
+    """Recompute follower counts from `subscription` and post scores from `like` (likes without a time count
+    as made when the post was created)."""
+    now = datetime.utcnow()
+    scores = TrendingScore.__table__
+    db.session.execute(scores.delete().where(scores.c.kind.in_([USER_FOLLOWERS, LAB_FOLLOWERS])))
+    for kind, followee_type in ((USER_FOLLOWERS, 'user'), (LAB_FOLLOWERS, 'lab')):
+        counts = db.session.query(Subscription.followee, db.func.count(Subscription.id)) \
+            .filter(Subscription.followee_type == followee_type).group_by(Subscription.followee).all()
+        if counts:
+            db.session.execute(scores.insert(), [
+                {'kind': kind, 'ref_id': followee, 'score': count, 'updated_at': now} for followee, count in counts])
+    db.session.execute(scores.delete().where(scores.c.kind == POST_HOT))
+    exponents = defaultdict(list)
+    for post_id, liked_at in db.session.query(Like.post_id, func.coalesce(Like.created_at, Post.created_at)) \
+            .join(Post, Post.id == Like.post_id):
+        exponents[post_id].append(decay_exponent(liked_at))
+    if exponents:
+        db.session.execute(scores.insert(), [
+            {'kind': POST_HOT, 'ref_id': post_id, 'score': _log2_sum(values), 'updated_at': now}
+            for post_id, values in exponents.items()])
+    db.session.commit()
@@ -0,0 +1,136 @@
+"""Streaming uploads.
+
+Werkzeug normally spools an uploaded file into memory (or an anonymous temp file) and the view then copies
+it to its destination. `UploadRequest` instead streams every file part straight into a temp file under
+the instance folder, hashing it chunk by chunk as the form parser writes it. `store()` then moves the temp
+file into `static/<folder>/` under a name derived from its SHA-256, so an identical file that was uploaded
+before is reused instead of written again.
+
+Size limits are enforced before and while the body is read: UPLOAD_LIMITS maps an endpoint to its maximum
+request size (falling back to MAX_CONTENT_LENGTH). A request whose Content-Length is over it is rejected
+without reading the body (by Werkzeug for forms, by `UploadRequest.get_data()` for JSON), and a file part
+that grows past it aborts the parse. API calls get a JSON error back, forms a redirect with a flashed message.
+"""
+import hashlib
+import os
+import shutil
+import tempfile
+
+from flask import Request, flash, jsonify, redirect, request
+from werkzeug.exceptions import RequestEntityTooLarge
+
+from iiit_research import app
+
+KB = 1024
+MB = 1024 * KB
+CHUNK_SIZE = 64 * 1024
+FOLDERS = ('files', 'lab_images', 'profile_pics')  # the static/ folders store() writes to
+
+app.config.setdefault('MAX_CONTENT_LENGTH', 16 * MB)
+app.config.setdefault('UPLOAD_LIMITS', {'account': 2 * MB, 'create_lab': 2 * MB, 'new_post': 16 * MB})
+
+
+class HashingFile:
+    """A temp file on disk that hashes and counts everything written to it."""
+
+    def __init__(self, directory, limit):
+        os.makedirs(directory, exist_ok=True)
+        self._file = tempfile.NamedTemporaryFile(dir=directory, prefix='upload-', delete=False)
+        self.path = self._file.name
+        self.limit = limit
+        self.size = 0
+        self._hash = hashlib.sha256()
+
+    def write(self, chunk):
+        self.size += len(chunk)
+        if self.limit and self.size > self.limit:
+            raise RequestEntityTooLarge()
+        self._hash.update(chunk)
+        return self._file.write(chunk)
+
+    def hexdigest(self):
+        return self._hash.hexdigest()
+
+    def close(self):
+        # called by Flask when the request ends; a stored file has already been moved away
+        self._file.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def __getattr__(self, name):
+        return getattr(self._file, name)
+
+
+class UploadRequest(Request):
+    @property
+    def max_content_length(self):
+        limits = app.config['UPLOAD_LIMITS']
+        if self.url_rule is not None and self.url_rule.endpoint in limits:
+            return limits[self.url_rule.endpoint]
+        return app.config['MAX_CONTENT_LENGTH']
+
+    def get_data(self, *args, **kwargs):
+        # Werkzeug only checks the limit when parsing forms; JSON bodies (the API) are read with get_data()
+        limit = self.max_content_length
+        if limit is not None and (self.content_length or 0) > limit:
+            raise RequestEntityTooLarge()
+        return super().get_data(*args, **kwargs)
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return HashingFile(os.path.join(app.instance_path, 'uploads'), self.max_content_length)
+
+
+app.request_class = UploadRequest
+
+
+def _digest(stream):
+    """SHA-256 of a stream that wasn't hashed on the way in."""
+    sha = hashlib.sha256()
+    for chunk in iter(lambda: stream.read(CHUNK_SIZE), b''):
+        sha.update(chunk)
+    stream.seek(0)
+    return sha.hexdigest()
+
+
+def store(file_storage, folder):
+    """Save an uploaded FileStorage into static/<folder>/ and return its file name.
+    Files are named after their content hash, so re-uploading a file reuses the stored copy."""
+    stream = file_storage.stream
+    if isinstance(stream, HashingFile):
+        stream.flush()
+        digest = stream.hexdigest()
+    else:
+        digest = _digest(stream)
+
+    ext = os.path.splitext(file_storage.filename)[1].lower()
+    # 16 hex digits plus .jpg/.png/.pdf fit the String(20) file name columns
+    filename = digest[:16] + ext
+    path = os.path.join(app.root_path, 'static', folder, filename)
+    if os.path.exists(path):
+        return filename
+
+    if isinstance(stream, HashingFile):
+        # same filesystem in the usual layout, so this is a rename rather than a copy
+        shutil.move(stream.path, path)
+    else:
+        with open(path, 'wb') as out:
+            shutil.copyfileobj(stream, out, CHUNK_SIZE)
+    return filename
+
+
+def _format_size(size):
+    """'16 MB', '1.5 MB', '512 KB' or '100 bytes'."""
+    for unit, name in ((MB, 'MB'), (KB, 'KB')):
+        if size >= unit:
+            return f'{round(size / unit, 1):g} {name}'
+    return f'{size} bytes'
+
+
+@app.errorhandler(RequestEntityTooLarge)
+def upload_too_large(e):
+    limit = request.max_content_length
+    message = f'That upload is too large, the limit is {_format_size(limit)}.' if limit else 'That upload is too large.'
+    if request.path.startswith('/api/') or request.is_json:
+        return jsonify({'error': message}), 413
+    flash(message, 'danger')
+    return redirect(request.url)
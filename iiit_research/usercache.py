@@ -0,0 +1,59 @@
+"""Cache for the authenticated user behind `login_manager.user_loader`.
+
+The user's columns are cached across requests (TTL, `USER_CACHE_*` config, see cache.make_cache) and
+re-attached to the session without a SELECT. The password hash is left out of the cache (it may be a file
+shared by every worker, see cache.py); the login, account and reset views that read it load it on access.
+Anything that changes a user's row must call `invalidate(user_id)` after committing.
+"""
+from flask import g
+from sqlalchemy.orm import make_transient_to_detached
+
+from iiit_research import app, db
+from iiit_research.cache import make_cache
+
+_cache = None
+_UNCACHED = {'password'}
+
+
+def get_cache():
+    global _cache
+    if _cache is None:
+        _cache = make_cache(app, 'USER_CACHE')
+    return _cache
+
+
+def _key(user_id):
+    return f'user:{user_id}'
+
+
+def _snapshot(user):
+    return {column.key: getattr(user, column.key) for column in user.__table__.columns
+            if column.key not in _UNCACHED}
+
+
+def _attach(model, data):
+    user = model(**data)
+    make_transient_to_detached(user)
+    return db.session.merge(user, load=False)
+
+
+def load(model, user_id):
+    """The `model` row for `user_id`, from the request or shared cache when possible."""
+    loaded = g.setdefault('loaded_users', {})
+    if user_id in loaded:
+        return loaded[user_id]
+
+    data = get_cache().get(_key(user_id))
+    if data is None:
+        user = model.query.get(user_id)
+        if user is not None:
+            get_cache().set(_key(user_id), _snapshot(user))
+    else:
+        user = _attach(model, data)
+    loaded[user_id] = user
+    return user
+
+
+def invalidate(user_id):
+    get_cache().delete(_key(user_id))
+    g.get('loaded_users', {}).pop(user_id, None)
@@ -0,0 +1,132 @@
+"""HTTP validators (ETag and Last-Modified) for pages, so unchanged pages are answered with 304 Not Modified.
+
+A page names the data it shows with the same tags as the fragment cache (see fragments.py): a post page
+depends on 'post:<id>', 'user_names' and 'labs', a profile on 'user:<id>', 'followers:<id>', ... Every tag
+touched by `fragments.touch()` also has its row in the `content_version` table incremented, in the
+transaction that made the change, so the stamps are exact and shared by every worker.
+
+`@conditional(tags)` reads the page's stamps with one query before running the view. The ETag hashes them
+together with the viewer, the image format their browser gets, their queued likes and the version of the
+code and static assets; Last-Modified is the newest stamp. If the request's If-None-Match (or, without it,
+If-Modified-Since) matches, the view is skipped and a bodiless 304 is sent. Pages with flashed messages
+always render.
+
+Writes that bypass the ORM and `touch()` (bulk imports) must `record()` the 'all' tag, which every page
+depends on. Set CONDITIONAL_RESPONSES = False to turn validators off.
+"""
+import hashlib
+import os
+from datetime import datetime
+from functools import wraps
+
+from flask import request, session
+from flask_login import current_user
+from sqlalchemy import event, text
+from sqlalchemy.orm import Session
+from werkzeug.http import is_resource_modified
+
+from iiit_research import app, db, assets, images, likebuffer, uploads
+from iiit_research.models import ContentVersion
+
+_UPSERT = text("INSERT INTO content_version (tag, version, updated_at) VALUES (:tag, 1, :now) "
+               "ON CONFLICT (tag) DO UPDATE SET version = content_version.version + 1, updated_at = :now")
+
+_build = None
+
+
+def record(db_session, tags):
+    """Increment the stamps of `tags` in `db_session`'s transaction (once per tag and transaction)."""
+    recorded = db_session.info.setdefault('content_versions', set())
+    tags = set(tags) - recorded
+    if tags:
+        now = datetime.utcnow()
+        db_session.connection().execute(_UPSERT, [{'tag': tag, 'now': now} for tag in sorted(tags)])
+        recorded |= tags
+
+
+@event.listens_for(Session, 'after_commit')
+@event.listens_for(Session, 'after_rollback')
+def _forget_recorded(db_session):
+    db_session.info.pop('content_versions', None)
+
+
+def _asset_fingerprints():
+    """[(filename, content hash)] of the static assets, whose fingerprinted URLs are in every page. Uploads
+    are left out: they are named after their content and never change in place."""
+    fingerprints = []
+    for directory, folders, files in os.walk(app.static_folder):
+        if directory == app.static_folder:
+            folders[:] = [folder for folder in folders if folder not in uploads.FOLDERS]
+        for name in files:
+            filename = os.path.relpath(os.path.join(directory, name), app.static_folder).replace(os.sep, '/')
+            fingerprints.append((filename, assets.content_hash(filename)))
+    return sorted(fingerprints)
+
+
+def _code_version():
+    """(hash, mtime) of the templates, modules and static assets, so a deploy changes every ETag."""
+    global _build
+    if _build is None:
+        package = os.path.dirname(os.path.abspath(__file__))
+        stats = []
+        for directory, _, files in os.walk(package):
+            stats += [(os.path.join(directory, name), os.stat(os.path.join(directory, name)))
+                      for name in files if name.endswith(('.py', '.html'))]
+        fingerprints = _asset_fingerprints()
+        stats += [(filename, os.stat(os.path.join(app.static_folder, filename))) for filename, _ in fingerprints]
+        digest = hashlib.sha1(repr((sorted((path, st.st_mtime_ns, st.st_size) for path, st in stats),
+                                    fingerprints)).encode())
+        _build = digest.hexdigest()[:12], datetime.utcfromtimestamp(max(st.st_mtime for _, st in stats))
+    return _build
+
+
+def stamps(tags):
+    """{tag: (version, updated_at)} for the tags that have changed at least once."""
+    rows = db.session.query(ContentVersion.tag, ContentVersion.version, ContentVersion.updated_at) \
+        .filter(ContentVersion.tag.in_(tags))
+    return {tag: (version, updated_at) for tag, version, updated_at in rows}
+
+
+def validators(tags):
+    """(etag, last_modified) for a page showing `tags` to the current viewer."""
+    tags = sorted(set(tags) | {'all', f'user:{current_user.id}'})
+    versions = stamps(tags)
+    build, built_at = _code_version()
+    buffer = likebuffer.get_buffer()
+    pending = buffer.pending_for(current_user.id) if buffer is not None else ()
+    key = repr((build, current_user.id, images.client_format(), pending,
+                [(tag, versions[tag][0] if tag in versions else 0) for tag in tags]))
+    last_modified = max([built_at] + [updated_at for _, updated_at in versions.values()])
+    return hashlib.sha1(key.encode()).hexdigest()[:20], last_modified
+
+
+def conditional(tags):
+    """Send 304 Not Modified instead of running the view when nothing behind the page has changed.
+    `tags(**view_args)` gives the page's tags, or None to always render."""
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if not app.config.get('CONDITIONAL_RESPONSES', True) or request.method not in ('GET', 'HEAD') \
+                    or '_flashes' in session or not current_user.is_authenticated:
+                return view(*args, **kwargs)
+            page_tags = tags(**kwargs)
+            if page_tags is None:
+                return view(*args, **kwargs)
+            # read before rendering: a change committed meanwhile gives a page newer than its ETag, which
+            # only costs a render next time, never a stale 304
+            etag, last_modified = validators(page_tags)
+            if is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+                response = app.make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+            else:
+                response = app.response_class(status=304)
+            response.set_etag(etag, weak=True)
+            response.last_modified = last_modified
+            # browsers must revalidate every time, and the page is per user
+            response.cache_control.private = True
+            response.cache_control.no_cache = True
+            response.vary.add('Cookie')
+            return response
+        return wrapper
+    return decorator
@@ -0,0 +1,91 @@
+"""The vocabulary of areas of interest.
+
+`terms()` is the list offered on the register and account pages. It is kept in the fragment cache under the
+'interests' tag, so it costs no query until an interest is added.
+
+`resolve()` turns submitted form values (names picked from the list and comma separated free text) into
+Interest rows. Names are normalized (whitespace collapsed, surrounding commas dropped) and matched
+case-insensitively against the cached vocabulary; only names that aren't in it hit the database, with a
+single INSERT OR IGNORE for all of them, which the unique index on lower(name) makes safe against
+concurrent registrations, and a single SELECT for their ids.
+"""
+import string
+from collections import namedtuple
+
+from sqlalchemy import func, select, text
+from sqlalchemy.orm import make_transient_to_detached
+
+from iiit_research import db, fragments, fulltext
+from iiit_research.models import Interest, UserInterests
+
+Term = namedtuple('Term', 'id name')
+
+MAX_LENGTH = Interest.__table__.c.name.type.length
+# SQLite's lower() only folds ASCII, so keys must not fold anything else
+_ASCII_LOWER = str.maketrans(string.ascii_uppercase, string.ascii_lowercase)
+
+
+def normalize(name):
+    """`name` with whitespace collapsed and surrounding separators dropped, cut to the column length."""
+    return ' '.join(name.strip(', ').split())[:MAX_LENGTH].strip()
+
+
+def key(name):
+    return normalize(name).translate(_ASCII_LOWER)
+
+
+def terms():
+    """Every interest as a Term(id, name), in the order they were added."""
+    def load():
+        return [Term(id_, name) for id_, name in db.session.execute(
+            select([Interest.id, Interest.name]).order_by(Interest.id))]
+
+    return fragments.cached('interest_vocabulary', ['interests'], load)
+
+
+def _attach(term):
+    # the term's columns are already known, so hand the session an Interest without loading it again
+    interest = Interest(id=term.id, name=term.name)
+    make_transient_to_detached(interest)
+    return db.session.merge(interest, load=False)
+
+
+def resolve(values):
+    """Interest rows for the submitted form `values`, creating the ones that don't exist yet."""
+    wanted = {}
+    for value in values:
+        for name in value.split(','):
+            name = normalize(name)
+            if name:
+                wanted.setdefault(key(name), name)
+    if not wanted:
+        return []
+
+    known = {key(term.name): term for term in terms()}
+    missing = [name for k, name in wanted.items() if k not in known]
+    if missing:
+        conn = db.session.connection()
+        conn.execute(Interest.__table__.insert().prefix_with('OR IGNORE', dialect='sqlite'),
+                     [{'name': name} for name in missing])
+        created = Interest.query.filter(func.lower(Interest.name).in_([key(name) for name in missing])).all()
+        fulltext.index(created)
+        fragments.touch(db.session, 'interests')
+        known.update((key(interest.name), Term(interest.id, interest.name)) for interest in created)
+    return [_attach(known[k]) for k in wanted if k in known]
+
+
+def merge_duplicates(conn):
+    """Normalize stored names and fold interests whose names only differ in case or spacing into the oldest
+    one. Needed once before the unique index on lower(name) can be created."""
+    survivors = {}
+    for id_, name in conn.execute(select([Interest.id, Interest.name]).order_by(Interest.id)).fetchall():
+        survivor = survivors.setdefault(key(name), id_)
+        if survivor == id_:
+            if normalize(name) != name:
+                conn.execute(Interest.__table__.update().where(Interest.id == id_).values(name=normalize(name)))
+            continue
+        conn.execute(text("INSERT OR IGNORE INTO user_interests (user_id, interest_id) "
+                          "SELECT user_id, :survivor FROM user_interests WHERE interest_id = :duplicate"),
+                     survivor=survivor, duplicate=id_)
+        conn.execute(UserInterests.delete().where(UserInterests.c.interest_id == id_))
+        conn.execute(Interest.__table__.delete().where(Interest.id == id_))
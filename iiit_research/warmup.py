@@ -0,0 +1,68 @@
+"""Worker start-up work, done once ahead of time instead of on every worker's first requests.
+
+Templates are compiled through a persistent Jinja bytecode cache in TEMPLATE_BYTECODE_CACHE (default
+instance/template-cache, set it to '' to turn it off), so a new worker loads marshalled code instead of
+parsing and compiling every template. `flask build-templates` fills it on deploy.
+
+`preload()` loads every template into the environment, hashes the static files and, with `data=True`, reads
+the follow graph. A server that imports the app before forking its workers (e.g. gunicorn --preload) calls
+it in the master, so every worker starts with all of that in memory.
+`python benchmarks/startup.py` measures the difference.
+"""
+import os
+import time
+
+from jinja2 import FileSystemBytecodeCache
+
+from iiit_research import app, db, assets, socialgraph
+
+app.config.setdefault('TEMPLATE_BYTECODE_CACHE',
+                      os.environ.get('TEMPLATE_BYTECODE_CACHE', os.path.join(app.instance_path, 'template-cache')))
+
+
+def _configure():
+    directory = app.config['TEMPLATE_BYTECODE_CACHE']
+    if not directory:
+        return
+    try:
+        os.makedirs(directory, exist_ok=True)
+    except OSError:
+        app.logger.warning('Template bytecode cache %s is not writable, templates are compiled in memory',
+                           directory)
+        return
+    app.jinja_env.bytecode_cache = FileSystemBytecodeCache(directory)
+
+
+_configure()
+
+
+def compile_templates():
+    """Load every template, compiling (and caching the bytecode of) those that changed. Returns how many."""
+    names = [name for name in app.jinja_env.list_templates() if name.endswith('.html')]
+    for name in names:
+        app.jinja_env.get_template(name)
+    return len(names)
+
+
+def preload(data=False):
+    """Do the start-up work before workers are forked. Returns {step: seconds}."""
+    timings = {}
+    started = time.perf_counter()
+    compile_templates()
+    timings['templates'] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    for name in os.listdir(app.static_folder):
+        if os.path.isfile(os.path.join(app.static_folder, name)):
+            assets.content_hash(name)
+    timings['assets'] = time.perf_counter() - started
+
+    if data:
+        started = time.perf_counter()
+        with app.app_context():
+            socialgraph.get()
+            db.session.remove()
+        # connections must not be shared with forked workers
+        db.engine.dispose()
+        timings['social graph'] = time.perf_counter() - started
+    return timings
@@ -0,0 +1,57 @@
+"""Fixtures: the app on a scratch SQLite database loaded with a small synthetic data set (benchmarks/datagen.py)."""
+import os
+import sys
+import tempfile
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+WORKDIR = tempfile.mkdtemp()
+# read when the package is imported
+os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(WORKDIR, 'test.db')
+os.environ['TEMPLATE_BYTECODE_CACHE'] = ''
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+
+import datagen  # noqa: E402
+from iiit_research import app as flask_app  # noqa: E402
+
+USERS = 40
+
+
+@pytest.fixture(scope='session')
+def app():
+    flask_app.config.update(TESTING=True, WTF_CSRF_ENABLED=False, MAIL_QUEUE_IN_PROCESS=False)
+    datagen.write(datagen.generate(users=USERS, labs=4, follow_degree=5, posts=60, likes_per_post=3), WORKDIR)
+    with flask_app.app_context():
+        datagen.load(WORKDIR)
+    return flask_app
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def login(client):
+    """login(user_id) signs the test client in as that user."""
+    def login(user_id):
+        with client.session_transaction() as session:
+            session['_user_id'] = str(user_id)
+            session['_fresh'] = True
+    return login
+
+
+@pytest.fixture
+def new_post(app):
+    """new_post() adds a post without likes by professor 1 and returns its id."""
+    from iiit_research import db
+    from iiit_research.models import Post
+
+    def new_post():
+        with app.app_context():
+            post = Post(title='Test post', content='...', author_id=1)
+            db.session.add(post)
+            db.session.commit()
+            return post.id
+    return new_post
@@ -0,0 +1,39 @@
+import io
+
+import pytest
+from sqlalchemy import event
+from sqlalchemy.pool import Pool
+
+from iiit_research import bulk, db
+from iiit_research.models import Interest
+
+NORMAL = 1
+
+
+@pytest.fixture
+def checked_in(app):
+    """PRAGMA synchronous of every connection returned to the pool during the test."""
+    levels = []
+
+    def probe(dbapi_connection, connection_record):
+        levels.append(dbapi_connection.execute('PRAGMA synchronous').fetchone()[0])
+
+    event.listen(Pool, 'checkin', probe)
+    yield levels
+    event.remove(Pool, 'checkin', probe)
+
+
+def test_import_restores_synchronous_after_its_commit(app, checked_in):
+    with app.app_context():
+        assert bulk.import_table('interest', io.StringIO('{"id": 9001, "name": "Bulk loading"}\n')) == 1
+        assert Interest.query.get(9001).name == 'Bulk loading'
+    assert checked_in and set(checked_in) == {NORMAL}
+
+
+def test_failed_import_restores_synchronous_after_the_rollback(app, checked_in):
+    with app.app_context():
+        with pytest.raises(ValueError):
+            bulk.import_table('interest', io.StringIO('{"id": 9002, "name": "Fine"}\nnot json\n'))
+        db.session.rollback()
+        assert Interest.query.get(9002) is None
+    assert checked_in and set(checked_in) == {NORMAL}
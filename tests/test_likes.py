@@ -0,0 +1,74 @@
+import pytest
+
+from iiit_research import db, likebuffer
+from iiit_research.models import Like, Post
+
+CLICKS = [(5, 'like'), (6, 'like'), (5, 'unlike'), (7, 'like'), (6, 'like'), (5, 'like'), (7, 'unlike'),
+          (8, 'unlike')]
+
+
+@pytest.fixture
+def buffered(app, monkeypatch):
+    """Write-behind on, with a buffer that only flushes when the test says so."""
+    monkeypatch.setitem(app.config, 'LIKE_WRITE_BEHIND', True)
+    buffer = likebuffer.LikeBuffer(interval=3600)
+    monkeypatch.setattr(likebuffer, '_buffer', buffer)
+    return buffer
+
+
+def click(client, login, post_id, user_id, action):
+    login(user_id)
+    assert client.get(f'/like/{post_id}/{action}', headers={'Referer': '/posts'}).status_code == 302
+
+
+def like_state(app, post_id):
+    with app.app_context():
+        likers = {user_id for user_id, in db.session.query(Like.user_id).filter_by(post_id=post_id)}
+        return likers, Post.query.get(post_id).like_count
+
+
+def test_buffered_and_direct_clicks_end_in_the_same_state(app, client, login, new_post, request):
+    direct, batched = new_post(), new_post()
+    for user_id, action in CLICKS:
+        click(client, login, direct, user_id, action)
+
+    buffer = request.getfixturevalue('buffered')
+    for user_id, action in CLICKS:
+        click(client, login, batched, user_id, action)
+    assert like_state(app, batched) == (set(), 0)
+    assert buffer.flush() == 4  # the last click of each user
+
+    assert like_state(app, direct) == like_state(app, batched) == ({5, 6}, 2)
+
+
+def test_pending_like_is_shown_to_its_user_before_the_flush(app, client, login, new_post, buffered):
+    post_id = new_post()
+    click(client, login, post_id, 5, 'like')
+    page = client.get(f'/posts/{post_id}').get_data(as_text=True)
+    assert 'data-action="unlike"' in page and f'<span data-likes="{post_id}">0</span>' in page
+
+    buffered.flush()
+    page = client.get(f'/posts/{post_id}').get_data(as_text=True)
+    assert 'data-action="unlike"' in page and f'<span data-likes="{post_id}">1</span>' in page
+
+
+def test_cached_post_page_matches_uncached_and_a_like_invalidates_it(app, client, login, new_post, monkeypatch):
+    post_id = new_post()
+    url = f'/posts/{post_id}'
+
+    def render(cached):
+        monkeypatch.setitem(app.config, 'FRAGMENT_CACHE_ENABLED', cached)
+        response = client.get(url)
+        assert response.status_code == 200
+        return response.get_data(as_text=True)
+
+    login(5)
+    for _ in range(2):  # fills the fragment cache, then serves from it
+        assert render(True) == render(False)
+    etag = client.get(url).headers['ETag']
+
+    click(client, login, post_id, 6, 'like')
+    login(5)
+    assert client.get(url, headers={'If-None-Match': etag}).status_code == 200
+    page = render(True)
+    assert f'<span data-likes="{post_id}">1</span>' in page and page == render(False)
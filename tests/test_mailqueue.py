@@ -0,0 +1,89 @@
+from datetime import datetime, timedelta
+
+import pytest
+from flask_mail import Message
+
+from iiit_research import db, mail, mailqueue
+from iiit_research.models import OutboundMail
+
+
+class SMTPStandIn:
+    """Stands in for a flask_mail Connection; `send` raises the next of `errors` (None means success)."""
+
+    def __init__(self, errors):
+        self.errors = list(errors)
+        self.opened = 0
+        self.sent = []
+
+    def __enter__(self):
+        self.opened += 1
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+    def send(self, message):
+        error = self.errors.pop(0) if self.errors else None
+        if error is not None:
+            raise error
+        self.sent.append(message.subject)
+
+
+@pytest.fixture
+def smtp(app, monkeypatch):
+    """smtp(*errors) queues one message and makes SMTP fail with `errors` in turn before it succeeds."""
+    monkeypatch.setitem(app.config, 'MAIL_RETRY_BASE', 30)
+    monkeypatch.setitem(app.config, 'MAIL_MAX_ATTEMPTS', 3)
+
+    def smtp(*errors):
+        server = SMTPStandIn(errors)
+        monkeypatch.setattr(mail, 'connect', lambda: server)
+        with app.app_context():
+            OutboundMail.query.delete()
+            mailqueue.enqueue_many([Message('Hello', sender='noreply@demo.com', recipients=['user5@example.com'],
+                                            body='...')])
+        return server
+    return smtp
+
+
+def outbox(app):
+    with app.app_context():
+        row = OutboundMail.query.one()
+        return row.status, row.attempts, row.next_attempt_at - datetime.utcnow()
+
+
+def make_due(app):
+    with app.app_context():
+        OutboundMail.query.update({OutboundMail.next_attempt_at: datetime.utcnow()})
+        db.session.commit()
+
+
+def test_failed_send_is_retried_with_backoff(app, smtp):
+    server = smtp(RuntimeError('not an SMTP error'), OSError('connection reset'))
+    dispatcher = mailqueue.MailDispatcher()
+
+    assert dispatcher.drain() == 0
+    status, attempts, wait = outbox(app)
+    assert (status, attempts) == ('pending', 1) and timedelta(seconds=25) < wait <= timedelta(seconds=30)
+    assert dispatcher.drain() == 0  # not due yet
+
+    make_due(app)
+    assert dispatcher.drain() == 0
+    status, attempts, wait = outbox(app)
+    assert (status, attempts) == ('pending', 2) and timedelta(seconds=55) < wait <= timedelta(seconds=60)
+
+    make_due(app)
+    assert dispatcher.drain() == 1
+    assert outbox(app)[:2] == ('sent', 2) and server.sent == ['Hello']
+
+
+def test_gives_up_after_max_attempts(app, smtp):
+    server = smtp(*[ValueError('bad message')] * 5)
+    dispatcher = mailqueue.MailDispatcher()
+    for _ in range(3):
+        make_due(app)
+        assert dispatcher.drain() == 0
+    assert outbox(app)[:2] == ('failed', 3)
+
+    make_due(app)
+    assert dispatcher.drain() == 0 and server.opened == 3  # failed messages are not claimed again
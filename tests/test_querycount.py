@@ -0,0 +1,44 @@
+import pytest
+
+from iiit_research import app as flask_app, loaders
+from iiit_research.querycount import QueryBudgetExceeded
+
+HOT_ROUTES = ['/home', '/posts', '/posts/1', '/user/user2', '/account', '/labs', '/labs/1', '/trending']
+
+
+@pytest.fixture
+def uncached(app, monkeypatch):
+    # fragment cache hits skip queries, so every test takes the expensive path
+    monkeypatch.setitem(app.config, 'FRAGMENT_CACHE_ENABLED', False)
+    return app
+
+
+@pytest.mark.parametrize('url', HOT_ROUTES)
+def test_hot_routes_stay_within_budget(uncached, client, login, url):
+    login(5)
+    # a route over its budget raises QueryBudgetExceeded while TESTING is set
+    assert client.get(url).status_code == 200
+
+
+def test_n_plus_one_exceeds_budget(uncached, client, login, monkeypatch):
+    monkeypatch.setattr(loaders, 'post_authors', lambda: ())
+    login(5)
+    with pytest.raises(QueryBudgetExceeded, match='post issued .* queries, budget is 3'):
+        client.get('/posts')
+
+
+def test_over_budget_only_warns_outside_testing(uncached, client, login, monkeypatch):
+    monkeypatch.setattr(loaders, 'post_authors', lambda: ())
+    monkeypatch.setitem(flask_app.config, 'TESTING', False)
+    monkeypatch.setitem(flask_app.config, 'QUERY_BUDGETS_ENABLED', True)
+    login(5)
+    assert client.get('/posts').status_code == 200
+
+
+def test_form_submissions_are_not_budgeted(uncached, client, login):
+    login(12)
+    data = {'name': 'User Twelve', 'username': 'user12', 'about_me': 'Graph algorithms',
+            'aoi': ['Machine Learning, Graph Theory', 'Compilers']}
+    response = client.post('/account', data=data)
+    assert response.status_code == 302 and response.location.endswith('/account')
+    assert 'Graph algorithms' in client.get('/account').get_data(as_text=True)
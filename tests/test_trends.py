@@ -0,0 +1,87 @@
+import math
+import threading
+from datetime import datetime
+
+import pytest
+from sqlalchemy import event
+
+from iiit_research import actions, db, trends
+from iiit_research.models import Like, TrendingScore
+
+
+def _score(post_id):
+    return db.session.query(TrendingScore.score).filter_by(kind=trends.POST_HOT, ref_id=post_id).scalar()
+
+
+def test_scores_stay_finite_decades_from_the_epoch():
+    assert math.isfinite(trends._log2_sum([trends.decay_exponent(datetime(2100, 1, 1))] * 3))
+
+
+def test_unlike_takes_out_the_weight_the_like_was_added_with(app, new_post):
+    with app.app_context():
+        post_id = new_post()
+        actions.like(5, {post_id: True})
+        actions.like(6, {post_id: True})
+        # pretend user 5 liked it four half-lives ago: it weighs 1/16 of user 6's like
+        Like.query.filter_by(user_id=5, post_id=post_id) \
+            .update({Like.created_at: datetime.utcnow() - 4 * trends.HALF_LIFE})
+        trends.reconcile()
+        with_both = _score(post_id)
+
+        actions.like(5, {post_id: False})
+        db.session.commit()
+        assert _score(post_id) == pytest.approx(with_both - math.log2(1 + 1 / 16), abs=1e-6)
+        assert _score(post_id) == pytest.approx(trends.decay_exponent(), abs=1e-3)
+
+        actions.like(6, {post_id: False})
+        db.session.commit()
+        assert _score(post_id) is None
+
+
+def test_incremental_scores_match_reconcile(app, new_post):
+    with app.app_context():
+        post_id = new_post()
+        for user_id in (7, 8, 9):
+            actions.like(user_id, {post_id: True})
+        actions.like(8, {post_id: False})
+        actions.like(7, {post_id: True})  # already liked, no change
+        db.session.commit()
+        incremental = _score(post_id)
+        trends.reconcile()
+        assert incremental == pytest.approx(_score(post_id), abs=1e-3)
+
+
+def test_concurrent_double_like_adds_its_weight_once(app, new_post):
+    post_id = new_post()
+    both_inserting = threading.Barrier(2)
+
+    def before_insert(conn, cursor, statement, parameters, context, executemany):
+        if statement.startswith('INSERT OR IGNORE INTO "like"'):
+            # lets both clicks reach their insert if nothing serializes them before it
+            try:
+                both_inserting.wait(timeout=0.5)
+            except threading.BrokenBarrierError:
+                pass
+
+    def click():
+        with app.app_context():
+            actions.like(5, {post_id: True})
+            db.session.commit()
+            db.session.remove()
+
+    with app.app_context():
+        event.listen(db.engine, 'before_cursor_execute', before_insert)
+    try:
+        threads = [threading.Thread(target=click) for _ in range(2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        with app.app_context():
+            event.remove(db.engine, 'before_cursor_execute', before_insert)
+
+    with app.app_context():
+        incremental = _score(post_id)
+        trends.reconcile()
+        assert incremental == pytest.approx(_score(post_id), abs=1e-3)
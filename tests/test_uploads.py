@@ -0,0 +1,50 @@
+import io
+import os
+
+import pytest
+
+from iiit_research import uploads
+from iiit_research.models import Post
+
+PDF = b'%PDF-1.4 upload test ' + os.urandom(16)
+
+
+@pytest.fixture
+def stored_files(app):
+    """Removes what the test stored under static/files/."""
+    before = set(os.listdir(os.path.join(app.root_path, 'static', 'files')))
+    yield
+    for name in set(os.listdir(os.path.join(app.root_path, 'static', 'files'))) - before:
+        os.remove(os.path.join(app.root_path, 'static', 'files', name))
+
+
+def test_stored_file_name_fits_its_column(app, client, login, stored_files):
+    login(10)
+    data = {'title': 'Upload test', 'content': '...', 'file': (io.BytesIO(PDF), 'A Long Paper Title.PDF')}
+    assert client.post('/post/new', data=data, content_type='multipart/form-data').status_code == 302
+    with app.app_context():
+        name = Post.query.filter_by(title='Upload test').one().file
+    assert len(name) <= Post.file.type.length and name.endswith('.pdf')
+    assert os.path.exists(os.path.join(app.root_path, 'static', 'files', name))
+
+
+def test_too_large_api_call_gets_json(app, client, login, monkeypatch):
+    monkeypatch.setitem(app.config, 'MAX_CONTENT_LENGTH', 1024)
+    login(5)
+    response = client.post('/api/v1/actions', json={'actions': [{'action': 'like', 'id': 1}] * 100})
+    assert response.status_code == 413
+    assert response.get_json() == {'error': 'That upload is too large, the limit is 1 KB.'}
+
+
+def test_too_large_form_is_redirected_with_a_message(app, client, login, monkeypatch):
+    monkeypatch.setitem(app.config, 'UPLOAD_LIMITS', dict(app.config['UPLOAD_LIMITS'], new_post=1024))
+    login(10)
+    data = {'title': 'Too large', 'content': '...', 'file': (io.BytesIO(b'x' * 4096), 'paper.pdf')}
+    response = client.post('/post/new', data=data, content_type='multipart/form-data')
+    assert response.status_code == 302 and response.location.endswith('/post/new')
+    assert 'the limit is 1 KB.' in client.get('/post/new').get_data(as_text=True)
+
+
+def test_size_limits_are_written_in_a_fitting_unit():
+    sizes = [100, 1024, 1536, 512 * 1024, 2 * 1024 * 1024, 16 * 1024 * 1024]
+    assert [uploads._format_size(size) for size in sizes] == ['100 bytes', '1 KB', '1.5 KB', '512 KB', '2 MB', '16 MB']
@@ -0,0 +1,30 @@
+from iiit_research import bcrypt, db, usercache
+from iiit_research.models import User
+
+
+def test_password_hash_is_not_cached(app, client, login):
+    login(3)
+    assert client.get('/about').status_code == 200
+    cached = usercache.get_cache().get('user:3')
+    assert cached['username'] == 'user3'
+    assert 'password' not in cached
+
+
+def test_password_loads_on_access_after_a_cache_hit(app, client, login):
+    login(4)
+    client.get('/about')
+    with app.test_request_context():
+        user = usercache.load(User, 4)
+        assert user.password == 'x'
+
+
+def test_login_with_a_cached_user(app, client):
+    with app.app_context():
+        user = User.query.get(6)
+        user.password = bcrypt.generate_password_hash('secret').decode('utf-8')
+        db.session.commit()
+        usercache.get_cache().set('user:6', usercache._snapshot(user))
+
+    response = client.post('/login', data={'email': 'user6@example.com', 'password': 'secret'})
+    assert response.status_code == 302 and response.location.endswith('/account')
+    assert client.get('/account').status_code == 200
@@ -0,0 +1,20 @@
+from iiit_research import assets, validators
+
+
+def test_asset_fingerprints_leave_out_uploads(app):
+    with app.app_context():
+        filenames = [filename for filename, _ in validators._asset_fingerprints()]
+    assert 'main.css' in filenames and 'actions.js' in filenames
+    assert not [filename for filename in filenames if filename.startswith(('files/', 'profile_pics/'))]
+
+
+def test_changed_asset_changes_the_etag(app, client, login, monkeypatch):
+    login(5)
+    etag = client.get('/posts/1').headers['ETag']
+    assert client.get('/posts/1', headers={'If-None-Match': etag}).status_code == 304
+
+    content_hash = assets.content_hash
+    monkeypatch.setattr(assets, 'content_hash', lambda name: 'changed' if name == 'main.css' else content_hash(name))
+    monkeypatch.setattr(validators, '_build', None)  # as after a restart
+    response = client.get('/posts/1', headers={'If-None-Match': etag})
+    assert response.status_code == 200 and response.headers['ETag'] != etag